@@ -0,0 +1,14 @@
+-- ==========================================
+-- WORK QUEUE LEASES (rag-processing/work_queue.py)
+-- Run once on an existing database:
+--   wrangler d1 execute leukemialens-db --file=schema_work_queue.sql
+-- ==========================================
+
+-- Worker holding the document while it is 'processing', and when that lease
+-- runs out (unix seconds). Expired 'processing' rows are claimable again.
+ALTER TABLE documents ADD COLUMN lease_owner TEXT;
+ALTER TABLE documents ADD COLUMN lease_expires_at INTEGER;
+
+-- Claims select by status and order by id; heartbeats and releases go by owner
+CREATE INDEX IF NOT EXISTS idx_documents_status_id ON documents(status, id);
+CREATE INDEX IF NOT EXISTS idx_documents_lease_owner ON documents(lease_owner);
@@ -0,0 +1,198 @@
+"""
+Extraction Artifact Store
+
+Persists the output of text extraction (text, page breaks, page count and
+metadata) per document, so changing CHUNK_SIZE or CHUNK_OVERLAP only re-runs
+chunking instead of downloading and parsing every document again. Entries are
+keyed by (document id, extraction.PARSER_VERSION): bumping the parser version
+makes every stored artifact a miss. Text is stored zlib-compressed and page
+breaks as a packed int64 array, in a local SQLite file.
+
+Usage:
+    python artifact_store.py                              # Show entry count and size
+    python artifact_store.py --rechunk --chunk-size 400   # Re-chunk every stored artifact locally
+"""
+
+import os
+import time
+import json
+import zlib
+import sqlite3
+import argparse
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+import logging
+
+from extraction import PARSER_VERSION, pack_result, unpack_result
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ARTIFACT_STORE_PATH = Path(__file__).parent / 'data' / 'artifacts.sqlite'
+COMPRESSION_LEVEL = 6
+
+
+# Read on use, not at import: callers import this module before load_dotenv()
+def artifact_store_enabled() -> bool:
+    """Whether ARTIFACT_STORE turns the store on."""
+    return os.getenv('ARTIFACT_STORE', 'false').lower() in ('1', 'true', 'yes')
+
+
+def artifact_store_path() -> Path:
+    return Path(os.getenv('ARTIFACT_STORE_PATH', str(DEFAULT_ARTIFACT_STORE_PATH)))
+
+
+class ArtifactStore:
+    """SQLite-backed store of compressed extraction results."""
+
+    def __init__(self, path: Optional[Path] = None, parser_version: int = PARSER_VERSION):
+        self.path = Path(path) if path is not None else artifact_store_path()
+        self.parser_version = parser_version
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS artifacts (
+                doc_id TEXT NOT NULL,
+                parser_version INTEGER NOT NULL,
+                text BLOB NOT NULL,
+                page_breaks BLOB NOT NULL,
+                page_count INTEGER NOT NULL,
+                metadata TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (doc_id, parser_version)
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, doc_id: str) -> Optional[Dict]:
+        """The stored extraction result for a document (as returned by the parsers), or None."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT text, page_breaks, page_count, metadata FROM artifacts '
+                'WHERE doc_id = ? AND parser_version = ?',
+                (doc_id, self.parser_version)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return _decode(row)
+
+    def put(self, doc_id: str, result: Dict):
+        """Store an extraction result, replacing any earlier one for this parser version."""
+        text, packed_breaks, page_count, metadata = pack_result(result)
+        row = (
+            doc_id, self.parser_version,
+            zlib.compress(text.encode('utf-8'), COMPRESSION_LEVEL),
+            packed_breaks, page_count, json.dumps(metadata), time.time()
+        )
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO artifacts '
+                '(doc_id, parser_version, text, page_breaks, page_count, metadata, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                row
+            )
+            self._conn.commit()
+
+    def items(self) -> Iterator[Tuple[str, Dict]]:
+        """(document id, extraction result) for every artifact of this parser version."""
+        with self._lock:
+            doc_ids = [r[0] for r in self._conn.execute(
+                'SELECT doc_id FROM artifacts WHERE parser_version = ? ORDER BY doc_id', (self.parser_version,)
+            )]
+        for doc_id in doc_ids:
+            result = self.get(doc_id)
+            if result is not None:
+                yield doc_id, result
+
+    def stats(self) -> Dict[int, Tuple[int, int]]:
+        """Parser version -> (artifact count, stored bytes)."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT parser_version, COUNT(*), COALESCE(SUM(LENGTH(text) + LENGTH(page_breaks)), 0) '
+                'FROM artifacts GROUP BY parser_version'
+            ).fetchall()
+        return {version: (count, size) for version, count, size in rows}
+
+    def prune(self) -> int:
+        """Delete artifacts of other parser versions. Returns how many were deleted."""
+        with self._lock:
+            cursor = self._conn.execute('DELETE FROM artifacts WHERE parser_version != ?', (self.parser_version,))
+            self._conn.commit()
+        return cursor.rowcount
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _decode(row) -> Dict:
+    text, packed_breaks, page_count, metadata = row
+    return unpack_result((zlib.decompress(text).decode('utf-8'), packed_breaks, page_count, json.loads(metadata)))
+
+
+_store: Optional[ArtifactStore] = None
+_store_lock = threading.Lock()
+
+
+def get_artifact_store() -> ArtifactStore:
+    """Get or open the shared artifact store."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ArtifactStore()
+                logger.info(f"Artifact store opened: {_store.path} (parser version {_store.parser_version})")
+    return _store
+
+
+def rechunk(store: ArtifactStore, chunk_size: int, overlap: int):
+    """Chunk every stored artifact with the given parameters and print totals (nothing is uploaded)."""
+    from chunker import chunk_text
+
+    start = time.time()
+    documents = chunks = tokens = 0
+    for doc_id, result in store.items():
+        doc_chunks = chunk_text(result['text'], result['page_breaks'], doc_id,
+                                max_chunk_size=chunk_size, overlap=overlap)
+        documents += 1
+        chunks += len(doc_chunks)
+        tokens += sum(c.token_count for c in doc_chunks)
+    elapsed = time.time() - start
+    print(f"Re-chunked {documents} documents in {elapsed:.1f}s: {chunks} chunks, {tokens} tokens "
+          f"({chunks / max(documents, 1):.1f} chunks/document)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect the extraction artifact store')
+    parser.add_argument('--prune', action='store_true', help='Delete artifacts of older parser versions')
+    parser.add_argument('--rechunk', action='store_true', help='Re-chunk every stored artifact and report totals')
+    parser.add_argument('--chunk-size', type=int, default=int(os.getenv('CHUNK_SIZE', '600')))
+    parser.add_argument('--overlap', type=int, default=int(os.getenv('CHUNK_OVERLAP', '100')))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    store = ArtifactStore()
+    if args.prune:
+        print(f"✓ Deleted {store.prune()} artifacts of older parser versions")
+    for version, (count, size) in sorted(store.stats().items()):
+        current = ' (current)' if version == store.parser_version else ''
+        print(f"Parser version {version}{current}: {count} artifacts, {size / 1024**2:.1f} MB")
+    if args.rechunk:
+        rechunk(store, args.chunk_size, args.overlap)
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Asyncio I/O Engine
+
+aiohttp-based client for the network-bound calls of the processing pipeline
+(document downloads, status PATCHes, chunk batch POSTs and D1 queries). One
+event loop keeps hundreds of requests in flight over a shared keep-alive
+connection pool, instead of one blocked OS thread per document.
+
+Timeouts and retry behaviour follow the endpoint policies in http_client.py.
+"""
+
+import asyncio
+from pathlib import Path
+from typing import List, Optional
+import logging
+
+try:
+    import aiohttp
+except ImportError:  # Optional dependency, only needed for --io-concurrency
+    aiohttp = None
+
+from http_client import (
+    ENDPOINTS, RETRY_STATUSES, NOT_PROCESSED_STATUSES, MAX_RETRIES, DATABASE_ID,
+    backoff_delay, api_url, cloudflare_url, cloudflare_headers
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IO_CONCURRENCY = 64
+
+# Bytes read per iteration when streaming a download to disk
+DOWNLOAD_CHUNK_SIZE = 65536
+# Downloaded bytes collected before each file write, which runs off the event loop
+DOWNLOAD_WRITE_SIZE = 1024 * 1024
+
+
+class AsyncApiClient:
+    """
+    Async counterpart of the HTTP helpers in backfill_gpu.py.
+
+    Use as `async with AsyncApiClient(concurrency) as client:`; `concurrency`
+    caps the number of open connections.
+    """
+
+    def __init__(self, concurrency: int = DEFAULT_IO_CONCURRENCY):
+        if aiohttp is None:
+            raise RuntimeError("aiohttp is required for the asyncio I/O engine: pip install aiohttp")
+        self.concurrency = concurrency
+        self._session: Optional['aiohttp.ClientSession'] = None
+
+    async def __aenter__(self) -> 'AsyncApiClient':
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            limit_per_host=self.concurrency,
+            keepalive_timeout=60
+        )
+        self._session = aiohttp.ClientSession(connector=connector)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+
+    async def _request(self, method: str, url: str, endpoint: str, handler, **kwargs):
+        """
+        Send a request with the endpoint's timeout and retry policy.
+
+        `handler` is awaited with the final response while it is still open and
+        its return value is returned.
+        """
+        policy = ENDPOINTS.get(endpoint, ENDPOINTS['default'])
+        connect_timeout, read_timeout = policy.timeout
+        timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        retry_statuses = RETRY_STATUSES if policy.idempotent else NOT_PROCESSED_STATUSES
+
+        for attempt in range(MAX_RETRIES + 1):
+            last_attempt = attempt == MAX_RETRIES
+            try:
+                async with self._session.request(method, url, timeout=timeout, **kwargs) as response:
+                    if response.status not in retry_statuses or last_attempt:
+                        return await handler(response)
+                    retry_after = response.headers.get('Retry-After')
+                    status = response.status
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                # Without a response we only know a non-idempotent call was not sent if connecting failed
+                retryable = policy.idempotent or isinstance(e, aiohttp.ClientConnectorError)
+                if last_attempt or not retryable:
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning(f"{method} {endpoint} failed ({type(e).__name__}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            delay = backoff_delay(attempt, retry_after)
+            logger.warning(f"{method} {endpoint} returned {status}; retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def download_document(self, doc_id: str, output_path: Path) -> bool:
+        """Download document from R2 via API. File writes run in the default executor."""
+        async def handler(response) -> bool:
+            if response.status != 200:
+                logger.error(f"Failed to download {doc_id}: {response.status}")
+                return False
+            loop = asyncio.get_running_loop()
+            f = await loop.run_in_executor(None, open, output_path, 'wb')
+            try:
+                buffer = bytearray()
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    buffer += chunk
+                    if len(buffer) >= DOWNLOAD_WRITE_SIZE:
+                        await loop.run_in_executor(None, f.write, buffer)
+                        buffer.clear()
+                if buffer:
+                    await loop.run_in_executor(None, f.write, buffer)
+            finally:
+                await loop.run_in_executor(None, f.close)
+            return True
+
+        try:
+            return await self._request('GET', api_url(f"/api/documents/{doc_id}/content"), 'download', handler)
+        except Exception as e:
+            logger.error(f"Download error for {doc_id}: {e}")
+            return False
+
+    async def update_document_status(self, doc_id: str, status: str, chunk_count: int = 0,
+                                     error: str = None) -> bool:
+        """Update document status via API."""
+        payload = {'status': status}
+        if chunk_count > 0:
+            payload['chunkCount'] = chunk_count
+        if error:
+            payload['errorMessage'] = error
+
+        async def handler(response) -> bool:
+            return response.status == 200
+
+        try:
+            return await self._request('PATCH', api_url(f"/api/documents/{doc_id}/status"), 'status',
+                                       handler, json=payload)
+        except Exception as e:
+            logger.error(f"Status update error for {doc_id}: {e}")
+            return False
+
+    async def upload_chunks(self, doc_id: str, body: bytes, content_type: str) -> bool:
+        """POST an encoded chunk batch (see chunk_payload.encode_chunk_batch)."""
+        async def handler(response) -> bool:
+            if response.status != 200:
+                logger.error(f"Chunk upload failed: {response.status} - {await response.text()}")
+                return False
+            return True
+
+        try:
+            return await self._request('POST', api_url("/api/chunks/batch"), 'upload', handler,
+                                       data=body, headers={'Content-Type': content_type})
+        except Exception as e:
+            logger.error(f"Chunk upload error for {doc_id}: {e}")
+            return False
+
+    async def query_d1(self, sql: str, params: List = None) -> dict:
+        """Execute a D1 query via Cloudflare API."""
+        async def handler(response) -> dict:
+            data = await response.json(content_type=None)
+            if not data.get('success'):
+                raise Exception(f"D1 query failed: {data.get('errors')}")
+            return data['result'][0]
+
+        return await self._request('POST', cloudflare_url(f"/d1/database/{DATABASE_ID}/query"), 'd1',
+                                   handler, headers=cloudflare_headers(), json={'sql': sql, 'params': params or []})
@@ -6,46 +6,101 @@ Designed to run on a local machine with GPU for initial backfill of documents.
 
 Features:
 - GPU acceleration with automatic detection
-- Resume capability via checkpoint file
+- Resume capability via checkpoint file and per-document journal
 - Progress tracking with ETA
 - Configurable batch sizes
 - Parallel chunk processing
+- Staged pipeline mode (download / parse / embed / upload overlap)
+- Asyncio I/O mode (hundreds of requests in flight on one event loop)
+- Sharded runs across hosts (--shard i/N, see sharding.py)
+- Live throughput and stage latency metrics (--metrics-file, see metrics.py)
+- Per-document timing traces and run profiles (--trace-file, --profile, see profiling.py)
 """
 
 import os
 import sys
 import json
+import asyncio
 import time
 import argparse
 import logging
 import threading
-from typing import List, Optional
-from dataclasses import dataclass, asdict
+from typing import List, Optional, Tuple
+from dataclasses import dataclass, field, fields
 from datetime import datetime
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor
 
-import requests
+import numpy as np
 from dotenv import load_dotenv
 from tqdm import tqdm
 
-from pdf_parser import extract_text_from_pdf
-from xml_parser import extract_text_from_xml
-from chunker import chunk_text
-from embedder import generate_embeddings, get_device, EMBEDDING_DIM, pre_load_model
+from extraction import extract_document, ExtractionPool, DEFAULT_EXTRACT_PROCESSES, PARSER_VERSION
+from blob_cache import BlobCache, get_blob_cache, blob_cache_enabled
+from artifact_store import ArtifactStore, get_artifact_store, artifact_store_enabled
+from work_queue import (
+    WorkQueue, D1WorkQueue, SQLiteWorkQueue, pub_date_range,
+    DEFAULT_LEASE_SECONDS, DEFAULT_CLAIM_SIZE, DEFAULT_QUEUE_DB
+)
+from sharding import Shard, parse_shard, in_shard, shard_path, write_stats, STATS_FILE
+from journal import Journal, JOURNAL_FILE, FSYNC_POLICIES, DEFAULT_FSYNC
+from metrics import get_metrics, MetricsWriter, METRICS_FORMATS, DEFAULT_METRICS_INTERVAL
+from profiling import (
+    DocumentTrace, Profiler, IterationTimer, start_trace, finish_trace, record_span, trace_span, timer,
+    profiled, traced, enable_tracing, disable_tracing, TRACE_FILE, PROFILE_MODE, PROFILE_MODES,
+    DEFAULT_SAMPLE_INTERVAL
+)
+from pdf_parser import iter_pdf_pages
+from status_writer import (
+    StatusWriter, get_status_writer, shutdown_status_writer, DEFAULT_FLUSH_SIZE, DEFAULT_FLUSH_INTERVAL
+)
+from chunker import Chunk, chunk_text, chunk_pages
+from embedder import (
+    generate_embeddings_array, get_device, EMBEDDING_DIM, pre_load_model,
+    get_embedding_service, shutdown_embedding_service, DEFAULT_MAX_BATCH_LATENCY,
+    get_embedding_cache, embedding_cache_enabled
+)
+from chunk_payload import encode_chunk_batch, WIRE_FORMATS
+from http_client import API_BASE_URL, api_url, query_d1, request
+from async_io import AsyncApiClient
+from pipeline import Stage, StagedPipeline, DEFAULT_QUEUE_SIZE, DEFAULT_REPORT_INTERVAL
 
 # Load environment
 load_dotenv()
 
 # Configuration
-CLOUDFLARE_ACCOUNT_ID = os.getenv('CLOUDFLARE_ACCOUNT_ID')
-CLOUDFLARE_API_TOKEN = os.getenv('CLOUDFLARE_API_TOKEN')
-DATABASE_ID = os.getenv('DATABASE_ID')
-API_BASE_URL = os.getenv('API_BASE_URL', 'https://leukemialens-api.jr-rhinehart.workers.dev')
+UPLOAD_FORMAT = os.getenv('UPLOAD_FORMAT', 'json')  # 'json', 'binary' or 'binary-gzip'
 
 # Paths
 CHECKPOINT_FILE = Path(__file__).parent / 'data' / 'backfill_checkpoint.json'
 
+# Set by --micro-batch: embed through the shared cross-document batcher
+USE_EMBEDDING_SERVICE = False
+
+# Set by --extract-processes: run text extraction in worker processes
+EXTRACTION_POOL: Optional[ExtractionPool] = None
+
+# Set by --batch-status: buffer status/study writes and flush them to D1 in batches
+STATUS_WRITER: Optional[StatusWriter] = None
+
+# Set by --blob-cache (or BLOB_CACHE=true): serve downloads from the local blob cache
+BLOB_CACHE: Optional[BlobCache] = None
+
+# Set by --artifacts (or ARTIFACT_STORE=true): reuse stored extraction results and store new ones
+ARTIFACT_STORE: Optional[ArtifactStore] = None
+
+# Set by --work-queue: claim documents under leases instead of polling for pending ones
+WORK_QUEUE: Optional[WorkQueue] = None
+
+# Opened by main(): every status transition is journaled so --resume knows each document's state
+JOURNAL: Optional[Journal] = None
+
+# Live counters and per-stage latencies, written out by --metrics-file
+METRICS = get_metrics()
+
+# Set by --vector-dtype: precision of the vectors sent to /api/chunks/batch
+VECTOR_DTYPE = 'float32'
+
 # Logging
 logging.basicConfig(
     level=logging.INFO,
@@ -74,9 +129,14 @@ class BackfillStats:
     chunks_created: int
     vectors_uploaded: int
     last_document_id: Optional[str]
-    _lock = threading.Lock()
+    # Keyset cursor of a --shard run: every document up to this id has been fetched
+    cursor: Optional[str] = None
+    elapsed_seconds: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
     
     def update(self, success: bool, chunks: int = 0, vectors: int = 0, doc_id: str = None):
+        METRICS.count('documents_processed' if success else 'documents_failed')
+        METRICS.count('chunks', chunks)
         with self._lock:
             if success:
                 self.documents_processed += 1
@@ -90,7 +150,11 @@ class BackfillStats:
     def save(self, path: Path):
         path.parent.mkdir(parents=True, exist_ok=True)
         with open(path, 'w') as f:
-            json.dump(asdict(self), f, indent=2)
+            json.dump(self.to_dict(), f, indent=2)
+    
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {f.name: getattr(self, f.name) for f in fields(self) if f.init}
     
     @classmethod
     def load(cls, path: Path) -> Optional['BackfillStats']:
@@ -101,38 +165,25 @@ class BackfillStats:
             return cls(**data)
 
 
-def query_d1(sql: str, params: List = None) -> dict:
-    """Execute a D1 query via Cloudflare API."""
-    url = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/d1/database/{DATABASE_ID}/query"
-    
-    response = requests.post(
-        url,
-        headers={
-            'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}',
-            'Content-Type': 'application/json'
-        },
-        json={'sql': sql, 'params': params or []}
-    )
-    
-    data = response.json()
-    if not data.get('success'):
-        raise Exception(f"D1 query failed: {data.get('errors')}")
-    
-    return data['result'][0]
-
-
 def get_pending_documents(limit: int = 1000, 
-                          year: Optional[int] = None, month: Optional[int] = None, include_errors: bool = False) -> List[Document]:
-    """Fetch documents with status 'pending', optionally filtered by date."""
+                          year: Optional[int] = None, month: Optional[int] = None, include_errors: bool = False,
+                          after: Optional[str] = None) -> List[Document]:
+    """
+    Fetch documents with status 'pending', optionally filtered by date.
     
-    # 1. First, get a total count for better logging
-    try:
-        count_query = "SELECT COUNT(*) as count FROM documents WHERE status = 'pending'"
-        count_result = query_d1(count_query)
-        total_pending = count_result.get('results', [{}])[0].get('count', 0)
-        logger.info(f"🔍 Total 'pending' documents in database: {total_pending}")
-    except Exception as e:
-        logger.warning(f"Could not fetch total pending count: {e}")
+    With `after`, only documents whose id sorts after it are returned (keyset
+    pagination), so a caller can walk the whole table page by page.
+    """
+    
+    # 1. First, get a total count for better logging (once, not for every page)
+    if after is None:
+        try:
+            count_query = "SELECT COUNT(*) as count FROM documents WHERE status = 'pending'"
+            count_result = query_d1(count_query)
+            total_pending = count_result.get('results', [{}])[0].get('count', 0)
+            logger.info(f"🔍 Total 'pending' documents in database: {total_pending}")
+        except Exception as e:
+            logger.warning(f"Could not fetch total pending count: {e}")
 
     # 2. Build the main query
     base_query = """
@@ -150,20 +201,13 @@ def get_pending_documents(limit: int = 1000,
     if year:
         # If we have a year, we MUST join with studies
         base_query += " JOIN studies s ON s.id = d.study_id"
-        
-        if month:
-            month_str = str(month).zfill(2)
-            import calendar
-            last_day = calendar.monthrange(year, month)[1]
-            conditions.append("s.pub_date >= ?")
-            conditions.append("s.pub_date <= ?")
-            params.append(f"{year}-{month_str}-01")
-            params.append(f"{year}-{month_str}-{last_day}")
-        else:
-            conditions.append("s.pub_date >= ?")
-            conditions.append("s.pub_date <= ?")
-            params.append(f"{year}-01-01")
-            params.append(f"{year}-12-31")
+        conditions.append("s.pub_date >= ?")
+        conditions.append("s.pub_date <= ?")
+        params.extend(pub_date_range(year, month))
+    
+    if after is not None:
+        conditions.append("d.id > ?")
+        params.append(after)
     
     if limit > 0:
         query = f"{base_query} WHERE {' AND '.join(conditions)} ORDER BY d.id LIMIT ?"
@@ -181,58 +225,152 @@ def get_pending_documents(limit: int = 1000,
     return [Document(**row) for row in rows]
 
 
+def get_shard_documents(shard: Shard, limit: int, after: Optional[str] = None,
+                        year: Optional[int] = None, month: Optional[int] = None,
+                        include_errors: bool = False, page_size: int = 1000) -> Tuple[List[Document], Optional[str]]:
+    """
+    Fetch the next `limit` pending documents of one shard (all of them if limit <= 0).
+    
+    D1 cannot hash ids, so pages of `page_size` documents are walked in id
+    order and filtered here. Returns the documents and the cursor to pass as
+    `after` next time: the id of the last document returned, or of the last
+    one scanned once the table is exhausted.
+    """
+    documents = []
+    while True:
+        page = get_pending_documents(page_size, year=year, month=month,
+                                     include_errors=include_errors, after=after)
+        for doc in page:
+            if in_shard(doc.id, shard):
+                documents.append(doc)
+                if len(documents) == limit:
+                    return documents, doc.id
+        if len(page) < page_size:
+            return documents, page[-1].id if page else after
+        after = page[-1].id
+
+
+def recover_journaled_documents(journal: Journal) -> List[Document]:
+    """
+    Reconcile documents left in 'processing' in D1 with the journal of the previous run.
+    
+    Documents the journal shows as finished only lost their status write (e.g.
+    a --batch-status buffer at the crash), so the status is sent again. Those
+    it shows as still 'processing' were in flight and are returned to be redone.
+    Documents the journal does not know belong to other runs and are left alone.
+    """
+    result = query_d1(
+        "SELECT id, pmcid, pmid, study_id, filename, format, r2_key, status "
+        "FROM documents WHERE status = 'processing' ORDER BY id"
+    )
+    redo = []
+    for row in result.get('results', []):
+        entry = journal.get(row['id'])
+        if entry is None:
+            continue
+        if entry.status == 'processing':
+            redo.append(Document(**row))
+        else:
+            update_document_status(row['id'], entry.status, chunk_count=entry.chunk_count, error=entry.error)
+    return redo
+
+
+def skip_finished(documents: List[Document], journal: Journal, include_errors: bool = False) -> List[Document]:
+    """
+    Drop fetched documents the journal already has as finished, sending their lost status again.
+    
+    'error' documents are kept with --include-errors, which asks for them to be retried.
+    """
+    remaining = []
+    for doc in documents:
+        entry = journal.get(doc.id)
+        if entry is None or entry.status == 'processing' or (entry.status == 'error' and include_errors):
+            remaining.append(doc)
+        else:
+            update_document_status(doc.id, entry.status, chunk_count=entry.chunk_count, error=entry.error)
+    return remaining
+
+
+@profiled('download')
 def download_document(doc: Document, output_path: str) -> bool:
-    """Download document from R2 via API."""
+    """Download document from R2 via API, or take it from the blob cache (--blob-cache)."""
+    if BLOB_CACHE is not None and BLOB_CACHE.fetch(doc.id, output_path):
+        return True
     try:
-        response = requests.get(
-            f"{API_BASE_URL}/api/documents/{doc.id}/content",
-            stream=True,
-            timeout=60
-        )
-        
-        if response.status_code != 200:
-            logger.error(f"Failed to download {doc.id}: {response.status_code}")
-            return False
-        
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        with request('GET', api_url(f"/api/documents/{doc.id}/content"),
+                     endpoint='download', stream=True) as response:
+            if response.status_code != 200:
+                logger.error(f"Failed to download {doc.id}: {response.status_code}")
+                return False
+            
+            with open(output_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=65536):
+                    f.write(chunk)
         
+        cache_download(doc, output_path)
         return True
     except Exception as e:
         logger.error(f"Download error for {doc.id}: {e}")
         return False
 
 
+def cache_download(doc: Document, path: str):
+    """Add a freshly downloaded document to the blob cache, if enabled. Failures only cost a re-download later."""
+    if BLOB_CACHE is None:
+        return
+    try:
+        BLOB_CACHE.store(doc.id, path)
+    except Exception as e:
+        logger.warning(f"Blob cache: could not store {doc.id}: {e}")
+
+
 def update_document_status(doc_id: str, status: str, chunk_count: int = 0, error: str = None):
-    """Update document status via API."""
+    """Update document status and journal the transition once it is written (or buffered)."""
+    written = send_document_status(doc_id, status, chunk_count, error)
+    if written and JOURNAL is not None:
+        JOURNAL.record(doc_id, status, chunk_count, error)
+    return written
+
+
+def send_document_status(doc_id: str, status: str, chunk_count: int = 0, error: str = None):
+    """Update document status via API, or buffer it in the status writer (--batch-status)."""
+    if WORK_QUEUE is not None and not queue_status(doc_id, status):
+        return True
+    if STATUS_WRITER is not None:
+        return STATUS_WRITER.update_document_status(doc_id, status, chunk_count, error)
+
     payload = {'status': status}
     if chunk_count > 0:
         payload['chunkCount'] = chunk_count
     if error:
         payload['errorMessage'] = error
     
-    response = requests.patch(
-        f"{API_BASE_URL}/api/documents/{doc_id}/status",
-        json=payload
-    )
+    response = request('PATCH', api_url(f"/api/documents/{doc_id}/status"), endpoint='status', json=payload)
     
     return response.status_code == 200
 
 
-def update_study_metadata(study_id: Optional[int], pmid: Optional[str], pmcid: Optional[str]):
-    """Update study extraction method and processed_at in D1."""
-    method = 'rag_batch_v1'
-    
+def queue_status(doc_id: str, status: str) -> bool:
+    """Tell the work queue about a status change. False if the claim already wrote it ('processing')."""
+    if status == 'processing':
+        return False
+    WORK_QUEUE.finish(doc_id, status)
+    return True
+
+
+STUDY_EXTRACTION_METHOD = 'rag_batch_v1'
+
+
+def study_match_keys(study_id: Optional[int], pmid: Optional[str], pmcid: Optional[str]) -> List[tuple]:
+    """
+    (column, value) pairs identifying a document's row in studies, in the order to try them.
+
+    The study is matched by ID when the document has one, falling back to its
+    source_id (PMID or PMCID).
+    """
+    keys = []
     if study_id:
-        try:
-            query_d1(
-                "UPDATE studies SET extraction_method = ?, processed_at = datetime('now') WHERE id = ?",
-                [method, study_id]
-            )
-            return True
-        except Exception as e:
-            logger.error(f"Failed to update study metadata by ID {study_id}: {e}")
+        keys.append(('id', study_id))
     
     # Fallback to source_id (PMID or PMCID)
     source_id = None
@@ -244,129 +382,427 @@ def update_study_metadata(study_id: Optional[int], pmid: Optional[str], pmcid: O
              source_id = f"PMC{source_id}"
     
     if source_id:
+        keys.append(('source_id', source_id))
+    
+    return keys
+
+
+def study_metadata_updates(study_id: Optional[int], pmid: Optional[str], pmcid: Optional[str]) -> List[tuple]:
+    """D1 statements that mark a study as processed, in the order to try them."""
+    return [
+        (f"UPDATE studies SET extraction_method = ?, processed_at = datetime('now') WHERE {column} = ?",
+         [STUDY_EXTRACTION_METHOD, value])
+        for column, value in study_match_keys(study_id, pmid, pmcid)
+    ]
+
+
+def buffer_study_metadata(study_id: Optional[int], pmid: Optional[str], pmcid: Optional[str]) -> bool:
+    """Hand the study update to the status writer, matched on the first key."""
+    keys = study_match_keys(study_id, pmid, pmcid)
+    if not keys:
+        return False
+    column, value = keys[0]
+    return STATUS_WRITER.mark_study_processed(column, value, STUDY_EXTRACTION_METHOD)
+
+
+def update_study_metadata(study_id: Optional[int], pmid: Optional[str], pmcid: Optional[str]):
+    """Update study extraction method and processed_at in D1."""
+    if STATUS_WRITER is not None:
+        return buffer_study_metadata(study_id, pmid, pmcid)
+
+    for sql, params in study_metadata_updates(study_id, pmid, pmcid):
         try:
-            # We use LIKE for PMC because it might be stored with or without prefix
-            sql = "UPDATE studies SET extraction_method = ?, processed_at = datetime('now') WHERE source_id = ?"
-            query_d1(sql, [method, source_id])
+            query_d1(sql, params)
             return True
         except Exception as e:
-            logger.error(f"Failed to update study metadata by source_id {source_id}: {e}")
+            logger.error(f"Failed to update study metadata ({params[1]}): {e}")
             
     return False
 
 
-def upload_chunks(doc_id: str, chunks: List, embeddings: List[List[float]]) -> bool:
+@profiled('upload')
+def upload_chunks(doc_id: str, chunks: List, embeddings: np.ndarray) -> bool:
     """Upload chunks and embeddings to Cloudflare."""
     try:
-        payload = {
-            'documentId': doc_id,
-            'chunks': [
-                {
-                    'id': chunk.id,
-                    'chunkIndex': chunk.chunk_index,
-                    'content': chunk.content,
-                    'startPage': chunk.start_page,
-                    'endPage': chunk.end_page,
-                    'sectionHeader': chunk.section_header,
-                    'tokenCount': chunk.token_count,
-                    'embedding': embeddings[i]
-                }
-                for i, chunk in enumerate(chunks)
-            ]
-        }
+        # Vectors are written straight from the embedding matrix
+        body, content_type = encode_chunk_batch(doc_id, chunks, embeddings, UPLOAD_FORMAT)
         
-        response = requests.post(
-            f"{API_BASE_URL}/api/chunks/batch",
-            json=payload,
-            timeout=120
+        response = request(
+            'POST', api_url("/api/chunks/batch"), endpoint='upload',
+            data=body,
+            headers={'Content-Type': content_type}
         )
         
         if response.status_code != 200:
             logger.error(f"Chunk upload failed: {response.status_code} - {response.text}")
             return False
         
+        METRICS.count('upload_bytes', len(body))
         return True
     except Exception as e:
         logger.error(f"Chunk upload error: {e}")
         return False
 
 
-def process_document(doc: Document, data_dir: Path, stats: BackfillStats) -> bool:
-    """Process a single document through the full pipeline."""
+@dataclass
+class DocumentWork:
+    """A document moving through the processing steps."""
+    doc: Document
+    file_path: Path
+    text_result: Optional[dict] = None
+    chunks: Optional[List] = None
+    embeddings: Optional[np.ndarray] = None
+    trace: Optional[DocumentTrace] = None
+
+
+def new_work(doc: Document, data_dir: Path) -> DocumentWork:
     # Determine file extension based on format
     file_ext = '.tgz' if doc.format == 'xml' else '.pdf'
-    file_path = data_dir / f"{doc.id}{file_ext}"
-    
-    try:
-        update_document_status(doc.id, 'processing')
-        
-        # Step 1: Download document
-        if not download_document(doc, str(file_path)):
-            update_document_status(doc.id, 'error', error='Download failed')
-            return False
-        
-        # Step 2: Extract text (route based on format)
-        if doc.format == 'xml':
-            text_result = extract_text_from_xml(str(file_path))
-        else:
-            text_result = extract_text_from_pdf(str(file_path))
-            
+    return DocumentWork(doc=doc, file_path=data_dir / f"{doc.id}{file_ext}", trace=start_trace(doc.id))
+
+
+def cleanup_work(work: DocumentWork):
+    if work.file_path.exists():
+        work.file_path.unlink()
+
+
+class StepFailed(Exception):
+    """A processing step failed in an expected way; the message is stored as the document's error."""
+
+
+def fail_work(work: DocumentWork, stats: BackfillStats, error: str):
+    """Record a failed document."""
+    update_document_status(work.doc.id, 'error', error=error)
+    stats.update(False, doc_id=work.doc.id)
+    cleanup_work(work)
+    finish_trace(work.trace, 'error', error)
+
+
+@traced
+def download_step(work: DocumentWork, stats: BackfillStats) -> DocumentWork:
+    """Step 1: mark the document as processing and download it, unless its extracted text is stored."""
+    with timer('status'):
+        update_document_status(work.doc.id, 'processing')
+
+    if ARTIFACT_STORE is not None:
+        work.text_result = ARTIFACT_STORE.get(work.doc.id)
+        if work.text_result is not None:
+            return work
+
+    if not download_document(work.doc, str(work.file_path)):
+        raise StepFailed('Download failed')
+    return work
+
+
+@traced
+def parse_step(work: DocumentWork, stats: BackfillStats) -> DocumentWork:
+    """Steps 2-3: extract text (routed by format) and chunk it."""
+    doc = work.doc
+    text_result = work.text_result
+    work.text_result = None
+
+    if text_result is None:
+        if doc.format == 'pdf' and EXTRACTION_POOL is None and ARTIFACT_STORE is None:
+            work.chunks = stream_pdf_chunks(work)
+            return work
+
+        try:
+            with timer('extract'):
+                if EXTRACTION_POOL is not None:
+                    text_result = EXTRACTION_POOL.extract(str(work.file_path), doc.format)
+                else:
+                    text_result = extract_document(str(work.file_path), doc.format)
+        finally:
+            # The file is no longer needed once extraction has run
+            cleanup_work(work)
+
         if not text_result or not text_result.get('text'):
-            update_document_status(doc.id, 'error', error=f'Text extraction failed ({doc.format})')
-            return False
-        
-        # Step 3: Chunk text
+            raise StepFailed(f'Text extraction failed ({doc.format})')
+        if ARTIFACT_STORE is not None:
+            ARTIFACT_STORE.put(doc.id, text_result)
+
+    with timer('chunk'):
         chunks = chunk_text(
             text=text_result['text'],
             page_breaks=text_result.get('page_breaks', []),
             document_id=doc.id
         )
-        
-        if not chunks:
-            update_document_status(doc.id, 'error', error='Chunking produced no results')
-            return False
-        
-        # Step 4: Generate embeddings (GPU-accelerated)
-        chunk_texts = [c.content for c in chunks]
-        embeddings = generate_embeddings(chunk_texts, show_progress=False)
-        
-        if len(embeddings) != len(chunks):
-            update_document_status(doc.id, 'error', error='Embedding generation mismatch')
-            return False
-        
-        # Validate embedding dimension
-        if len(embeddings[0]) != EMBEDDING_DIM:
-            update_document_status(doc.id, 'error', error=f'Wrong embedding dimension: {len(embeddings[0])} != {EMBEDDING_DIM}')
-            return False
-        
-        # Step 5: Upload to Cloudflare
-        if not upload_chunks(doc.id, chunks, embeddings):
-            update_document_status(doc.id, 'error', error='Upload failed')
-            return False
-        
-        # Step 6: Mark as ready
-        update_document_status(doc.id, 'ready', chunk_count=len(chunks))
-        
-        # Step 7: Update study metadata
+
+    if not chunks:
+        raise StepFailed('Chunking produced no results')
+
+    work.chunks = chunks
+    return work
+
+
+def stream_pdf_chunks(work: DocumentWork) -> List[Chunk]:
+    """
+    Chunk a PDF page by page as it is read, without materializing its full text.
+
+    Only the extraction is streamed: the chunks are collected into a list,
+    because the embed and upload steps take the whole document. Memory still
+    grows with the document's length, by the size of its chunks rather than
+    several copies of its text.
+
+    Used only when extraction runs in the parse thread and --artifacts is off.
+    The extraction pool returns whole documents from its worker processes, and
+    the artifact store needs the full text to store it.
+    """
+    doc = work.doc
+    pages = IterationTimer(iter_pdf_pages(str(work.file_path)))
+    started = time.perf_counter()
+    try:
+        chunks = list(chunk_pages(pages, document_id=doc.id))
+    except Exception as e:
+        logger.exception(f"Error extracting text from {work.file_path}: {e}")
+        raise StepFailed('Text extraction failed (pdf)')
+    finally:
+        # Pages are chunked as they are read: time spent reading them is
+        # extraction, the rest is chunking
+        record_span(work.trace, 'extract', started, pages.seconds)
+        record_span(work.trace, 'chunk', started, time.perf_counter() - started - pages.seconds)
+        cleanup_work(work)
+
+    if not chunks:
+        # No page had any text
+        raise StepFailed('Text extraction failed (pdf)')
+    return chunks
+
+
+@traced
+def embed_step(work: DocumentWork, stats: BackfillStats) -> DocumentWork:
+    """Step 4: generate embeddings (GPU-accelerated)."""
+    chunk_texts = [c.content for c in work.chunks]
+    with timer('embed'):
+        if USE_EMBEDDING_SERVICE:
+            embeddings = get_embedding_service().embed(chunk_texts)
+        else:
+            embeddings = generate_embeddings_array(chunk_texts, show_progress=False)
+
+    if len(embeddings) != len(work.chunks):
+        raise StepFailed('Embedding generation mismatch')
+
+    # Validate embedding dimension
+    if embeddings.shape[1] != EMBEDDING_DIM:
+        raise StepFailed(f'Wrong embedding dimension: {embeddings.shape[1]} != {EMBEDDING_DIM}')
+
+    METRICS.count('embeddings', len(embeddings))
+    work.embeddings = embeddings.astype(VECTOR_DTYPE, copy=False)
+    return work
+
+
+@traced
+def upload_step(work: DocumentWork, stats: BackfillStats) -> DocumentWork:
+    """Steps 5-7: upload chunks, mark ready and update study metadata."""
+    doc = work.doc
+    if not upload_chunks(doc.id, work.chunks, work.embeddings):
+        raise StepFailed('Upload failed')
+
+    with timer('status'):
+        update_document_status(doc.id, 'ready', chunk_count=len(work.chunks))
         update_study_metadata(doc.study_id, doc.pmid, doc.pmcid)
-        
-        # Update stats
-        stats.update(True, chunks=len(chunks), vectors=len(embeddings), doc_id=doc.id)
-        
+
+    stats.update(True, chunks=len(work.chunks), vectors=len(work.embeddings), doc_id=doc.id)
+    finish_trace(work.trace, 'ready')
+    return work
+
+
+PROCESSING_STEPS = (download_step, parse_step, embed_step, upload_step)
+
+
+def process_document(doc: Document, data_dir: Path, stats: BackfillStats) -> bool:
+    """Process a single document through the full pipeline."""
+    work = new_work(doc, data_dir)
+
+    try:
+        for step in PROCESSING_STEPS:
+            step(work, stats)
         return True
-        
+
+    except StepFailed as e:
+        fail_work(work, stats, str(e))
+        return False
+
     except Exception as e:
         logger.exception(f"Error processing {doc.id}: {e}")
         update_document_status(doc.id, 'error', error=str(e))
         stats.update(False, doc_id=doc.id)
+        finish_trace(work.trace, 'error', str(e))
         return False
-    
+
+    finally:
+        cleanup_work(work)
+
+
+async def update_document_status_async(client: AsyncApiClient, doc_id: str, status: str,
+                                      chunk_count: int = 0, error: str = None) -> bool:
+    """
+    Async counterpart of update_document_status().
+
+    Only the API PATCH runs on the event loop. The work queue, the status writer
+    and the journal (which may fsync) block, so they are called from the default
+    executor.
+    """
+    loop = asyncio.get_running_loop()
+    if WORK_QUEUE is not None and not await loop.run_in_executor(None, queue_status, doc_id, status):
+        written = True
+    elif STATUS_WRITER is not None:
+        written = await loop.run_in_executor(
+            None, STATUS_WRITER.update_document_status, doc_id, status, chunk_count, error
+        )
+    else:
+        written = await client.update_document_status(doc_id, status, chunk_count=chunk_count, error=error)
+    if written and JOURNAL is not None:
+        await loop.run_in_executor(None, JOURNAL.record, doc_id, status, chunk_count, error)
+    return written
+
+
+async def process_document_async(doc: Document, data_dir: Path, stats: BackfillStats,
+                                 client: AsyncApiClient, parse_executor: ThreadPoolExecutor,
+                                 embed_executor: ThreadPoolExecutor) -> bool:
+    """
+    Process a single document with async network I/O.
+
+    Downloads, status updates and uploads run on the event loop; parsing and
+    embedding run on executors so they do not block it.
+    """
+    loop = asyncio.get_running_loop()
+    work = new_work(doc, data_dir)
+
+    try:
+        with trace_span(work.trace, 'status'):
+            await update_document_status_async(client, doc.id, 'processing')
+        if ARTIFACT_STORE is not None:
+            work.text_result = await loop.run_in_executor(parse_executor, ARTIFACT_STORE.get, doc.id)
+        cached = work.text_result is not None or (BLOB_CACHE is not None and await loop.run_in_executor(
+            parse_executor, BLOB_CACHE.fetch, doc.id, work.file_path
+        ))
+        if not cached:
+            with trace_span(work.trace, 'download'):
+                downloaded = await client.download_document(doc.id, work.file_path)
+            if not downloaded:
+                raise StepFailed('Download failed')
+            await loop.run_in_executor(parse_executor, cache_download, doc, str(work.file_path))
+
+        await loop.run_in_executor(parse_executor, parse_step, work, stats)
+        await loop.run_in_executor(embed_executor, embed_step, work, stats)
+
+        # Encoding counts as upload time, as in upload_chunks()
+        with trace_span(work.trace, 'upload'):
+            body, content_type = await loop.run_in_executor(
+                parse_executor, encode_chunk_batch, doc.id, work.chunks, work.embeddings, UPLOAD_FORMAT
+            )
+            uploaded = await client.upload_chunks(doc.id, body, content_type)
+        if not uploaded:
+            raise StepFailed('Upload failed')
+        METRICS.count('upload_bytes', len(body))
+
+        with trace_span(work.trace, 'status'):
+            await update_document_status_async(client, doc.id, 'ready', chunk_count=len(work.chunks))
+            if STATUS_WRITER is not None:
+                await loop.run_in_executor(None, buffer_study_metadata, doc.study_id, doc.pmid, doc.pmcid)
+            else:
+                for sql, params in study_metadata_updates(doc.study_id, doc.pmid, doc.pmcid):
+                    try:
+                        await client.query_d1(sql, params)
+                        break
+                    except Exception as e:
+                        logger.error(f"Failed to update study metadata ({params[1]}): {e}")
+
+        stats.update(True, chunks=len(work.chunks), vectors=len(work.embeddings), doc_id=doc.id)
+        finish_trace(work.trace, 'ready')
+        return True
+
+    except StepFailed as e:
+        error = str(e)
+    except Exception as e:
+        logger.exception(f"Error processing {doc.id}: {e}")
+        error = str(e)
+    finally:
+        cleanup_work(work)
+
+    await update_document_status_async(client, doc.id, 'error', error=error)
+    stats.update(False, doc_id=doc.id)
+    finish_trace(work.trace, 'error', error)
+    return False
+
+
+async def process_documents_async(documents: List[Document], data_dir: Path, stats: BackfillStats,
+                                  args, progress: tqdm):
+    """Process a batch of documents with at most --io-concurrency of them in flight."""
+    parse_executor = ThreadPoolExecutor(max_workers=args.parse_workers, thread_name_prefix='parse')
+    # Only one thread calls the model directly; --micro-batch lets several feed the batcher
+    embed_executor = ThreadPoolExecutor(
+        max_workers=args.embed_workers if USE_EMBEDDING_SERVICE else 1,
+        thread_name_prefix='embed'
+    )
+    in_flight = asyncio.Semaphore(args.io_concurrency)
+
+    try:
+        async with AsyncApiClient(args.io_concurrency) as client:
+            async def run(doc: Document):
+                async with in_flight:
+                    await process_document_async(doc, data_dir, stats, client, parse_executor, embed_executor)
+                progress.update(1)
+
+            await asyncio.gather(*(run(doc) for doc in documents))
     finally:
-        if file_path.exists():
-            file_path.unlink()
+        parse_executor.shutdown()
+        embed_executor.shutdown()
+
+
+def documents_as_work(documents: List[Document], data_dir: Path):
+    for doc in documents:
+        yield new_work(doc, data_dir)
+
+
+def build_staged_pipeline(args, stats: BackfillStats, progress: tqdm) -> StagedPipeline:
+    """
+    Build the staged pipeline: download pool -> parse pool -> one embedder -> upload pool.
+
+    Bounded queues between the stages keep the embedder fed while network and
+    parsing work happens in parallel, and stop downloads from racing ahead when
+    the embedder falls behind.
+    """
+    def on_error(work: DocumentWork, e: BaseException):
+        update_document_status(work.doc.id, 'error', error=str(e))
+        stats.update(False, doc_id=work.doc.id)
+        cleanup_work(work)
+        finish_trace(work.trace, 'error', str(e))
+        progress.update(1)
+
+    def run_step(step, last: bool = False):
+        def func(work: DocumentWork) -> Optional[DocumentWork]:
+            try:
+                result = step(work, stats)
+            except StepFailed as e:
+                fail_work(work, stats, str(e))
+                progress.update(1)
+                return None
+            if last:
+                progress.update(1)
+            return result
+        return func
+
+    stages = [
+        Stage('download', run_step(download_step), workers=args.download_workers,
+              queue_size=args.queue_size, on_error=on_error),
+        Stage('parse', run_step(parse_step), workers=args.parse_workers,
+              queue_size=args.queue_size, on_error=on_error),
+        # A single consumer owns the device so encode calls never contend. With
+        # --micro-batch several consumers feed the shared batcher instead.
+        Stage('embed', run_step(embed_step), workers=args.embed_workers if USE_EMBEDDING_SERVICE else 1,
+              queue_size=args.queue_size, on_error=on_error),
+        Stage('upload', run_step(upload_step, last=True), workers=args.upload_workers,
+              queue_size=args.queue_size, on_error=on_error),
+    ]
+    return StagedPipeline(stages, report_interval=args.report_interval)
 
 
 def main():
+    global USE_EMBEDDING_SERVICE, VECTOR_DTYPE, UPLOAD_FORMAT, EXTRACTION_POOL, STATUS_WRITER, BLOB_CACHE, ARTIFACT_STORE
+    global WORK_QUEUE, JOURNAL
+
     parser = argparse.ArgumentParser(description='GPU-optimized RAG backfill processor')
     parser.add_argument('--limit', type=int, default=0, help='Max documents to process (default: 0 for unlimited)')
     parser.add_argument('--year', type=int, help='Filter by publication year')
@@ -374,39 +810,146 @@ def main():
     parser.add_argument('--resume', action='store_true', help='Resume from last checkpoint')
     parser.add_argument('--dry-run', action='store_true', help='List documents without processing')
     parser.add_argument('--clear-checkpoint', action='store_true', help='Clear checkpoint and start fresh')
+    parser.add_argument('--journal-fsync', choices=FSYNC_POLICIES, default=DEFAULT_FSYNC,
+                        help=f'When the resume journal is fsynced: every record, at most once per '
+                             f'JOURNAL_FSYNC_INTERVAL seconds, or never (default: {DEFAULT_FSYNC})')
     parser.add_argument('--workers', type=int, default=1, help='Number of parallel workers (default: 1)')
     parser.add_argument('--include-errors', action='store_true', help='Include documents in error state for reprocessing')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Run download, parse, embed and upload as overlapping stages with bounded queues')
+    parser.add_argument('--download-workers', type=int, default=4, help='Download threads in --pipeline mode (default: 4)')
+    parser.add_argument('--parse-workers', type=int, default=2,
+                        help='Parse/chunk threads in --pipeline or --io-concurrency mode (default: 2)')
+    parser.add_argument('--upload-workers', type=int, default=4, help='Upload threads in --pipeline mode (default: 4)')
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help=f'Capacity of each queue between stages in --pipeline mode (default: {DEFAULT_QUEUE_SIZE})')
+    parser.add_argument('--report-interval', type=float, default=DEFAULT_REPORT_INTERVAL,
+                        help=f'Seconds between stage reports in --pipeline mode (default: {DEFAULT_REPORT_INTERVAL:.0f})')
+    parser.add_argument('--metrics-file', type=Path,
+                        help='Write live counters, rolling rates and stage latency percentiles to this file')
+    parser.add_argument('--metrics-format', choices=METRICS_FORMATS, default='json',
+                        help='Format of --metrics-file; prometheus suits node_exporter\'s textfile collector '
+                             '(default: json)')
+    parser.add_argument('--metrics-interval', type=float, default=DEFAULT_METRICS_INTERVAL,
+                        help=f'Seconds between --metrics-file writes (default: {DEFAULT_METRICS_INTERVAL:g})')
+    parser.add_argument('--trace-file', type=Path, default=TRACE_FILE,
+                        help='Append a JSONL record per document with the time of each step '
+                             '(summarize with profiling.py)')
+    parser.add_argument('--profile', choices=PROFILE_MODES, default=PROFILE_MODE,
+                        help='Profile the run: cprofile (pstats file) or sample (folded stacks for flame graphs)')
+    parser.add_argument('--profile-output', type=Path,
+                        help='Profile file (default: data/profile.prof or data/profile.folded)')
+    parser.add_argument('--profile-interval', type=float, default=DEFAULT_SAMPLE_INTERVAL,
+                        help=f'Seconds between stack samples with --profile sample (default: {DEFAULT_SAMPLE_INTERVAL:g})')
+    parser.add_argument('--io-concurrency', type=int, default=0,
+                        help='Use the asyncio I/O engine with up to N documents in flight (default: 0, off)')
+    parser.add_argument('--embed-workers', type=int, default=4,
+                        help='Embed threads in --pipeline/--io-concurrency mode when --micro-batch is on (default: 4)')
+    parser.add_argument('--micro-batch', action='store_true',
+                        help='Pack chunks from concurrent documents into full embedding batches')
+    parser.add_argument('--max-batch-latency', type=float, default=DEFAULT_MAX_BATCH_LATENCY,
+                        help=f'Seconds a partial embedding batch waits before flushing (default: {DEFAULT_MAX_BATCH_LATENCY})')
+    parser.add_argument('--extract-processes', type=int, default=0,
+                        help=f'Run PDF/XML text extraction in N worker processes (0 = in-thread; '
+                             f'{DEFAULT_EXTRACT_PROCESSES} on this machine leaves one core free)')
+    parser.add_argument('--batch-status', action='store_true',
+                        help='Buffer status updates and write them to D1 in batched statements')
+    parser.add_argument('--status-flush-size', type=int, default=DEFAULT_FLUSH_SIZE,
+                        help=f'Buffered status updates that trigger a flush (default: {DEFAULT_FLUSH_SIZE})')
+    parser.add_argument('--status-flush-interval', type=float, default=DEFAULT_FLUSH_INTERVAL,
+                        help=f'Max seconds a status update stays buffered (default: {DEFAULT_FLUSH_INTERVAL:g})')
+    parser.add_argument('--blob-cache', action='store_true', default=blob_cache_enabled(),
+                        help='Keep downloaded documents in the local blob cache (data/blobs) and reuse them')
+    parser.add_argument('--pin-blobs', action='store_true',
+                        help='Pin the documents of this run in the blob cache so they are never evicted '
+                             '(implies --blob-cache)')
+    parser.add_argument('--artifacts', action='store_true', default=artifact_store_enabled(),
+                        help='Store extracted text per document and reuse it, skipping download and '
+                             'extraction (data/artifacts.sqlite)')
+    parser.add_argument('--work-queue', choices=['d1', 'sqlite'],
+                        help='Claim documents under leases from D1 (needs db/schema_work_queue.sql) or a local '
+                             'SQLite queue, instead of polling for pending documents; safe across hosts')
+    parser.add_argument('--queue-db', type=Path, default=DEFAULT_QUEUE_DB,
+                        help=f'SQLite queue file for --work-queue sqlite (default: {DEFAULT_QUEUE_DB})')
+    parser.add_argument('--claim-size', type=int, default=DEFAULT_CLAIM_SIZE,
+                        help=f'Documents leased per claim (default: {DEFAULT_CLAIM_SIZE})')
+    parser.add_argument('--lease-seconds', type=int, default=DEFAULT_LEASE_SECONDS,
+                        help=f'Lease length; leases are renewed every third of it (default: {DEFAULT_LEASE_SECONDS})')
+    parser.add_argument('--shard', metavar='i/N',
+                        help='Process only shard i (0-based) of N, partitioned by document id hash; each shard '
+                             'has its own checkpoint and stats file (merge with sharding.py)')
+    parser.add_argument('--upload-format', choices=WIRE_FORMATS, default=UPLOAD_FORMAT,
+                        help=f'Wire format for chunk uploads (default: {UPLOAD_FORMAT})')
+    parser.add_argument('--vector-dtype', choices=['float32', 'float16'], default='float32',
+                        help='Precision of vectors sent to the API (default: float32)')
     args = parser.parse_args()
     
+    shard = None
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(f"--shard: {e}")
+        if args.work_queue:
+            parser.error("--shard and --work-queue are alternatives; leases already keep hosts apart")
+    checkpoint_file = shard_path(CHECKPOINT_FILE, shard)
+    journal_file = shard_path(JOURNAL_FILE, shard)
+    
     print("=" * 70)
     print("  LeukemiaLens RAG Backfill - GPU Optimized")
     print("=" * 70)
     print(f"  Device: {get_device()}")
     print(f"  Embedding Model: BAAI/bge-base-en-v1.5 (768-dim)")
     print(f"  API: {API_BASE_URL}")
+    print(f"  Upload: {args.upload_format}, {args.vector_dtype} vectors")
     print(f"  Limit: {'Unlimited' if args.limit <= 0 else args.limit}")
+    if args.extract_processes > 0:
+        print(f"  Extraction: {args.extract_processes} worker processes")
+    if args.batch_status:
+        print(f"  Status writes: batched (every {args.status_flush_size} updates or {args.status_flush_interval:g}s)")
+    if args.blob_cache or args.pin_blobs:
+        print(f"  Blob cache: ON{' (pinning documents)' if args.pin_blobs else ''}")
+    if args.artifacts:
+        print(f"  Extraction artifacts: ON (parser version {PARSER_VERSION})")
+    if args.micro_batch:
+        print(f"  Micro-batching: ON (max latency {args.max_batch_latency * 1000:.0f}ms)")
     if args.year:
         date_str = f"{args.year}-{str(args.month).zfill(2)}" if args.month else str(args.year)
         print(f"  Date Filter: {date_str}")
-    print(f"  Workers: {args.workers}")
+    if args.io_concurrency > 0:
+        print(f"  Async I/O: {args.io_concurrency} documents in flight, parse x{args.parse_workers}")
+    elif args.pipeline:
+        print(f"  Pipeline: download x{args.download_workers} -> parse x{args.parse_workers} "
+              f"-> embed x1 -> upload x{args.upload_workers} (queue {args.queue_size})")
+    else:
+        print(f"  Workers: {args.workers}")
     if args.include_errors:
         print(f"  Include Errors: YES (will retry failed documents)")
+    if args.work_queue:
+        print(f"  Work queue: {args.work_queue} (claims of {args.claim_size}, {args.lease_seconds}s leases)")
+    if shard:
+        print(f"  Shard: {shard[0]}/{shard[1]} (checkpoint {checkpoint_file.name})")
     print("=" * 70)
     
     # Handle checkpoint
-    if args.clear_checkpoint and CHECKPOINT_FILE.exists():
-        CHECKPOINT_FILE.unlink()
+    if args.clear_checkpoint and checkpoint_file.exists():
+        checkpoint_file.unlink()
         print("✓ Cleared checkpoint")
+    if args.clear_checkpoint and journal_file.exists():
+        journal_file.unlink()
+        print("✓ Cleared journal")
     
     # Resume from checkpoint or start fresh
     stats = None
-    resume_after = None
+    cursor = None
     
     if args.resume:
-        stats = BackfillStats.load(CHECKPOINT_FILE)
+        stats = BackfillStats.load(checkpoint_file)
         if stats:
-            resume_after = stats.last_document_id
-            print(f"📍 Resuming after document: {resume_after}")
+            # The journal says which documents are done; the checkpoint keeps the totals
+            print(f"📍 Resuming from checkpoint (last document: {stats.last_document_id})")
+            if shard:
+                cursor = stats.cursor
             print(f"   Previous progress: {stats.documents_processed} processed, {stats.chunks_created} chunks")
     
     if not stats:
@@ -423,17 +966,35 @@ def main():
     data_dir = Path(__file__).parent / 'data'
     data_dir.mkdir(parents=True, exist_ok=True)
     
+    if args.work_queue == 'd1':
+        WORK_QUEUE = D1WorkQueue(lease_seconds=args.lease_seconds)
+    elif args.work_queue == 'sqlite':
+        WORK_QUEUE = SQLiteWorkQueue(args.queue_db, lease_seconds=args.lease_seconds)
+
     # Get pending documents
     status_msg = "pending and error" if args.include_errors else "pending"
     print(f"\n📥 Fetching {status_msg} documents...")
-    documents = get_pending_documents(
-        limit=args.limit, 
-        year=args.year,
-        month=args.month,
-        include_errors=args.include_errors
-    )
+    if WORK_QUEUE is not None:
+        # Look without leasing; claims are made batch by batch below
+        documents = [Document(**row) for row in WORK_QUEUE.peek(
+            args.limit if args.limit > 0 else -1,
+            year=args.year, month=args.month, include_errors=args.include_errors
+        )]
+    elif shard:
+        documents, _ = get_shard_documents(
+            shard, args.limit, after=cursor,
+            year=args.year, month=args.month, include_errors=args.include_errors
+        )
+    else:
+        documents = get_pending_documents(
+            limit=args.limit, 
+            year=args.year,
+            month=args.month,
+            include_errors=args.include_errors
+        )
     
-    if not documents:
+    # On --resume the journal may still list documents that were in flight, which are not 'pending'
+    if not documents and not (args.resume and journal_file.exists()):
         print("✓ No pending documents to process.")
         return
     
@@ -452,9 +1013,61 @@ def main():
     print("\n🚀 Starting processing...\n")
     
     # Pre-load model in main thread to avoid race conditions with meta tensors in multi-threaded initialization
-    if args.workers > 1:
+    if args.workers > 1 or args.pipeline or args.io_concurrency > 0:
         print("📥 Pre-loading embedding model...")
         pre_load_model()
+
+    VECTOR_DTYPE = args.vector_dtype
+    UPLOAD_FORMAT = args.upload_format
+
+    if args.extract_processes > 0:
+        EXTRACTION_POOL = ExtractionPool(args.extract_processes)
+
+    if args.batch_status:
+        STATUS_WRITER = get_status_writer(args.status_flush_size, args.status_flush_interval)
+
+    if args.blob_cache or args.pin_blobs:
+        BLOB_CACHE = get_blob_cache(pin=args.pin_blobs)
+
+    if args.artifacts:
+        ARTIFACT_STORE = get_artifact_store()
+
+    if args.micro_batch:
+        USE_EMBEDDING_SERVICE = True
+        get_embedding_service(max_latency=args.max_batch_latency)
+
+    # The journal follows the checkpoint: kept with --resume, started over otherwise
+    if not args.resume and journal_file.exists():
+        journal_file.unlink()
+    JOURNAL = Journal(journal_file, fsync=args.journal_fsync)
+    redo = []
+    resent = set()
+    if args.resume:
+        counts = JOURNAL.summary()
+        if counts['ready'] or counts['error']:
+            # Exact, unlike the checkpoint, which can be a whole batch behind
+            stats.documents_processed = counts['ready']
+            stats.documents_failed = counts['error']
+            stats.chunks_created = stats.vectors_uploaded = counts['chunks']
+            print(f"📓 Journal: {counts['ready']} ready, {counts['error']} failed, "
+                  f"{counts['processing']} in flight when the last run stopped")
+        if WORK_QUEUE is None and counts['processing']:
+            # With a work queue, expired leases hand these out again
+            redo = recover_journaled_documents(JOURNAL)
+
+    metrics_writer = None
+    if args.metrics_file:
+        metrics_writer = MetricsWriter(METRICS, args.metrics_file, fmt=args.metrics_format,
+                                       interval=args.metrics_interval)
+        print(f"📈 Writing metrics to {args.metrics_file} every {args.metrics_interval:g}s")
+    trace_writer = None
+    if args.trace_file:
+        trace_writer = enable_tracing(args.trace_file)
+        print(f"🔍 Tracing documents to {args.trace_file}")
+    profiler = None
+    if args.profile:
+        profiler = Profiler(args.profile, args.profile_output, interval=args.profile_interval)
+        profiler.start()
     
     start_time = time.time()
     total_docs_requested = args.limit
@@ -463,25 +1076,64 @@ def main():
     while True:
         # Determine fetch limit for this iteration
         # If total_docs_requested is 0, we fetch 1000 at a time to keep D1 responses manageable
-        fetch_limit = 1000 if total_docs_requested <= 0 else min(total_docs_requested, 1000)
+        batch_size = args.claim_size if WORK_QUEUE is not None else 1000
+        fetch_limit = batch_size if total_docs_requested <= 0 else min(total_docs_requested, batch_size)
         
         # Get pending documents
         status_msg = "pending and error" if args.include_errors else "pending"
-        print(f"\n📥 Fetching next {fetch_limit} {status_msg} documents...")
-        documents = get_pending_documents(
-            limit=fetch_limit, 
-            year=args.year,
-            month=args.month,
-            include_errors=args.include_errors
-        )
+        next_cursor = cursor
+        if redo:
+            documents, redo = redo, []
+            print(f"\n♻️  Redoing {len(documents)} documents that were in flight when the last run stopped...")
+        elif WORK_QUEUE is not None:
+            print(f"\n📥 Claiming next {fetch_limit} {status_msg} documents...")
+            documents = [Document(**row) for row in WORK_QUEUE.claim(
+                fetch_limit, year=args.year, month=args.month, include_errors=args.include_errors
+            )]
+        elif shard:
+            # Keyset pagination: the cursor moves past every fetched document, so one that
+            # stays pending or in error is not fetched again and the loop always ends
+            print(f"\n📥 Fetching next {fetch_limit} {status_msg} documents of shard {shard[0]}/{shard[1]}...")
+            documents, next_cursor = get_shard_documents(
+                shard, fetch_limit, after=cursor,
+                year=args.year, month=args.month, include_errors=args.include_errors
+            )
+        else:
+            print(f"\n📥 Fetching next {fetch_limit} {status_msg} documents...")
+            documents = get_pending_documents(
+                limit=fetch_limit, 
+                year=args.year,
+                month=args.month,
+                include_errors=args.include_errors
+            )
         
         if not documents:
             print("✓ No more pending documents found.")
             break
+        
+        fetched = documents
+        documents = skip_finished(fetched, JOURNAL, include_errors=args.include_errors)
+        if len(documents) < len(fetched):
+            skipped = {doc.id for doc in fetched} - {doc.id for doc in documents}
+            print(f"⏭️  Skipping {len(skipped)} documents the journal has as finished")
+            if not documents and skipped <= resent:
+                # Their statuses were sent again last time and they still come back as pending
+                print("⚠️  Could not write the statuses of finished documents; stopping.")
+                break
+            resent |= skipped
             
         print(f"📦 Processing {len(documents)} documents...")
         
-        if args.workers > 1:
+        if args.io_concurrency > 0:
+            with tqdm(total=len(documents), desc="Processing", unit="doc") as progress:
+                asyncio.run(process_documents_async(documents, data_dir, stats, args, progress))
+        elif args.pipeline:
+            with tqdm(total=len(documents), desc="Processing", unit="doc") as progress:
+                pipeline = build_staged_pipeline(args, stats, progress)
+                pipeline.run(documents_as_work(documents, data_dir))
+            for line in pipeline.report_lines():
+                logger.info(line)
+        elif args.workers > 1:
             with ThreadPoolExecutor(max_workers=args.workers) as executor:
                 # Wrap the executor map with tqdm to track overall progress
                 list(tqdm(executor.map(lambda d: process_document(d, data_dir, stats), documents), 
@@ -492,10 +1144,18 @@ def main():
                 
                 # Save checkpoint every 10 documents
                 if (stats.documents_processed + stats.documents_failed) % 10 == 0:
-                    stats.save(CHECKPOINT_FILE)
+                    stats.save(checkpoint_file)
         
+        # Statuses must be in D1 before the next fetch, or it returns these documents again
+        if STATUS_WRITER is not None:
+            STATUS_WRITER.flush()
+
+        if shard:
+            # Only now that the whole batch is done can --resume skip past it
+            cursor = stats.cursor = next_cursor
+
         # Periodic checkpoint save
-        stats.save(CHECKPOINT_FILE)
+        stats.save(checkpoint_file)
         
         # Update remaining count if not unlimited
         if total_docs_requested > 0:
@@ -507,10 +1167,26 @@ def main():
         time.sleep(1)
     
     # Final checkpoint save
-    stats.save(CHECKPOINT_FILE)
+    elapsed = time.time() - start_time
+    stats.elapsed_seconds += elapsed
+    stats.save(checkpoint_file)
+    write_stats(shard_path(STATS_FILE, shard), stats.to_dict(), shard)
+    shutdown_embedding_service()
+    shutdown_status_writer()
+    JOURNAL.close()
+    if metrics_writer is not None:
+        metrics_writer.close()
+    if trace_writer is not None:
+        disable_tracing(trace_writer)
+    if profiler is not None:
+        profiler.stop()
+    if WORK_QUEUE is not None:
+        # After the status writer, so only documents that never got a final status are handed back
+        WORK_QUEUE.close()
+    if EXTRACTION_POOL is not None:
+        EXTRACTION_POOL.close()
     
     # Summary
-    elapsed = time.time() - start_time
     total_attempted = stats.documents_processed + stats.documents_failed
     docs_per_min = total_attempted / (elapsed / 60) if elapsed > 0 else 0
     
@@ -522,6 +1198,28 @@ def main():
     print(f"  📦 Chunks created: {stats.chunks_created}")
     print(f"  🔢 Vectors uploaded: {stats.vectors_uploaded}")
     print(f"  ⏱️  Time elapsed: {elapsed:.1f}s ({docs_per_min:.1f} docs/min)")
+    if embedding_cache_enabled():
+        cache = get_embedding_cache()
+        print(f"  💾 Embedding cache: {cache.hits} hits / {cache.misses} misses ({cache.hit_rate() * 100:.1f}%)")
+    if ARTIFACT_STORE is not None:
+        print(f"  🧾 Extraction artifacts: {ARTIFACT_STORE.hits} reused / {ARTIFACT_STORE.misses} extracted")
+    if BLOB_CACHE is not None:
+        print(f"  🗄️  Blob cache: {BLOB_CACHE.hits} hits / {BLOB_CACHE.misses} misses "
+              f"({BLOB_CACHE.size_bytes() / 1024**2:.1f} MB cached)")
+    if STATUS_WRITER is not None:
+        print(f"  📝 Status writes: {STATUS_WRITER.calls} updates in {STATUS_WRITER.round_trips} round trips "
+              f"({STATUS_WRITER.saved_round_trips} saved)")
+    stage_lines = METRICS.summary_lines()
+    if stage_lines:
+        print("  ⏲️  Stage latency:")
+        for line in stage_lines:
+            print(f"     {line}")
+    if trace_writer is not None:
+        print(f"  🔍 Traces: {trace_writer.records} documents in {trace_writer.path}")
+    if profiler is not None:
+        print(f"  🔬 Profile ({profiler.mode}): {profiler.path}")
+        for line in profiler.summary_lines():
+            print(f"     {line}")
     print("=" * 70)
 
 
@@ -0,0 +1,106 @@
+"""
+Chunker Benchmark
+
+Times chunker.chunk_text on a synthetic 100-page supplement (or a real PDF) and,
+with --compare-ref, against chunker.py as of a git revision. Also reports
+whether both versions produce the same chunk texts and how many page ranges
+differ.
+
+Usage:
+    python benchmarks/bench_chunker.py --pages 100 --compare-ref HEAD~1
+    python benchmarks/bench_chunker.py --pdf data/sample.pdf --repeat 5
+"""
+
+import random
+import argparse
+import logging
+from typing import List, Tuple
+
+from common import load_module_at, best_of
+
+import chunker
+
+WORDS = ("leukemia patients treatment response remission cohort analysis marrow blast cells "
+         "mutation FLT3 NPM1 induction chemotherapy survival relapse transplant median months "
+         "trial arm dose toxicity grade adverse events were observed in the study").split()
+
+# Supplements repeat captions and boilerplate, which is what trips up text.find()
+BOILERPLATE = [
+    "Supplementary Table S1. Baseline characteristics of the study population.",
+    "Data are presented as median (range) unless otherwise indicated.",
+    "Abbreviations: AML, acute myeloid leukemia; CR, complete remission.",
+]
+
+
+def synthetic_document(pages: int, seed: int = 0) -> Tuple[str, List[int]]:
+    """Build a paper-like text of `pages` pages with headers, long paragraphs and repeated boilerplate."""
+    rng = random.Random(seed)
+
+    def sentence() -> str:
+        words = rng.choices(WORDS, k=rng.randint(8, 30))
+        return ' '.join(words).capitalize() + '.'
+
+    parts = []
+    page_breaks = []
+    length = 0
+    for page in range(pages):
+        page_parts = []
+        if page % 10 == 0:
+            page_parts.append(f"{page // 10 + 1}. Supplementary Results")
+        for _ in range(rng.randint(4, 8)):
+            roll = rng.random()
+            if roll < 0.2:
+                page_parts.append(rng.choice(BOILERPLATE))
+            elif roll < 0.3:
+                # Longer than a chunk, so it is split on sentences
+                page_parts.append(' '.join(sentence() for _ in range(rng.randint(60, 120))))
+            else:
+                page_parts.append(' '.join(sentence() for _ in range(rng.randint(2, 10))))
+        page_text = '\n\n'.join(page_parts) + '\n\n'
+        parts.append(page_text)
+        length += len(page_text)
+        page_breaks.append(length)
+
+    return ''.join(parts), page_breaks
+
+
+def pdf_document(path: str) -> Tuple[str, List[int]]:
+    from pdf_parser import extract_text_from_pdf
+    result = extract_text_from_pdf(path)
+    if result is None:
+        raise SystemExit(f"Could not extract {path}")
+    return result['text'], result['page_breaks']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chunker.chunk_text')
+    parser.add_argument('--pages', type=int, default=100, help='Pages of synthetic text (default: 100)')
+    parser.add_argument('--pdf', help='Chunk the text of this PDF instead of synthetic text')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per version; the best is reported')
+    parser.add_argument('--compare-ref', help='Also time chunker.py at this git revision, e.g. HEAD~1')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    text, page_breaks = pdf_document(args.pdf) if args.pdf else synthetic_document(args.pages)
+    print(f"Document: {len(text):,} chars, {len(page_breaks)} pages")
+
+    current, chunks = best_of(lambda: chunker.chunk_text(text, page_breaks, 'bench-doc'), args.repeat)
+    print(f"  working tree: {current * 1000:9.1f} ms  ({len(chunks)} chunks)")
+
+    if args.compare_ref:
+        baseline_chunker = load_module_at(args.compare_ref, 'chunker.py')
+        baseline, ref_chunks = best_of(lambda: baseline_chunker.chunk_text(text, page_breaks, 'bench-doc'), args.repeat)
+        print(f"  {args.compare_ref:>12}: {baseline * 1000:9.1f} ms  ({len(ref_chunks)} chunks)")
+        print(f"  speedup: {baseline / current:.1f}x")
+
+        same_text = [c.content for c in chunks] == [c.content for c in ref_chunks]
+        page_diffs = sum(
+            (a.start_page, a.end_page) != (b.start_page, b.end_page)
+            for a, b in zip(chunks, ref_chunks)
+        )
+        print(f"  identical chunk texts: {same_text}; chunks with different page ranges: {page_diffs}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+"""
+Pipeline Benchmark
+
+Runs each stage of backfill_gpu.py separately (download, extract, chunk,
+embed, upload) and then end to end (process_document) on a fixed local corpus.
+The API is stub_api.py on a local port, so no network or credentials are
+involved. For every stage it reports throughput, per-document latency
+percentiles and peak RSS, and saves the results as JSON so runs at different
+commits can be compared with --compare.
+
+The corpus is generated into a temporary directory and is the same on every
+run for the same options:
+- --pdfs synthetic PDFs of --pages pages (text from bench_chunker.py)
+- one long generated PDF of --long-pages pages
+- the PMC packages in data/*.tgz
+
+Stage inputs come from the previous stage; stages left out with --stages are
+still run once, untimed, when a later stage needs their output. Extract and
+chunk are timed separately here. process_document() streams PDF pages into the
+chunker, so end to end they overlap.
+
+Usage:
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --stages extract chunk --repeat 3
+    python benchmarks/bench_pipeline.py --workers 4 --compare benchmarks/results/bench_pipeline-abc1234-....json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import textwrap
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from common import ROOT, percentiles, reset_peak_rss, peak_rss_bytes, git_revision
+
+from bench_chunker import synthetic_document
+import stub_api
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+STAGES = ('download', 'extract', 'chunk', 'embed', 'upload', 'end_to_end')
+
+# A4 pages of 8pt text
+LINES_PER_PAGE = 80
+LINE_WIDTH = 110
+
+# A stage is flagged by --compare when it gets this much slower
+DEFAULT_THRESHOLD = 0.10
+
+
+@dataclass
+class CorpusFile:
+    doc_id: str
+    format: str  # 'pdf' or 'xml'
+    kind: str    # 'synthetic', 'long' or 'pmc'
+    path: Path
+
+
+def write_pdf(path: Path, pages: int, seed: int):
+    """A PDF of `pages` pages of paper-like text; the same bytes of text for the same seed."""
+    import fitz  # PyMuPDF
+
+    text, page_breaks = synthetic_document(pages, seed)
+    pdf = fitz.open()
+    start = 0
+    for end in page_breaks:
+        lines = []
+        for paragraph in text[start:end].split('\n\n'):
+            lines.extend(textwrap.wrap(paragraph, LINE_WIDTH) + [''])
+        page = pdf.new_page()
+        page.insert_text((36, 40), '\n'.join(lines[:LINES_PER_PAGE]), fontsize=8)
+        start = end
+    pdf.save(str(path))
+    pdf.close()
+
+
+def build_corpus(directory: Path, pdfs: int, pages: int, long_pages: int, packages: List[Path]) -> List[CorpusFile]:
+    """Write the corpus as {id}.pdf / {id}.tgz, the layout stub_api.py serves."""
+    directory.mkdir(parents=True, exist_ok=True)
+    files = []
+    for i in range(pdfs):
+        doc_id = f"bench-pdf-{i:02d}"
+        write_pdf(directory / f"{doc_id}.pdf", pages, seed=i)
+        files.append(CorpusFile(doc_id, 'pdf', 'synthetic', directory / f"{doc_id}.pdf"))
+    if long_pages:
+        write_pdf(directory / 'bench-long.pdf', long_pages, seed=1000)
+        files.append(CorpusFile('bench-long', 'pdf', 'long', directory / 'bench-long.pdf'))
+    for package in packages:
+        doc_id = f"bench-pmc-{package.stem[:8]}"
+        shutil.copyfile(package, directory / f"{doc_id}.tgz")
+        files.append(CorpusFile(doc_id, 'xml', 'pmc', directory / f"{doc_id}.tgz"))
+    return files
+
+
+def measure(items: List[Tuple[str, object]], func: Callable, repeat: int = 1, workers: int = 1,
+            warmup: bool = True) -> Tuple[Dict, Dict[str, object]]:
+    """
+    Run func(item) for every (key, item), `repeat` times, timing each call.
+
+    Returns the stage stats and the outputs of the last run by key. With
+    warmup, the first item runs once untimed beforehand (model and tokenizer
+    loading, connection setup).
+    """
+    if warmup and items:
+        func(items[0][1])
+
+    latencies: List[float] = []
+    outputs: Dict[str, object] = {}
+
+    def timed_call(entry: Tuple[str, object]):
+        key, item = entry
+        started = time.perf_counter()
+        output = func(item)
+        return key, output, time.perf_counter() - started
+
+    reset_peak_rss()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(timed_call, items))
+        else:
+            results = [timed_call(entry) for entry in items]
+        for key, output, seconds in results:
+            outputs[key] = output
+            latencies.append(seconds)
+    elapsed = time.perf_counter() - started
+
+    calls = len(items) * repeat
+    stats = {
+        'documents': len(items),
+        'runs': repeat,
+        'failed': sum(1 for output in outputs.values() if _failed(output)),
+        'seconds': elapsed,
+        'docs_per_sec': calls / elapsed if elapsed > 0 else 0.0,
+        'latency': percentiles(latencies),
+        'peak_rss_mb': peak_rss_bytes() / 1024 ** 2,
+    }
+    return stats, outputs
+
+
+def _failed(output) -> bool:
+    # None/False from the pipeline functions, or an empty result (no text, no chunks)
+    return output is None or output is False or (hasattr(output, '__len__') and len(output) == 0)
+
+
+def run_benchmark(args, files: List[CorpusFile], work_dir: Path, server) -> Dict[str, Dict]:
+    # Imported only now: http_client reads API_BASE_URL (the stub) at import time
+    import backfill_gpu as bg
+    from extraction import extract_document
+    from chunker import chunk_text
+    from embedder import generate_embeddings_array, pre_load_model
+
+    logging.getLogger().setLevel(logging.WARNING)
+    bg.UPLOAD_FORMAT = args.upload_format
+
+    documents = {
+        f.doc_id: bg.Document(id=f.doc_id, pmcid=None, pmid=None, study_id=None, filename=f.path.name,
+                              format=f.format, r2_key=f.path.name, status='pending')
+        for f in files
+    }
+    paths = {f.doc_id: f.path for f in files}
+    selected = set(args.stages)
+    # The end-to-end run needs no stage outputs
+    last = max((STAGES.index(stage) for stage in selected if stage != 'end_to_end'), default=-1)
+
+    def needed(stage: str) -> bool:
+        return stage in selected or STAGES.index(stage) < last
+
+    def repeat_of(stage: str) -> int:
+        return args.repeat if stage in selected else 1
+
+    def new_stats():
+        return bg.BackfillStats(started_at=datetime.now().isoformat(), documents_processed=0,
+                                documents_failed=0, chunks_created=0, vectors_uploaded=0, last_document_id=None)
+
+    stages: Dict[str, Dict] = {}
+
+    if 'download' in selected:
+        def download(doc_id: str) -> bool:
+            doc = documents[doc_id]
+            return bg.download_document(doc, str(work_dir / doc.filename))
+
+        stats, _ = measure([(doc_id, doc_id) for doc_id in documents], download, args.repeat)
+        size = sum(path.stat().st_size for path in paths.values())
+        stats['mb_per_sec'] = size * args.repeat / 1024 ** 2 / stats['seconds']
+        stages['download'] = stats
+        for path in work_dir.iterdir():
+            path.unlink()
+
+    extracted: Dict[str, Optional[dict]] = {}
+    if needed('extract'):
+        stats, extracted = measure(
+            [(doc_id, doc_id) for doc_id in documents],
+            lambda doc_id: extract_document(str(paths[doc_id]), documents[doc_id].format),
+            repeat_of('extract')
+        )
+        chars = sum(len(result['text']) for result in extracted.values() if result)
+        stats['chars_per_sec'] = chars * stats['runs'] / stats['seconds']
+        if 'extract' in selected:
+            stages['extract'] = stats
+
+    chunked: Dict[str, list] = {}
+    if needed('chunk'):
+        stats, chunked = measure(
+            [(doc_id, (doc_id, result)) for doc_id, result in extracted.items() if result],
+            lambda item: chunk_text(item[1]['text'], item[1].get('page_breaks', []), item[0]),
+            repeat_of('chunk')
+        )
+        stats['chunks'] = sum(len(chunks) for chunks in chunked.values())
+        stats['chunks_per_sec'] = stats['chunks'] * stats['runs'] / stats['seconds']
+        if 'chunk' in selected:
+            stages['chunk'] = stats
+
+    embedded: Dict[str, object] = {}
+    if needed('embed'):
+        pre_load_model()
+        stats, embedded = measure(
+            [(doc_id, [c.content for c in chunks]) for doc_id, chunks in chunked.items() if chunks],
+            lambda texts: generate_embeddings_array(texts, show_progress=False),
+            repeat_of('embed')
+        )
+        count = sum(len(embeddings) for embeddings in embedded.values())
+        stats['embeddings_per_sec'] = count * stats['runs'] / stats['seconds']
+        if 'embed' in selected:
+            stages['embed'] = stats
+
+    if 'upload' in selected:
+        before = sum(server.state.snapshot()['bytesReceived'].values())
+        stats, _ = measure(
+            [(doc_id, doc_id) for doc_id in embedded],
+            lambda doc_id: bg.upload_chunks(doc_id, chunked[doc_id],
+                                            embedded[doc_id].astype(bg.VECTOR_DTYPE, copy=False)),
+            args.repeat, warmup=False
+        )
+        sent = sum(server.state.snapshot()['bytesReceived'].values()) - before
+        stats['mb_per_sec'] = sent / 1024 ** 2 / stats['seconds']
+        stats['chunks_per_sec'] = sum(len(chunked[d]) for d in embedded) * args.repeat / stats['seconds']
+        stages['upload'] = stats
+
+    if 'end_to_end' in selected:
+        pre_load_model()
+        # Warm up outside measure(), so the warmup document is not in the chunk count
+        first = next(iter(documents.values()))
+        bg.process_document(first, work_dir, new_stats())
+        backfill_stats = new_stats()
+        stats, _ = measure(
+            [(doc_id, doc) for doc_id, doc in documents.items()],
+            lambda doc: bg.process_document(doc, work_dir, backfill_stats),
+            args.repeat, workers=args.workers, warmup=False
+        )
+        stats['workers'] = args.workers
+        stats['docs_per_min'] = stats['docs_per_sec'] * 60
+        stats['chunks_per_sec'] = backfill_stats.chunks_created / stats['seconds']
+        stages['end_to_end'] = stats
+
+    return stages
+
+
+def environment(args) -> Dict:
+    import embedder
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'device': embedder.get_device(),
+        'embedding_model': embedder.EMBEDDING_MODEL,
+        'upload_format': args.upload_format,
+    }
+
+
+def print_results(results: Dict):
+    print(f"Revision {results['revision']}, {results['environment']['device']}, "
+          f"{len(results['corpus'])} documents")
+    print(f"  {'stage':<11} {'docs/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'peak RSS':>10}  throughput")
+    for stage, s in results['stages'].items():
+        latency = s['latency']
+        extra = ', '.join(f"{s[key]:,.1f} {label}" for key, label in (
+            ('mb_per_sec', 'MB/s'), ('chars_per_sec', 'chars/s'), ('chunks_per_sec', 'chunks/s'),
+            ('embeddings_per_sec', 'embeddings/s'), ('docs_per_min', 'docs/min')) if key in s)
+        failed = f"  ({s['failed']} failed)" if s['failed'] else ''
+        print(f"  {stage:<11} {s['docs_per_sec']:>8.2f} {latency['p50'] * 1000:>7.1f}ms "
+              f"{latency['p95'] * 1000:>7.1f}ms {latency['p99'] * 1000:>7.1f}ms "
+              f"{s['peak_rss_mb']:>8.0f}MB  {extra}{failed}")
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Lines comparing each stage with a baseline run; stages that got slower than `threshold` are flagged."""
+    lines = [f"Compared with {baseline['revision']} ({baseline['timestamp']}):"]
+    if baseline.get('corpus') != results.get('corpus'):
+        lines.append("  ⚠️  The corpus differs; the numbers are not directly comparable")
+    for stage, s in results['stages'].items():
+        base = baseline['stages'].get(stage)
+        if base is None:
+            continue
+        throughput = s['docs_per_sec'] / base['docs_per_sec'] - 1 if base['docs_per_sec'] else 0.0
+        p95 = s['latency']['p95'] / base['latency']['p95'] - 1 if base['latency']['p95'] else 0.0
+        rss = s['peak_rss_mb'] - base['peak_rss_mb']
+        flag = '  ⚠️  slower' if throughput < -threshold or p95 > threshold else ''
+        lines.append(f"  {stage:<11} throughput {throughput * 100:+6.1f}%  p95 {p95 * 100:+6.1f}%  "
+                     f"peak RSS {rss:+6.0f}MB{flag}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the processing pipeline, per stage and end to end')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES),
+                        help='Stages to time (default: all)')
+    parser.add_argument('--pdfs', type=int, default=4, help='Synthetic PDFs (default: 4)')
+    parser.add_argument('--pages', type=int, default=12, help='Pages per synthetic PDF (default: 12)')
+    parser.add_argument('--long-pages', type=int, default=200, help='Pages of the long PDF, 0 for none (default: 200)')
+    parser.add_argument('--packages', nargs='*', type=Path,
+                        help='PMC packages to include (default: data/*.tgz)')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs of each timed stage (default: 1)')
+    parser.add_argument('--workers', type=int, default=1, help='Threads for the end-to-end run (default: 1)')
+    parser.add_argument('--upload-format', choices=['json', 'binary', 'binary-gzip'], default='json',
+                        help='Wire format for uploads (default: json)')
+    parser.add_argument('--output', type=Path,
+                        help=f'Results file (default: {RESULTS_DIR.relative_to(ROOT)}/bench_pipeline-<revision>-<time>.json)')
+    parser.add_argument('--compare', type=Path, help='Earlier results file to compare with')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'Slowdown flagged by --compare, as a fraction (default: {DEFAULT_THRESHOLD:g})')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    packages = sorted((ROOT / 'data').glob('*.tgz')) if args.packages is None else args.packages
+
+    with tempfile.TemporaryDirectory(prefix='bench_pipeline_') as tmp:
+        corpus_dir, work_dir = Path(tmp) / 'corpus', Path(tmp) / 'work'
+        work_dir.mkdir()
+        files = build_corpus(corpus_dir, args.pdfs, args.pages, args.long_pages, packages)
+        if not files:
+            parser.error("the corpus is empty")
+
+        server = stub_api.start_in_thread(documents_dir=corpus_dir)
+        os.environ['API_BASE_URL'] = stub_api.server_url(server)
+        if 'http_client' in sys.modules:
+            raise SystemExit("http_client was imported before the stub URL was set")
+
+        try:
+            stages = run_benchmark(args, files, work_dir, server)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        results = {
+            'benchmark': 'bench_pipeline',
+            'revision': git_revision(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'environment': environment(args),
+            'options': {'repeat': args.repeat, 'workers': args.workers, 'stages': args.stages,
+                        'pdfs': args.pdfs, 'pages': args.pages, 'long_pages': args.long_pages},
+            'corpus': [{'id': f.doc_id, 'kind': f.kind, 'format': f.format} for f in files],
+            'stages': stages,
+        }
+
+    print_results(results)
+
+    output = args.output or RESULTS_DIR / (
+        f"bench_pipeline-{results['revision']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"✓ Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for line in compare(results, baseline, args.threshold):
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Segmentation Microbenchmark
+
+Times segmentation.scan_paragraphs (paragraphs, sentences and section headers
+in one pass) and segmentation.clean_pdf_text on a corpus sample, against the
+per-call functions of chunker.py and pdf_parser.py at a git revision:
+split_into_paragraphs, then detect_section_header and split_into_sentences per
+paragraph, and clean_text per PDF page. Outputs are checked to match.
+
+Corpus files can be .tgz/.nxml (JATS), .pdf or .txt; the default is data/*.tgz
+and data/*.pdf.
+
+Usage:
+    python benchmarks/bench_segmentation.py --compare-ref HEAD~1
+    python benchmarks/bench_segmentation.py --compare-ref HEAD~1 papers/*.pdf --repeat 10
+"""
+
+import argparse
+import logging
+from pathlib import Path
+from typing import List, Tuple
+
+from common import ROOT, load_module_at, best_of
+
+import segmentation
+from extraction import extract_document
+from xml_parser import parse_jats_xml
+
+
+def load_corpus(paths: List[Path]) -> Tuple[List[str], List[str]]:
+    """Extracted document texts, and raw PDF page texts (the input of clean_text)."""
+    texts, raw_pages = [], []
+    for path in paths:
+        if path.suffix == '.pdf':
+            import fitz
+            with fitz.open(path) as doc:
+                raw_pages.extend(page.get_text("text") for page in doc)
+            result = extract_document(str(path), 'pdf')
+        elif path.suffix == '.tgz':
+            result = extract_document(str(path), 'xml')
+        elif path.suffix in ('.nxml', '.xml'):
+            result = parse_jats_xml(str(path))
+        else:
+            result = {'text': path.read_text()}
+        if result:
+            texts.append(result['text'])
+    return texts, raw_pages
+
+
+def segment_scan(texts: List[str]) -> list:
+    return [
+        (p.text, p.header, [s.text for s in p.sentences()])
+        for text in texts for p in segmentation.scan_paragraphs(text)
+    ]
+
+
+def segment_per_call(chunker, texts: List[str]) -> list:
+    return [
+        (p, chunker.detect_section_header(p), chunker.split_into_sentences(p))
+        for text in texts for p in chunker.split_into_paragraphs(text)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark text segmentation')
+    parser.add_argument('files', nargs='*', type=Path, help='Corpus files (default: data/*.tgz, data/*.pdf)')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per version; the best is reported')
+    parser.add_argument('--compare-ref', help='Also time the functions at this git revision, e.g. HEAD~1')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    files = args.files or sorted((ROOT / 'data').glob('*.tgz')) + sorted((ROOT / 'data').glob('*.pdf'))
+    texts, raw_pages = load_corpus(files)
+    chars = sum(len(t) for t in texts)
+    print(f"Corpus: {len(texts)} documents, {chars:,} chars, {len(raw_pages)} raw PDF pages")
+
+    scan_time, scanned = best_of(lambda: segment_scan(texts), args.repeat)
+    clean_time, cleaned = best_of(lambda: [segmentation.clean_pdf_text(p) for p in raw_pages], args.repeat)
+    sentences = sum(len(s) for _, _, s in scanned)
+    print(f"  scan_paragraphs: {scan_time * 1000:8.2f} ms  ({len(scanned)} paragraphs, {sentences} sentences, "
+          f"{chars / scan_time / 1e6:.1f} MB/s)")
+    if raw_pages:
+        print(f"  clean_pdf_text:  {clean_time * 1000:8.2f} ms")
+
+    if args.compare_ref:
+        old_chunker = load_module_at(args.compare_ref, 'chunker.py')
+        old_time, old_segments = best_of(lambda: segment_per_call(old_chunker, texts), args.repeat)
+        print(f"  {args.compare_ref} per-call functions: {old_time * 1000:8.2f} ms "
+              f"(speedup {old_time / scan_time:.1f}x, identical: {old_segments == scanned})")
+
+        if raw_pages:
+            old_parser = load_module_at(args.compare_ref, 'pdf_parser.py')
+            old_clean, old_cleaned = best_of(lambda: [old_parser.clean_text(p) for p in raw_pages], args.repeat)
+            print(f"  {args.compare_ref} clean_text: {old_clean * 1000:8.2f} ms "
+                  f"(speedup {old_clean / clean_time:.1f}x, identical: {old_cleaned == cleaned})")
+
+
+if __name__ == '__main__':
+    main()
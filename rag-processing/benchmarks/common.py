@@ -0,0 +1,98 @@
+"""
+Shared benchmark helpers.
+"""
+
+import sys
+import time
+import resource
+import subprocess
+import importlib.util
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+# rag-processing/, so benchmarks can import the modules they measure
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def load_module_at(ref: str, filename: str):
+    """Import a rag-processing module as it was at a git revision (its own imports resolve to the working tree)."""
+    source = subprocess.run(
+        ['git', 'show', f'{ref}:./{filename}'],
+        cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    name = f"{Path(filename).stem}_{ref.replace('/', '_').replace('~', '_').replace('^', '_')}"
+    path = Path(tempfile.mkdtemp()) / f'{name}.py'
+    path.write_text(source)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def best_of(func: Callable, repeat: int) -> Tuple[float, object]:
+    """Best wall time of `repeat` calls to func(), and the last result."""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Count, mean, p50/p95/p99 (nearest rank) and max of a list of latencies."""
+    if not values:
+        return {'count': 0, 'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return ordered[max(0, min(len(ordered) - 1, int(q * len(ordered) + 0.5) - 1))]
+
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered),
+        'p50': rank(0.50),
+        'p95': rank(0.95),
+        'p99': rank(0.99),
+        'max': ordered[-1],
+    }
+
+
+def reset_peak_rss() -> bool:
+    """Reset the process's peak RSS, so the next peak_rss_bytes() covers one stage. Linux only."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size: since the last reset_peak_rss() on Linux, since process start elsewhere."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def git_revision() -> str:
+    """Short commit hash of the working tree, with '-dirty' if rag-processing has uncommitted changes."""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                                  capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--', '.'], cwd=ROOT, check=True,
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f"{revision}-dirty" if dirty else revision
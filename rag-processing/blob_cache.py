@@ -0,0 +1,284 @@
+"""
+Blob Cache Module
+
+Size-bounded local cache of downloaded documents (PDFs and PMC .tgz packages),
+so retries (--include-errors, reset_errors.py) and re-chunking experiments do
+not download the same files again. Blobs are content-addressed: each is stored
+once under data/blobs/<sha256[:2]>/<sha256>, and a SQLite index maps document
+ids to digests. The digest is re-checked when a blob is read back, and a blob
+that fails the check is dropped and downloaded again.
+
+Least recently used blobs are evicted once the cache exceeds its size limit.
+Pinned blobs are never evicted, which keeps a working set of documents on disk
+while chunker parameters are iterated on.
+
+Usage:
+    python blob_cache.py             # Show size, blob count and pinned count
+    python blob_cache.py --unpin     # Unpin everything, making it evictable again
+"""
+
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from typing import Optional, Union
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOB_CACHE_DIR = Path(__file__).parent / 'data' / 'blobs'
+
+# After eviction the cache is trimmed to this fraction of its limit, so a full
+# cache does not evict on every insert
+EVICT_TARGET = 0.9
+
+_HASH_BLOCK = 1024 * 1024
+
+
+# Settings are read when needed rather than at import time: scripts import this
+# module before calling load_dotenv(), and .env values must still apply
+def blob_cache_enabled() -> bool:
+    """Whether BLOB_CACHE turns the cache on."""
+    return os.getenv('BLOB_CACHE', 'false').lower() in ('1', 'true', 'yes')
+
+
+def blob_cache_dir() -> Path:
+    return Path(os.getenv('BLOB_CACHE_DIR', str(DEFAULT_BLOB_CACHE_DIR)))
+
+
+def blob_cache_max_bytes() -> int:
+    return int(float(os.getenv('BLOB_CACHE_MAX_MB', '10240')) * 1024 * 1024)
+
+
+def file_digest(path: Union[str, Path]) -> str:
+    """SHA-256 of a file's contents, as hex."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BlobCache:
+    """Content-addressed LRU cache of document files, indexed by document id."""
+
+    def __init__(self, root: Optional[Path] = None, max_bytes: Optional[int] = None, pin: bool = False):
+        self.root = Path(root) if root is not None else blob_cache_dir()
+        self.max_bytes = max_bytes if max_bytes is not None else blob_cache_max_bytes()
+        # Pin every blob fetched or stored from now on
+        self.pin = pin
+        self.hits = 0
+        self.misses = 0
+        self.corrupt = 0
+        self._lock = threading.Lock()
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.root / 'index.sqlite'), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                pinned INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id TEXT PRIMARY KEY,
+                digest TEXT NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_blobs_last_access ON blobs(last_access)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_documents_digest ON documents(digest)')
+        self._conn.commit()
+
+        row = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()
+        self._total_bytes = row[0]
+
+    def blob_path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def fetch(self, doc_id: str, output_path: Union[str, Path]) -> bool:
+        """
+        Place a cached copy of a document at output_path. Returns False on a miss.
+
+        The copy is a hard link when the filesystem allows it, so deleting it
+        after processing leaves the cached blob in place.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT digest FROM documents WHERE doc_id = ?', (doc_id,)
+            ).fetchone()
+        if row is None:
+            self._count(hit=False)
+            return False
+
+        digest = row[0]
+        path = self.blob_path(digest)
+        try:
+            if file_digest(path) != digest:
+                logger.warning(f"Blob cache: {doc_id} failed its integrity check, dropping it")
+                with self._lock:
+                    self.corrupt += 1
+                    self._drop(digest)
+                    self._conn.commit()
+                self._count(hit=False)
+                return False
+            _link_or_copy(path, Path(output_path))
+        except FileNotFoundError:
+            # Evicted by another thread since the lookup
+            self._count(hit=False)
+            return False
+
+        with self._lock:
+            self._conn.execute(
+                'UPDATE blobs SET last_access = ?, pinned = MAX(pinned, ?) WHERE digest = ?',
+                (time.time(), int(self.pin), digest)
+            )
+            self._conn.commit()
+        self._count(hit=True)
+        return True
+
+    def store(self, doc_id: str, file_path: Union[str, Path]) -> str:
+        """Add a downloaded document to the cache. Returns its digest."""
+        file_path = Path(file_path)
+        digest = file_digest(file_path)
+        path = self.blob_path(digest)
+        size = file_path.stat().st_size
+
+        with self._lock:
+            exists = self._conn.execute('SELECT 1 FROM blobs WHERE digest = ?', (digest,)).fetchone()
+            if not exists or not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # Write under a temporary name so readers never see a partial blob
+                tmp = path.with_name(f'.{digest}.tmp')
+                _link_or_copy(file_path, tmp)
+                os.replace(tmp, path)
+                if not exists:
+                    self._total_bytes += size
+            self._conn.execute(
+                'INSERT INTO blobs (digest, size, last_access, pinned) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(digest) DO UPDATE SET last_access = excluded.last_access, '
+                'pinned = MAX(pinned, excluded.pinned)',
+                (digest, size, time.time(), int(self.pin))
+            )
+            self._conn.execute(
+                'INSERT OR REPLACE INTO documents (doc_id, digest) VALUES (?, ?)', (doc_id, digest)
+            )
+            self._conn.commit()
+
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+        return digest
+
+    def unpin(self):
+        """Make every blob evictable again."""
+        with self._lock:
+            self._conn.execute('UPDATE blobs SET pinned = 0')
+            self._conn.commit()
+
+    def _drop(self, digest: str):
+        row = self._conn.execute('SELECT size FROM blobs WHERE digest = ?', (digest,)).fetchone()
+        if row:
+            self._total_bytes -= row[0]
+        self._conn.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+        self._conn.execute('DELETE FROM documents WHERE digest = ?', (digest,))
+        try:
+            self.blob_path(digest).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        """Drop least recently used unpinned blobs until the cache is under EVICT_TARGET of its limit."""
+        target = int(self.max_bytes * EVICT_TARGET)
+        doomed = []
+        cursor = self._conn.execute('SELECT digest, size FROM blobs WHERE pinned = 0 ORDER BY last_access')
+        kept = self._total_bytes
+        for digest, size in cursor:
+            if kept <= target:
+                break
+            doomed.append(digest)
+            kept -= size
+        for digest in doomed:
+            self._drop(digest)
+        self._conn.commit()
+        if self._total_bytes > target:
+            logger.warning(f"Blob cache: pinned blobs hold {self._total_bytes / 1024**2:.1f} MB, "
+                           f"over the {self.max_bytes / 1024**2:.0f} MB limit")
+        logger.info(f"Blob cache: evicted {len(doomed)} blobs ({self._total_bytes / 1024**2:.1f} MB kept)")
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def size_bytes(self) -> int:
+        return self._total_bytes
+
+    def counts(self):
+        """(blobs, pinned blobs, documents) in the index."""
+        with self._lock:
+            blobs, pinned = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(pinned), 0) FROM blobs').fetchone()
+            documents = self._conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+        return blobs, pinned, documents
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _link_or_copy(source: Path, target: Path):
+    if target.exists():
+        target.unlink()
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+_blob_cache: Optional[BlobCache] = None
+_blob_cache_lock = threading.Lock()
+
+
+def get_blob_cache(pin: bool = False) -> BlobCache:
+    """Get or open the shared blob cache. `pin` turns on pinning for the rest of the run."""
+    global _blob_cache
+    if _blob_cache is None:
+        with _blob_cache_lock:
+            if _blob_cache is None:
+                _blob_cache = BlobCache()
+                logger.info(f"Blob cache opened: {_blob_cache.root} ({_blob_cache.size_bytes() / 1024**2:.1f} MB)")
+    if pin:
+        _blob_cache.pin = True
+    return _blob_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect the local document blob cache')
+    parser.add_argument('--unpin', action='store_true', help='Unpin all blobs so they can be evicted')
+    args = parser.parse_args()
+
+    cache = BlobCache()
+    if args.unpin:
+        cache.unpin()
+        print("✓ Unpinned all blobs")
+    blobs, pinned, documents = cache.counts()
+    print(f"{cache.root}: {cache.size_bytes() / 1024**2:.1f} MB of {cache.max_bytes / 1024**2:.0f} MB, "
+          f"{blobs} blobs ({pinned} pinned) for {documents} documents")
+    cache.close()
+
+
+if __name__ == '__main__':
+    main()
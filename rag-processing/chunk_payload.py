@@ -0,0 +1,187 @@
+"""
+Chunk Payload Serialization
+
+Builds the request body for `/api/chunks/batch` straight from a contiguous
+numpy embedding matrix, in one of two wire formats:
+
+- JSON: vectors are formatted block by block out of the array buffer, so no
+  per-vector Python lists of floats are created, and each value is written
+  with only as many digits as its dtype can hold.
+- Binary frame: a fixed preamble, a JSON metadata header and the raw
+  little-endian vector block, optionally gzip-compressed.
+
+Binary frame layout (all integers little-endian):
+
+    offset  size  field
+    0       4     magic b'LLCB'
+    4       1     version (1)
+    5       1     vector dtype (1 = float32, 2 = float16)
+    6       1     compression (0 = none, 1 = gzip)
+    7       1     reserved (0)
+    8       4     header length in bytes (uncompressed)
+    12      4     vector block length in bytes (uncompressed)
+    16      ...   body: header JSON (space-padded to a multiple of 4 bytes)
+                  followed by the vector block; gzip-compressed as a whole
+                  when compression = 1
+
+The header is {"documentId": str, "dimension": int, "chunks": [...]} with the
+same chunk fields as the JSON format minus "embedding"; row i of the vector
+block belongs to chunk i.
+"""
+
+import io
+import gzip
+import json
+import struct
+from typing import Iterator, List, Sequence, Tuple, Union
+
+import numpy as np
+
+# Significant digits needed to round-trip each dtype through decimal text
+VECTOR_FORMATS = {
+    'float32': '%.9g',
+    'float16': '%.5g',
+}
+
+# Rows formatted per numpy call while streaming
+ROWS_PER_BLOCK = 64
+
+JSON_CONTENT_TYPE = 'application/json'
+FRAME_CONTENT_TYPE = 'application/vnd.leukemialens.chunk-batch'
+FRAME_MAGIC = b'LLCB'
+FRAME_VERSION = 1
+FRAME_PREAMBLE = struct.Struct('<4sBBBBII')
+FRAME_DTYPES = {1: np.dtype('<f4'), 2: np.dtype('<f2')}
+FRAME_DTYPE_CODES = {'float32': 1, 'float16': 2}
+COMPRESSION_NONE = 0
+COMPRESSION_GZIP = 1
+
+# Upload wire formats accepted by encode_chunk_batch()
+WIRE_FORMATS = ('json', 'binary', 'binary-gzip')
+
+
+def as_embedding_matrix(embeddings: Union[np.ndarray, Sequence[Sequence[float]]]) -> np.ndarray:
+    """Accept a numpy matrix or legacy list-of-lists and return a contiguous matrix."""
+    if isinstance(embeddings, np.ndarray) and embeddings.dtype in (np.float16, np.float32):
+        return np.ascontiguousarray(embeddings)
+    return np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32))
+
+
+def chunk_metadata(chunk) -> dict:
+    """API field names for a chunk, without its embedding."""
+    return {
+        'id': chunk.id,
+        'chunkIndex': chunk.chunk_index,
+        'content': chunk.content,
+        'startPage': chunk.start_page,
+        'endPage': chunk.end_page,
+        'sectionHeader': chunk.section_header,
+        'tokenCount': chunk.token_count,
+    }
+
+
+def iter_vector_rows(embeddings: np.ndarray) -> Iterator[bytes]:
+    """Yield each row as comma-separated decimal text."""
+    fmt = VECTOR_FORMATS.get(embeddings.dtype.name, VECTOR_FORMATS['float32'])
+    for start in range(0, len(embeddings), ROWS_PER_BLOCK):
+        buf = io.BytesIO()
+        np.savetxt(buf, embeddings[start:start + ROWS_PER_BLOCK], fmt=fmt, delimiter=',')
+        yield from buf.getvalue().splitlines()
+
+
+def iter_chunk_batch_json(document_id: str, chunks: List, embeddings) -> Iterator[bytes]:
+    """Stream the JSON body for `/api/chunks/batch`."""
+    matrix = as_embedding_matrix(embeddings)
+    if len(matrix) != len(chunks):
+        raise ValueError(f"Got {len(matrix)} embeddings for {len(chunks)} chunks")
+
+    yield b'{"documentId":' + json.dumps(document_id).encode('utf-8') + b',"chunks":['
+    for i, (chunk, row) in enumerate(zip(chunks, iter_vector_rows(matrix))):
+        meta = json.dumps(chunk_metadata(chunk), ensure_ascii=False).encode('utf-8')
+        # Splice the embedding in before the closing brace of the metadata object
+        yield (b',' if i else b'') + meta[:-1] + b',"embedding":[' + row + b']}'
+    yield b']}'
+
+
+def encode_chunk_batch_json(document_id: str, chunks: List, embeddings) -> bytes:
+    """Complete JSON body as one buffer (re-sendable, unlike a generator body)."""
+    return b''.join(iter_chunk_batch_json(document_id, chunks, embeddings))
+
+
+def encode_chunk_batch_binary(document_id: str, chunks: List, embeddings, compress: bool = False) -> bytes:
+    """Binary frame body for `/api/chunks/batch` (see module docstring for the layout)."""
+    matrix = as_embedding_matrix(embeddings)
+    if len(matrix) != len(chunks):
+        raise ValueError(f"Got {len(matrix)} embeddings for {len(chunks)} chunks")
+
+    dtype_code = FRAME_DTYPE_CODES[matrix.dtype.name]
+    dimension = matrix.shape[1] if matrix.ndim == 2 else 0
+    header = json.dumps({
+        'documentId': document_id,
+        'dimension': dimension,
+        'chunks': [chunk_metadata(c) for c in chunks],
+    }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    # Pad so the vector block starts 4-byte aligned for typed-array views
+    header += b' ' * (-len(header) % 4)
+
+    # Native little-endian, contiguous: the block is the array buffer itself
+    vectors = memoryview(np.ascontiguousarray(matrix, dtype=FRAME_DTYPES[dtype_code])).cast('B')
+
+    preamble = FRAME_PREAMBLE.pack(
+        FRAME_MAGIC, FRAME_VERSION, dtype_code,
+        COMPRESSION_GZIP if compress else COMPRESSION_NONE, 0,
+        len(header), len(vectors)
+    )
+
+    if not compress:
+        return b''.join((preamble, header, vectors))
+
+    buf = io.BytesIO()
+    buf.write(preamble)
+    # Level 6 is the usual size/speed balance; vectors compress poorly, metadata well
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6, mtime=0) as gz:
+        gz.write(header)
+        gz.write(vectors)
+    return buf.getvalue()
+
+
+def decode_chunk_batch_binary(data: bytes) -> Tuple[str, List[dict], np.ndarray]:
+    """Parse a binary frame into (document_id, chunk metadata, embedding matrix)."""
+    if len(data) < FRAME_PREAMBLE.size:
+        raise ValueError("Chunk batch frame is truncated")
+
+    magic, version, dtype_code, compression, _, header_len, vectors_len = FRAME_PREAMBLE.unpack_from(data)
+    if magic != FRAME_MAGIC:
+        raise ValueError("Not a chunk batch frame")
+    if version != FRAME_VERSION:
+        raise ValueError(f"Unsupported chunk batch frame version: {version}")
+    if dtype_code not in FRAME_DTYPES:
+        raise ValueError(f"Unsupported vector dtype code: {dtype_code}")
+
+    body = memoryview(data)[FRAME_PREAMBLE.size:]
+    if compression == COMPRESSION_GZIP:
+        body = memoryview(gzip.decompress(body))
+    elif compression != COMPRESSION_NONE:
+        raise ValueError(f"Unsupported compression: {compression}")
+
+    if len(body) != header_len + vectors_len:
+        raise ValueError(f"Frame body is {len(body)} bytes, expected {header_len + vectors_len}")
+
+    header = json.loads(bytes(body[:header_len]).decode('utf-8'))
+    chunks = header['chunks']
+    dimension = header['dimension']
+    vectors = np.frombuffer(body[header_len:], dtype=FRAME_DTYPES[dtype_code])
+    if vectors.size != len(chunks) * dimension:
+        raise ValueError(f"Vector block holds {vectors.size} values, expected {len(chunks)} x {dimension}")
+
+    return header['documentId'], chunks, vectors.reshape(len(chunks), dimension)
+
+
+def encode_chunk_batch(document_id: str, chunks: List, embeddings, wire_format: str = 'json') -> Tuple[bytes, str]:
+    """Body and Content-Type for `/api/chunks/batch` in the given wire format."""
+    if wire_format == 'json':
+        return encode_chunk_batch_json(document_id, chunks, embeddings), JSON_CONTENT_TYPE
+    if wire_format in ('binary', 'binary-gzip'):
+        body = encode_chunk_batch_binary(document_id, chunks, embeddings, compress=wire_format == 'binary-gzip')
+        return body, FRAME_CONTENT_TYPE
+    raise ValueError(f"Unknown wire format: {wire_format} (expected one of {', '.join(WIRE_FORMATS)})")
@@ -5,22 +5,25 @@ Splits extracted text into semantic chunks suitable for embedding and retrieval.
 Uses sentence boundaries, paragraph structure, and section headers.
 """
 
-import re
 import os
 import uuid
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional, Tuple
 from dataclasses import dataclass
 import logging
 
+from page_index import PageIndex, PageText, PAGE_SEPARATOR
+from segmentation import (
+    Span, Paragraph, PARAGRAPH_BREAK, SENTENCE_BREAK, split_spans, section_header, scan_paragraphs
+)
+# estimate_tokens is re-exported for callers of the old chunker-level estimate
+from token_counter import TokenCounter, get_token_counter, estimate_tokens, MAX_CHUNK_TOKENS
+
 logger = logging.getLogger(__name__)
 
 # Configuration
-CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', '600'))  # Target tokens per chunk
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', '600'))  # Target tokens per chunk, capped at MAX_CHUNK_TOKENS
 CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', '100'))  # Overlap tokens
 
-# Simple tokenization (approximation: 1 token ≈ 4 characters)
-CHARS_PER_TOKEN = 4
-
 
 @dataclass
 class Chunk:
@@ -32,49 +35,29 @@ class Chunk:
     end_page: int
     section_header: Optional[str]
     token_count: int
-
-
-def estimate_tokens(text: str) -> int:
-    """Estimate token count from text."""
-    return len(text) // CHARS_PER_TOKEN
+    start_char: int = 0  # Offset of the chunk's first character in the source text
+    end_char: int = 0  # Offset just past its last character
 
 
 def find_page_for_position(position: int, page_breaks: List[int]) -> int:
-    """Find which page a character position falls on."""
-    for i, break_pos in enumerate(page_breaks):
-        if position < break_pos:
-            return i + 1
-    return len(page_breaks)
+    """Find which page a character position falls on. Build a PageIndex to look up many positions."""
+    return PageIndex(page_breaks).page_at(position)
 
 
 def split_into_sentences(text: str) -> List[str]:
     """Split text into sentences."""
     # Simple sentence splitting on common boundaries
-    sentences = re.split(r'(?<=[.!?])\s+(?=[A-Z])', text)
-    return [s.strip() for s in sentences if s.strip()]
+    return [span.text for span in split_spans(text, SENTENCE_BREAK)]
 
 
 def split_into_paragraphs(text: str) -> List[str]:
     """Split text into paragraphs."""
-    paragraphs = re.split(r'\n\s*\n', text)
-    return [p.strip() for p in paragraphs if p.strip()]
+    return [span.text for span in split_spans(text, PARAGRAPH_BREAK)]
 
 
 def detect_section_header(text: str) -> Optional[str]:
     """Check if text starts with a section header."""
-    first_line = text.split('\n')[0].strip()
-    
-    # Common academic paper sections
-    section_patterns = [
-        r'^(?:Abstract|Introduction|Background|Methods?|Materials?\s+and\s+Methods?|Results?|Discussion|Conclusions?|References|Acknowledgements?)\s*$',
-        r'^\d+\.?\s+[A-Z][A-Za-z\s]+$',
-    ]
-    
-    for pattern in section_patterns:
-        if re.match(pattern, first_line, re.IGNORECASE):
-            return first_line
-    
-    return None
+    return section_header(text)
 
 
 def chunk_text(
@@ -82,7 +65,8 @@ def chunk_text(
     page_breaks: List[int],
     document_id: str,
     max_chunk_size: int = CHUNK_SIZE,
-    overlap: int = CHUNK_OVERLAP
+    overlap: int = CHUNK_OVERLAP,
+    counter: Optional[TokenCounter] = None
 ) -> List[Chunk]:
     """
     Split text into overlapping chunks.
@@ -92,147 +76,176 @@ def chunk_text(
     2. Merge small paragraphs until target size
     3. Split large paragraphs on sentences
     4. Add overlap between chunks
+
+    Paragraphs and sentences carry their offsets in `text` from a single scan
+    (segmentation.scan_paragraphs), so chunk offsets and pages are exact (also
+    for repeated passages) and the document is never re-searched.
+
+    Sizes are counted with the embedding model's tokenizer (see token_counter.py)
+    and capped at MAX_CHUNK_TOKENS, so no chunk is truncated by the model. A
+    sentence longer than that on its own is cut at token boundaries.
+    """
+    chunks = list(iter_chunks(
+        [scan_paragraphs(text)], PageIndex(page_breaks), document_id, max_chunk_size, overlap, counter
+    ))
+    logger.info(f"Created {len(chunks)} chunks from {len(text)} characters")
+    return chunks
+
+
+def chunk_pages(
+    pages: Iterable[PageText],
+    document_id: str,
+    max_chunk_size: int = CHUNK_SIZE,
+    overlap: int = CHUNK_OVERLAP,
+    counter: Optional[TokenCounter] = None
+) -> Iterator[Chunk]:
+    """
+    Chunk a stream of pages (e.g. pdf_parser.iter_pdf_pages) as it arrives.
+
+    Yields the same chunks as chunk_text() on the joined document, but only the
+    current page and the open chunk are held, never the whole text.
+    """
+    page_index = PageIndex([])
+
+    def paragraph_batches() -> Iterator[List[Paragraph]]:
+        for page in pages:
+            page_index.add_page(page.start + len(page.text) + len(PAGE_SEPARATOR))
+            yield scan_paragraphs(page.text, offset=page.start)
+
+    yield from iter_chunks(paragraph_batches(), page_index, document_id, max_chunk_size, overlap, counter)
+
+
+def iter_chunks(
+    paragraph_batches: Iterable[List[Paragraph]],
+    pages: PageIndex,
+    document_id: str,
+    max_chunk_size: int = CHUNK_SIZE,
+    overlap: int = CHUNK_OVERLAP,
+    counter: Optional[TokenCounter] = None
+) -> Iterator[Chunk]:
     """
-    chunks = []
-    paragraphs = split_into_paragraphs(text)
+    The chunking loop behind chunk_text() and chunk_pages().
+
+    Consumes paragraphs in document order, one batch at a time (token counts
+    are computed per batch), and yields each chunk as soon as it is complete.
+    `pages` must cover every paragraph received so far.
+    """
+    counter = counter or get_token_counter()
+    max_chunk_size = min(max_chunk_size, MAX_CHUNK_TOKENS)
+    chunk_index = 0
     
-    current_chunk = []
+    # (span, token count) pairs
+    current_chunk: List[Tuple[Span, int]] = []
     current_tokens = 0
     current_section = None
-    chunk_index = 0
     
-    for para in paragraphs:
-        para_tokens = estimate_tokens(para)
-        
-        # Check for section header
-        header = detect_section_header(para)
-        if header:
-            current_section = header
+    def make_chunk(parts: List[Tuple[Span, int]], separator: str) -> Chunk:
+        nonlocal chunk_index
+        content = separator.join(span.text for span, _ in parts)
+        start, end = parts[0][0].start, parts[-1][0].end
+        chunk_index += 1
+        return Chunk(
+            id=str(uuid.uuid4()),
+            document_id=document_id,
+            chunk_index=chunk_index - 1,
+            content=content,
+            start_page=pages.page_at(start),
+            end_page=pages.page_at(end),
+            section_header=current_section,
+            # Estimates are taken on the joined text. Exact counts of the parts add
+            # up to the joined text's (WordPiece splits on the whitespace between
+            # them), which saves tokenizing every chunk a second time
+            token_count=sum(tokens for _, tokens in parts) if counter.exact else counter.count(content),
+            start_char=start,
+            end_char=end
+        )
+    
+    for paragraphs in paragraph_batches:
+        # Oversized paragraphs only need to be known as such; they are counted by sentence
+        para_counts = counter.count_many([para.text for para in paragraphs], limit=max_chunk_size)
+        for para, para_tokens in zip(paragraphs, para_counts):
+            # Check for section header
+            if para.header:
+                current_section = para.header
         
-        # If single paragraph exceeds chunk size, split on sentences
-        if para_tokens > max_chunk_size:
-            # Flush current chunk first
-            if current_chunk:
-                chunk_text = '\n\n'.join(current_chunk)
-                chunk_start = text.find(current_chunk[0])
-                chunk_end = text.find(current_chunk[-1]) + len(current_chunk[-1])
-                
-                chunks.append(Chunk(
-                    id=str(uuid.uuid4()),
-                    document_id=document_id,
-                    chunk_index=chunk_index,
-                    content=chunk_text,
-                    start_page=find_page_for_position(chunk_start, page_breaks),
-                    end_page=find_page_for_position(chunk_end, page_breaks),
-                    section_header=current_section,
-                    token_count=estimate_tokens(chunk_text)
-                ))
-                chunk_index += 1
-                current_chunk = []
-                current_tokens = 0
+            # If single paragraph exceeds chunk size, split on sentences
+            if para_tokens > max_chunk_size:
+                # Flush current chunk first
+                if current_chunk:
+                    yield make_chunk(current_chunk, '\n\n')
+                    current_chunk = []
+                    current_tokens = 0
             
-            # Split large paragraph into sentences
-            sentences = split_into_sentences(para)
-            sentence_chunk = []
-            sentence_tokens = 0
+                # Split large paragraph into sentences
+                sentence_chunk: List[Tuple[Span, int]] = []
+                sentence_tokens = 0
             
-            for sent in sentences:
-                sent_tokens = estimate_tokens(sent)
-                
-                if sentence_tokens + sent_tokens > max_chunk_size and sentence_chunk:
-                    chunk_text = ' '.join(sentence_chunk)
-                    chunk_start = text.find(sentence_chunk[0])
-                    
-                    chunks.append(Chunk(
-                        id=str(uuid.uuid4()),
-                        document_id=document_id,
-                        chunk_index=chunk_index,
-                        content=chunk_text,
-                        start_page=find_page_for_position(chunk_start, page_breaks),
-                        end_page=find_page_for_position(chunk_start + len(chunk_text), page_breaks),
-                        section_header=current_section,
-                        token_count=estimate_tokens(chunk_text)
-                    ))
-                    chunk_index += 1
+                for sent, sent_tokens in sentence_parts(para, max_chunk_size, counter):
+                    if sentence_tokens + sent_tokens > max_chunk_size and sentence_chunk:
+                        yield make_chunk(sentence_chunk, ' ')
                     
-                    # Overlap: keep last few sentences
-                    overlap_tokens = 0
-                    overlap_start = len(sentence_chunk)
-                    for i in range(len(sentence_chunk) - 1, -1, -1):
-                        overlap_tokens += estimate_tokens(sentence_chunk[i])
-                        if overlap_tokens >= overlap:
-                            overlap_start = i
-                            break
+                        # Overlap: keep last few sentences, as long as the next one still fits
+                        overlap_tokens = 0
+                        overlap_start = len(sentence_chunk)
+                        for i in range(len(sentence_chunk) - 1, -1, -1):
+                            overlap_tokens += sentence_chunk[i][1]
+                            if overlap_tokens >= overlap:
+                                overlap_start = i
+                                break
                     
-                    sentence_chunk = sentence_chunk[overlap_start:]
-                    sentence_tokens = sum(estimate_tokens(s) for s in sentence_chunk)
+                        sentence_chunk = sentence_chunk[overlap_start:]
+                        sentence_tokens = sum(tokens for _, tokens in sentence_chunk)
+                        while sentence_chunk and sentence_tokens + sent_tokens > max_chunk_size:
+                            sentence_tokens -= sentence_chunk.pop(0)[1]
                 
-                sentence_chunk.append(sent)
-                sentence_tokens += sent_tokens
+                    sentence_chunk.append((sent, sent_tokens))
+                    sentence_tokens += sent_tokens
             
-            # Add remaining sentences
-            if sentence_chunk:
-                chunk_text = ' '.join(sentence_chunk)
-                chunk_start = text.find(sentence_chunk[0])
-                
-                current_chunk = [chunk_text]
-                current_tokens = estimate_tokens(chunk_text)
+                # Add remaining sentences
+                if sentence_chunk:
+                    remainder = ' '.join(sent.text for sent, _ in sentence_chunk)
+                    current_chunk = [(Span(remainder, sentence_chunk[0][0].start, sentence_chunk[-1][0].end), sentence_tokens)]
+                    current_tokens = sentence_tokens
         
-        # Normal paragraph - add to current chunk
-        elif current_tokens + para_tokens > max_chunk_size and current_chunk:
-            # Save current chunk
-            chunk_text = '\n\n'.join(current_chunk)
-            chunk_start = text.find(current_chunk[0])
-            chunk_end = text.find(current_chunk[-1]) + len(current_chunk[-1])
-            
-            chunks.append(Chunk(
-                id=str(uuid.uuid4()),
-                document_id=document_id,
-                chunk_index=chunk_index,
-                content=chunk_text,
-                start_page=find_page_for_position(chunk_start, page_breaks),
-                end_page=find_page_for_position(chunk_end, page_breaks),
-                section_header=current_section,
-                token_count=estimate_tokens(chunk_text)
-            ))
-            chunk_index += 1
+            # Normal paragraph - add to current chunk
+            elif current_tokens + para_tokens > max_chunk_size and current_chunk:
+                # Save current chunk
+                yield make_chunk(current_chunk, '\n\n')
             
-            # Start new chunk with overlap
-            overlap_paras = []
-            overlap_tokens = 0
-            for p in reversed(current_chunk):
-                p_tokens = estimate_tokens(p)
-                if overlap_tokens + p_tokens > overlap:
-                    break
-                overlap_paras.insert(0, p)
-                overlap_tokens += p_tokens
+                # Start new chunk with overlap
+                overlap_paras = []
+                overlap_tokens = 0
+                for p, p_tokens in reversed(current_chunk):
+                    if overlap_tokens + p_tokens > overlap or overlap_tokens + p_tokens + para_tokens > max_chunk_size:
+                        break
+                    overlap_paras.insert(0, (p, p_tokens))
+                    overlap_tokens += p_tokens
             
-            current_chunk = overlap_paras + [para]
-            current_tokens = overlap_tokens + para_tokens
-        else:
-            current_chunk.append(para)
-            current_tokens += para_tokens
+                current_chunk = overlap_paras + [(para, para_tokens)]
+                current_tokens = overlap_tokens + para_tokens
+            else:
+                current_chunk.append((para, para_tokens))
+                current_tokens += para_tokens
     
     # Don't forget the last chunk
     if current_chunk:
-        chunk_text = '\n\n'.join(current_chunk)
-        chunk_start = text.find(current_chunk[0])
-        chunk_end = text.find(current_chunk[-1]) + len(current_chunk[-1])
-        
-        chunks.append(Chunk(
-            id=str(uuid.uuid4()),
-            document_id=document_id,
-            chunk_index=chunk_index,
-            content=chunk_text,
-            start_page=find_page_for_position(chunk_start, page_breaks),
-            end_page=find_page_for_position(chunk_end, page_breaks),
-            section_header=current_section,
-            token_count=estimate_tokens(chunk_text)
-        ))
-    
-    logger.info(f"Created {len(chunks)} chunks from {len(text)} characters")
-    
-    return chunks
+        yield make_chunk(current_chunk, '\n\n')
+
+
+def sentence_parts(para: Paragraph, max_tokens: int, counter: TokenCounter) -> List[Tuple[Span, int]]:
+    """A paragraph's sentences with their token counts, cutting any sentence longer than max_tokens."""
+    sentences = para.sentences()
+    parts = []
+    for sent, tokens in zip(sentences, counter.count_many([sent.text for sent in sentences])):
+        if tokens <= max_tokens:
+            parts.append((sent, tokens))
+            continue
+        pieces = [
+            Span(sent.text[start:end], sent.start + start, sent.start + end)
+            for start, end in counter.split(sent.text, max_tokens)
+        ]
+        parts.extend(zip(pieces, counter.count_many([piece.text for piece in pieces])))
+    return parts
 
 
 if __name__ == '__main__':
@@ -6,7 +6,11 @@ Supports GPU acceleration for high-throughput batch processing.
 """
 
 import os
-from typing import List
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Deque, List, Optional, Tuple
 import logging
 
 from sentence_transformers import SentenceTransformer
@@ -23,10 +27,36 @@ EMBEDDING_DIM = 768  # bge-base-en-v1.5 produces 768-dimensional vectors
 DEFAULT_CPU_BATCH_SIZE = 32
 DEFAULT_GPU_BATCH_SIZE = 128
 
+# Length bucketing: sort inputs by tokenizer length and size batches by a token budget
+# (padded tokens per batch) instead of a fixed count, so short chunks are not padded
+# up to the longest chunk that happened to arrive next to them
+DEFAULT_TOKEN_BUDGET = 16384
+
+# Micro-batcher: longest a request waits for a batch to fill before it is flushed anyway
+DEFAULT_MAX_BATCH_LATENCY = float(os.getenv('EMBEDDING_MAX_BATCH_LATENCY', '0.05'))
+
+
+# Settings are read when embeddings are generated, not at import time:
+# process_documents.py imports this module before it calls load_dotenv()
+def length_bucketing_enabled() -> bool:
+    """Whether EMBEDDING_LENGTH_BUCKETING turns length bucketing on."""
+    return os.getenv('EMBEDDING_LENGTH_BUCKETING', 'false').lower() in ('1', 'true', 'yes')
+
+
+def embedding_token_budget() -> int:
+    return int(os.getenv('EMBEDDING_TOKEN_BUDGET', str(DEFAULT_TOKEN_BUDGET)))
+
+
+def embedding_cache_enabled() -> bool:
+    """Whether EMBEDDING_CACHE turns the persistent embedding cache (embedding_cache.py) on."""
+    return os.getenv('EMBEDDING_CACHE', 'false').lower() in ('1', 'true', 'yes')
+
+
 # Global model instance (loaded once)
 _model = None
 _device = None
 _model_lock = threading.Lock()
+_cache = None
 
 
 def get_device() -> str:
@@ -91,6 +121,18 @@ def pre_load_model():
     get_model()
 
 
+def get_embedding_cache():
+    """Get or open the persistent embedding cache."""
+    global _cache
+    if _cache is None:
+        with _model_lock:
+            if _cache is None:
+                from embedding_cache import EmbeddingCache
+                _cache = EmbeddingCache(EMBEDDING_MODEL)
+                logger.info(f"Embedding cache opened: {_cache.path} ({_cache.size_bytes() / 1024**2:.1f} MB)")
+    return _cache
+
+
 def get_batch_size() -> int:
     """Return optimal batch size based on device."""
     device = get_device()
@@ -99,41 +141,383 @@ def get_batch_size() -> int:
     return int(os.getenv('CPU_BATCH_SIZE', DEFAULT_CPU_BATCH_SIZE))
 
 
-def generate_embeddings(texts: List[str], show_progress: bool = True) -> List[List[float]]:
+def token_lengths(texts: List[str]) -> List[int]:
+    """Real tokenizer lengths (including special tokens), capped at the model's max sequence length."""
+    model = get_model()
+    encoded = model.tokenizer(
+        texts,
+        add_special_tokens=True,
+        truncation=True,
+        max_length=model.max_seq_length
+    )
+    return [len(ids) for ids in encoded['input_ids']]
+
+
+def plan_length_batches(lengths: List[int], token_budget: int, max_batch_size: int) -> List[List[int]]:
     """
-    Generate embeddings for a list of text chunks.
-    
-    Args:
-        texts: List of text strings to embed
-        show_progress: Whether to show progress bar
-    
-    Returns:
-        List of embedding vectors (each is a list of 768 floats)
+    Group input indices into batches of similar length.
+
+    Indices are sorted by length and a batch is closed once adding the next
+    input would push its padded size (longest length x batch count) over
+    `token_budget`, or once it reaches `max_batch_size`. Short inputs therefore
+    travel in large batches and long ones in small batches.
     """
-    if not texts:
-        return []
-    
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    batches = []
+    current: List[int] = []
+    current_max = 0
+
+    for i in order:
+        new_max = max(current_max, lengths[i])
+        if current and (new_max * (len(current) + 1) > token_budget or len(current) >= max_batch_size):
+            batches.append(current)
+            current = []
+            new_max = lengths[i]
+        current.append(i)
+        current_max = new_max
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+def arrival_order_batches(count: int, batch_size: int) -> List[List[int]]:
+    """Fixed-size batches in input order, as a plain `model.encode` call would form them."""
+    return [list(range(i, min(i + batch_size, count))) for i in range(0, count, batch_size)]
+
+
+def padding_ratio(lengths: List[int], batches: List[List[int]]) -> float:
+    """Fraction of the padded token slots across all batches that are padding."""
+    padded = sum(max(lengths[i] for i in batch) * len(batch) for batch in batches if batch)
+    if padded == 0:
+        return 0.0
+    return 1 - sum(lengths) / padded
+
+
+def _encode_length_bucketed(texts: List[str], batch_size: int, token_budget: int) -> np.ndarray:
+    """Encode texts in length-sorted, token-budgeted batches and restore input order."""
+    model = get_model()
+    lengths = token_lengths(texts)
+    batches = plan_length_batches(lengths, token_budget, batch_size)
+
+    # Padding for arrival-order batches is computed as if each batch were padded
+    # to its own longest input
+    before = padding_ratio(lengths, arrival_order_batches(len(texts), batch_size))
+    after = padding_ratio(lengths, batches)
+    logger.info(f"Length bucketing: {len(batches)} batches, padding {before * 100:.1f}% -> {after * 100:.1f}%")
+
+    embeddings = np.empty((len(texts), model.get_sentence_embedding_dimension()), dtype=np.float32)
+    for batch in batches:
+        encoded = model.encode(
+            [texts[i] for i in batch],
+            batch_size=len(batch),
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+        embeddings[batch] = encoded
+    return embeddings
+
+
+def _encode(texts: List[str], show_progress: bool, length_bucketing: bool, token_budget: int) -> np.ndarray:
     model = get_model()
     batch_size = get_batch_size()
-    
+
     logger.info(f"Generating embeddings for {len(texts)} chunks (batch_size={batch_size})...")
-    
+
+    if length_bucketing:
+        return _encode_length_bucketed(texts, batch_size, token_budget)
+
     # BGE models benefit from a query prefix for retrieval tasks
     # For documents, we use the text as-is; for queries, we'd add "Represent this sentence: "
-    embeddings = model.encode(
+    return model.encode(
         texts,
         batch_size=batch_size,
         show_progress_bar=show_progress,
         convert_to_numpy=True,
         normalize_embeddings=True  # BGE models work better with normalized vectors
     )
+
+
+def _encode_with_cache(texts: List[str], show_progress: bool, length_bucketing: bool, token_budget: int) -> np.ndarray:
+    """Serve what we can from the embedding cache and only encode the misses."""
+    cache = get_embedding_cache()
+    cached = cache.get_many(texts)
+    missing = [i for i, emb in enumerate(cached) if emb is None]
+
+    embeddings = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    for i, emb in enumerate(cached):
+        if emb is not None:
+            embeddings[i] = emb
+
+    if missing:
+        missing_texts = [texts[i] for i in missing]
+        encoded = _encode(missing_texts, show_progress, length_bucketing, token_budget)
+        embeddings[missing] = encoded
+        cache.put_many(missing_texts, encoded)
+
+    logger.info(f"Embedding cache: {len(texts) - len(missing)}/{len(texts)} hits "
+                f"({cache.hit_rate() * 100:.1f}% this run)")
+    return embeddings
+
+
+def _settings(length_bucketing: Optional[bool], token_budget: Optional[int],
+              use_cache: Optional[bool]) -> Tuple[bool, int, bool]:
+    """Fill in the settings a caller left as None from the environment."""
+    return (
+        length_bucketing_enabled() if length_bucketing is None else length_bucketing,
+        embedding_token_budget() if token_budget is None else token_budget,
+        embedding_cache_enabled() if use_cache is None else use_cache,
+    )
+
+
+def generate_embeddings_array(
+    texts: List[str],
+    show_progress: bool = True,
+    length_bucketing: Optional[bool] = None,
+    token_budget: Optional[int] = None,
+    use_cache: Optional[bool] = None,
+    dtype: str = 'float32'
+) -> np.ndarray:
+    """
+    Generate embeddings as one contiguous (len(texts), 768) matrix.
+
+    Prefer this over generate_embeddings() when the result goes to
+    chunk_payload for upload: it avoids converting every value to a Python float.
+
+    Args:
+        texts: List of text strings to embed
+        show_progress: Whether to show progress bar
+        length_bucketing: Batch inputs by tokenizer length under `token_budget`
+                          instead of fixed-size batches in arrival order
+                          (default: EMBEDDING_LENGTH_BUCKETING)
+        token_budget: Maximum padded tokens per batch when length_bucketing is on
+                      (default: EMBEDDING_TOKEN_BUDGET)
+        use_cache: Look texts up in the persistent embedding cache first
+                   (default: EMBEDDING_CACHE)
+        dtype: 'float32' or 'float16'
+    """
+    if not texts:
+        return np.empty((0, EMBEDDING_DIM), dtype=dtype)
+
+    length_bucketing, token_budget, use_cache = _settings(length_bucketing, token_budget, use_cache)
+    if use_cache:
+        embeddings = _encode_with_cache(texts, show_progress, length_bucketing, token_budget)
+    else:
+        embeddings = _encode(texts, show_progress, length_bucketing, token_budget)
+
+    logger.info(f"Generated {len(embeddings)} embeddings of dimension {embeddings.shape[1]}")
+
+    return np.ascontiguousarray(embeddings, dtype=dtype)
+
+
+def generate_embeddings(
+    texts: List[str],
+    show_progress: bool = True,
+    length_bucketing: Optional[bool] = None,
+    token_budget: Optional[int] = None,
+    use_cache: Optional[bool] = None
+) -> List[List[float]]:
+    """
+    Generate embeddings for a list of text chunks.
     
-    # Convert numpy arrays to lists for JSON serialization
-    result = [emb.tolist() for emb in embeddings]
-    
-    logger.info(f"Generated {len(result)} embeddings of dimension {len(result[0])}")
+    Args:
+        texts: List of text strings to embed
+        show_progress: Whether to show progress bar
+        length_bucketing: Batch inputs by tokenizer length under `token_budget`
+                          instead of fixed-size batches in arrival order
+                          (default: EMBEDDING_LENGTH_BUCKETING)
+        token_budget: Maximum padded tokens per batch when length_bucketing is on
+                      (default: EMBEDDING_TOKEN_BUDGET)
+        use_cache: Look texts up in the persistent embedding cache first
+                   (default: EMBEDDING_CACHE)
     
-    return result
+    Returns:
+        List of embedding vectors (each is a list of 768 floats)
+    """
+    embeddings = generate_embeddings_array(texts, show_progress, length_bucketing, token_budget, use_cache)
+    return embeddings.tolist()
+
+
+@dataclass
+class _EmbeddingRequest:
+    texts: List[str]
+    future: Future
+    submitted_at: float
+    next_index: int = 0  # First text not yet handed to a batch
+    remaining: int = 0   # Texts whose embeddings have not come back yet
+    results: Optional[np.ndarray] = None
+
+
+class EmbeddingService:
+    """
+    Cross-document embedding micro-batcher.
+
+    Callers on any thread submit the chunk texts of one document and get a
+    Future back, resolving to a (len(texts), 768) float32 matrix. A single background thread packs texts from all pending
+    requests into batches of `batch_size` and encodes them, so many small
+    documents share one full batch instead of each making a tiny call. A
+    partially filled batch is flushed once its oldest request has waited
+    `max_latency` seconds. Packed batches are encoded like any other call to
+    generate_embeddings_array(): cached texts are served from the embedding
+    cache and, with length bucketing on, the rest are sorted by length.
+    """
+
+    def __init__(
+        self,
+        batch_size: Optional[int] = None,
+        max_latency: float = DEFAULT_MAX_BATCH_LATENCY,
+        length_bucketing: Optional[bool] = None,
+        token_budget: Optional[int] = None,
+        use_cache: Optional[bool] = None
+    ):
+        self.batch_size = batch_size or get_batch_size()
+        self.max_latency = max_latency
+        self.length_bucketing, self.token_budget, self.use_cache = _settings(length_bucketing, token_budget, use_cache)
+        self._requests: Deque[_EmbeddingRequest] = deque()
+        self._pending_texts = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        # Counters for reporting
+        self.batches = 0
+        self.texts_embedded = 0
+        self.requests_completed = 0
+
+        self._thread = threading.Thread(target=self._run, name='embedding-service', daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        """Queue one document's texts. The Future resolves to their embedding matrix."""
+        future: Future = Future()
+        if not texts:
+            future.set_result(np.empty((0, EMBEDDING_DIM), dtype=np.float32))
+            return future
+
+        request = _EmbeddingRequest(
+            texts=list(texts),
+            future=future,
+            submitted_at=time.monotonic(),
+            remaining=len(texts),
+            results=np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+        )
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("EmbeddingService is closed")
+            self._requests.append(request)
+            self._pending_texts += len(texts)
+            self._cond.notify()
+        return future
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Submit texts and wait for their embeddings."""
+        return self.submit(texts).result()
+
+    def close(self):
+        """Flush outstanding requests and stop the background thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def fill_ratio(self) -> float:
+        """Average fraction of `batch_size` used per encode call."""
+        if not self.batches:
+            return 0.0
+        return self.texts_embedded / (self.batches * self.batch_size)
+
+    def _next_batch(self) -> Optional[List[tuple]]:
+        """Wait for a full batch (or a latency deadline) and claim its texts."""
+        with self._cond:
+            while not self._requests:
+                if self._closed:
+                    return None
+                self._cond.wait()
+
+            deadline = self._requests[0].submitted_at + self.max_latency
+            while self._pending_texts < self.batch_size and not self._closed:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                self._cond.wait(timeout)
+
+            # Each entry: (request, start, end) slice of that request's texts
+            batch = []
+            room = self.batch_size
+            while self._requests and room > 0:
+                request = self._requests[0]
+                start = request.next_index
+                end = min(len(request.texts), start + room)
+                batch.append((request, start, end))
+                request.next_index = end
+                room -= end - start
+                self._pending_texts -= end - start
+                if end == len(request.texts):
+                    self._requests.popleft()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            texts = [t for request, start, end in batch for t in request.texts[start:end]]
+            try:
+                if self.use_cache:
+                    embeddings = _encode_with_cache(texts, False, self.length_bucketing, self.token_budget)
+                else:
+                    embeddings = _encode(texts, False, self.length_bucketing, self.token_budget)
+            except Exception as e:
+                logger.exception(f"Embedding batch of {len(texts)} texts failed: {e}")
+                for request, _, _ in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.texts_embedded += len(texts)
+
+            offset = 0
+            for request, start, end in batch:
+                if request.future.done():
+                    # An earlier batch for this request already failed
+                    offset += end - start
+                    continue
+                request.results[start:end] = embeddings[offset:offset + end - start]
+                offset += end - start
+                request.remaining -= end - start
+                if request.remaining == 0:
+                    self.requests_completed += 1
+                    request.future.set_result(request.results)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_embedding_service(max_latency: float = DEFAULT_MAX_BATCH_LATENCY) -> EmbeddingService:
+    """Get or start the shared embedding micro-batcher."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                get_model()
+                _service = EmbeddingService(max_latency=max_latency)
+                logger.info(f"Embedding service started (batch_size={_service.batch_size}, "
+                            f"max_latency={max_latency * 1000:.0f}ms)")
+    return _service
+
+
+def shutdown_embedding_service():
+    """Stop the shared micro-batcher, if one was started, and log its batch fill."""
+    global _service
+    with _service_lock:
+        if _service is not None:
+            _service.close()
+            logger.info(f"Embedding service: {_service.texts_embedded} texts in {_service.batches} batches "
+                        f"({_service.fill_ratio() * 100:.1f}% average fill)")
+            _service = None
 
 
 def generate_query_embedding(query: str) -> List[float]:
@@ -0,0 +1,194 @@
+"""
+Embedding Cache Module
+
+Persistent, content-addressed cache of chunk embeddings. Entries are keyed by
+(model name, hash of whitespace-normalized chunk text), so re-processing a
+document after an error or a reset only embeds chunks whose text changed.
+Vectors are stored as raw float16/float32 bytes in a local SQLite file and the
+least recently used entries are evicted once the cache exceeds its size limit.
+"""
+
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from pathlib import Path
+from typing import List, Optional
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = Path(__file__).parent / 'data' / 'embedding_cache.sqlite'
+
+# After eviction the cache is trimmed to this fraction of its limit, so a full
+# cache does not evict on every insert
+EVICT_TARGET = 0.9
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+# Read when a cache is opened rather than at import, so .env values loaded
+# after the import still apply
+def cache_path() -> Path:
+    return Path(os.getenv('EMBEDDING_CACHE_PATH', str(DEFAULT_CACHE_PATH)))
+
+
+def cache_max_bytes() -> int:
+    return int(float(os.getenv('EMBEDDING_CACHE_MAX_MB', '2048')) * 1024 * 1024)
+
+
+def cache_dtype() -> str:
+    return os.getenv('EMBEDDING_CACHE_DTYPE', 'float32')
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize chunk text for hashing.
+
+    The tokenizer splits on whitespace, so runs of whitespace do not change the
+    embedding and are collapsed here too.
+    """
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def cache_key(model_name: str, text: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(model_name.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(normalize_text(text).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite-backed LRU cache of embedding vectors."""
+
+    def __init__(
+        self,
+        model_name: str,
+        path: Optional[Path] = None,
+        max_bytes: Optional[int] = None,
+        dtype: Optional[str] = None
+    ):
+        path = path if path is not None else cache_path()
+        max_bytes = max_bytes if max_bytes is not None else cache_max_bytes()
+        dtype = dtype or cache_dtype()
+        if dtype not in ('float16', 'float32'):
+            raise ValueError(f"Unsupported embedding cache dtype: {dtype}")
+
+        self.model_name = model_name
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                dtype TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)')
+        self._conn.commit()
+
+        row = self._conn.execute('SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings').fetchone()
+        self._total_bytes = row[0]
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Look up texts. Returns a float32 vector per text, or None on a miss."""
+        keys = [cache_key(self.model_name, t) for t in texts]
+        found = {}
+        now = time.time()
+
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            for i in range(0, len(unique), _SQL_BATCH):
+                batch = unique[i:i + _SQL_BATCH]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f'SELECT key, dtype, vector FROM embeddings WHERE key IN ({placeholders})', batch
+                ).fetchall()
+                for key, dtype, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.dtype(dtype).newbyteorder('<')).astype(np.float32)
+                if rows:
+                    hit_keys = [r[0] for r in rows]
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_access = ? WHERE key IN ({','.join('?' * len(hit_keys))})",
+                        [now] + hit_keys
+                    )
+            self._conn.commit()
+
+            results = [found.get(k) for k in keys]
+            hits = sum(1 for r in results if r is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+
+        return results
+
+    def put_many(self, texts: List[str], embeddings: np.ndarray):
+        """Store one vector per text and evict old entries if the cache is over its limit."""
+        now = time.time()
+        # Keyed so a text repeated in one call (e.g. boilerplate) is stored and counted once
+        rows = {}
+        for text, emb in zip(texts, embeddings):
+            blob = np.ascontiguousarray(emb, dtype=self.dtype).tobytes()
+            key = cache_key(self.model_name, text)
+            rows[key] = (key, self.dtype.name, blob, now)
+        rows = list(rows.values())
+
+        with self._lock:
+            for key, _, blob, _ in rows:
+                existing = self._conn.execute(
+                    'SELECT LENGTH(vector) FROM embeddings WHERE key = ?', (key,)
+                ).fetchone()
+                self._total_bytes += len(blob) - (existing[0] if existing else 0)
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO embeddings (key, dtype, vector, last_access) VALUES (?, ?, ?, ?)',
+                rows
+            )
+            self._conn.commit()
+
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is under EVICT_TARGET of its limit."""
+        target = int(self.max_bytes * EVICT_TARGET)
+        evicted = 0
+        cursor = self._conn.execute('SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_access')
+        doomed = []
+        for key, size in cursor:
+            if self._total_bytes <= target:
+                break
+            doomed.append((key,))
+            self._total_bytes -= size
+            evicted += 1
+        self._conn.executemany('DELETE FROM embeddings WHERE key = ?', doomed)
+        self._conn.commit()
+        logger.info(f"Embedding cache: evicted {evicted} entries ({self._total_bytes / 1024**2:.1f} MB kept)")
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def size_bytes(self) -> int:
+        return self._total_bytes
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,131 @@
+"""
+Parallel Text Extraction
+
+Runs PDF (PyMuPDF) and JATS XML (ElementTree) extraction in a pool of worker
+processes, so CPU-bound parsing is not serialized on the GIL of the process
+that downloads and embeds. Results cross the process boundary as compact
+tuples (text plus page breaks packed into an int array) rather than dicts of
+boxed ints.
+
+If a worker dies (e.g. PyMuPDF crashing on a malformed PDF), the pool is
+replaced and every document that was in flight is retried alone in a
+single-use process, so a bad file only fails itself instead of the run.
+"""
+
+import os
+import threading
+import multiprocessing
+from array import array
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple
+import logging
+
+from pdf_parser import extract_text_from_pdf
+from xml_parser import extract_text_from_xml
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXTRACT_PROCESSES = max(1, (os.cpu_count() or 2) - 1)
+
+# Version of the extraction output. Bump it whenever a change to pdf_parser.py,
+# xml_parser.py or segmentation.clean_pdf_text alters extracted text or page
+# breaks, so artifacts stored under the old version (artifact_store.py) are
+# extracted again instead of reused.
+PARSER_VERSION = 1
+
+# Compact cross-process payload: (text, packed page breaks, page count, metadata)
+ExtractionPayload = Tuple[str, bytes, int, Dict]
+
+
+def extract_document(file_path: str, doc_format: str) -> Optional[Dict]:
+    """Extract text from a downloaded document, routed by format ('xml' or 'pdf')."""
+    if doc_format == 'xml':
+        return extract_text_from_xml(file_path)
+    return extract_text_from_pdf(file_path)
+
+
+def pack_result(result: Optional[Dict]) -> Optional[ExtractionPayload]:
+    if result is None:
+        return None
+    page_breaks = array('q', result.get('page_breaks', []))
+    return result['text'], page_breaks.tobytes(), result.get('page_count', 0), result.get('metadata', {})
+
+
+def unpack_result(payload: Optional[ExtractionPayload]) -> Optional[Dict]:
+    if payload is None:
+        return None
+    text, packed_breaks, page_count, metadata = payload
+    page_breaks = array('q')
+    page_breaks.frombytes(packed_breaks)
+    return {
+        'text': text,
+        'page_count': page_count,
+        'page_breaks': page_breaks.tolist(),
+        'metadata': metadata
+    }
+
+
+def _extract_packed(file_path: str, doc_format: str) -> Optional[ExtractionPayload]:
+    """Worker-process entry point."""
+    return pack_result(extract_document(file_path, doc_format))
+
+
+class ExtractionPool:
+    """Thread-safe front end to a process pool running extract_document()."""
+
+    def __init__(self, processes: int = DEFAULT_EXTRACT_PROCESSES):
+        self.processes = max(1, processes)
+        # Spawn, not fork: the parent has threads and possibly a CUDA context
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._executor = self._new_executor()
+        self.crashes = 0
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.processes, mp_context=self._context)
+
+    def _replace_broken(self, generation: int):
+        """Swap in a fresh pool, once per breakage however many threads noticed it."""
+        with self._lock:
+            if generation != self._generation:
+                return
+            self.crashes += 1
+            logger.warning(f"Extraction worker died; restarting pool ({self.crashes} crash(es) so far)")
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._new_executor()
+            self._generation += 1
+
+    def _extract_isolated(self, file_path: str, doc_format: str) -> Optional[Dict]:
+        """Run one document in its own single-use worker, so a crash only affects it."""
+        with ProcessPoolExecutor(max_workers=1, mp_context=self._context) as executor:
+            try:
+                return unpack_result(executor.submit(_extract_packed, file_path, doc_format).result())
+            except BrokenProcessPool:
+                logger.error(f"Extraction of {file_path} crashed its worker; giving up")
+                return None
+
+    def extract(self, file_path: str, doc_format: str) -> Optional[Dict]:
+        """Extract in a worker process. Returns None if extraction failed or crashed its worker."""
+        while True:
+            with self._lock:
+                executor, generation = self._executor, self._generation
+            try:
+                future = executor.submit(_extract_packed, file_path, doc_format)
+            except (RuntimeError, BrokenProcessPool):
+                # Picked up a pool that is broken or was just replaced by another thread
+                self._replace_broken(generation)
+                continue
+
+            try:
+                return unpack_result(future.result())
+            except (BrokenProcessPool, CancelledError):
+                # Every document in flight on the pool fails together and we can't tell
+                # which one killed it; retrying each alone pins the crash on the culprit
+                self._replace_broken(generation)
+                return self._extract_isolated(file_path, doc_format)
+
+    def close(self):
+        with self._lock:
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,157 @@
+"""
+Shared HTTP Client
+
+One pooled, keep-alive `requests` session for every rag-processing script, so
+repeated calls to the API, D1 and R2 reuse TCP+TLS connections instead of
+opening a new one per call. Requests are tagged with an endpoint name that
+selects their timeout and retry policy; 429 and 5xx responses are retried with
+jittered exponential backoff (honouring Retry-After).
+"""
+
+import os
+import time
+import random
+import threading
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Configuration
+CLOUDFLARE_ACCOUNT_ID = os.getenv('CLOUDFLARE_ACCOUNT_ID')
+CLOUDFLARE_API_TOKEN = os.getenv('CLOUDFLARE_API_TOKEN')
+DATABASE_ID = os.getenv('DATABASE_ID')
+API_BASE_URL = os.getenv('API_BASE_URL', 'https://leukemialens-api.jr-rhinehart.workers.dev')
+CLOUDFLARE_API_BASE = os.getenv('CLOUDFLARE_API_BASE', 'https://api.cloudflare.com/client/v4')
+
+POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '16'))  # Connections kept per host
+MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '4'))
+BACKOFF_BASE = float(os.getenv('HTTP_BACKOFF_BASE', '0.5'))  # Seconds; doubles per attempt
+BACKOFF_MAX = float(os.getenv('HTTP_BACKOFF_MAX', '30'))
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Responses that mean the request was not acted on, so even non-idempotent calls can repeat it
+NOT_PROCESSED_STATUSES = frozenset({429, 503})
+
+
+@dataclass(frozen=True)
+class EndpointPolicy:
+    timeout: Tuple[float, float]  # (connect, read) seconds
+    idempotent: bool = True
+
+
+ENDPOINTS = {
+    'd1': EndpointPolicy(timeout=(10, 60)),
+    # Work-queue claims and finishes: a retried UPDATE ... RETURNING that already ran
+    # leases another batch, and the rows of the first stay leased until they expire
+    'd1_lease': EndpointPolicy(timeout=(10, 60), idempotent=False),
+    'download': EndpointPolicy(timeout=(10, 60)),
+    'status': EndpointPolicy(timeout=(10, 30)),
+    # Re-posting a batch that was partly written fails on duplicate chunk ids
+    'upload': EndpointPolicy(timeout=(10, 120), idempotent=False),
+    'r2': EndpointPolicy(timeout=(10, 60)),
+    'default': EndpointPolicy(timeout=(10, 60)),
+}
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Get or create the shared pooled session."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # Retries are handled in request() so each endpoint can have its own policy
+                adapter = HTTPAdapter(pool_connections=8, pool_maxsize=POOL_SIZE, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Full-jitter exponential backoff, or the server's Retry-After if it gave one."""
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def request(method: str, url: str, endpoint: str = 'default', **kwargs) -> requests.Response:
+    """
+    Send a request through the shared session with the endpoint's timeout and retry policy.
+
+    Returns the final response (which may still be an error status once retries
+    are exhausted). Raises the last requests exception if every attempt failed
+    to get a response.
+    """
+    policy = ENDPOINTS.get(endpoint, ENDPOINTS['default'])
+    kwargs.setdefault('timeout', policy.timeout)
+    session = get_session()
+
+    for attempt in range(MAX_RETRIES + 1):
+        last_attempt = attempt == MAX_RETRIES
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            # Without a response we only know a non-idempotent call was not sent if connecting failed
+            retryable = policy.idempotent or isinstance(e, requests.ConnectTimeout)
+            if last_attempt or not retryable:
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning(f"{method} {endpoint} failed ({type(e).__name__}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        retry_statuses = RETRY_STATUSES if policy.idempotent else NOT_PROCESSED_STATUSES
+        if response.status_code not in retry_statuses or last_attempt:
+            return response
+
+        delay = backoff_delay(attempt, response.headers.get('Retry-After'))
+        logger.warning(f"{method} {endpoint} returned {response.status_code}; retrying in {delay:.1f}s")
+        response.close()
+        time.sleep(delay)
+
+
+def api_url(path: str) -> str:
+    return f"{API_BASE_URL}{path}"
+
+
+def cloudflare_url(path: str) -> str:
+    return f"{CLOUDFLARE_API_BASE}/accounts/{CLOUDFLARE_ACCOUNT_ID}{path}"
+
+
+def cloudflare_headers() -> dict:
+    return {
+        'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}',
+        'Content-Type': 'application/json'
+    }
+
+
+def query_d1(sql: str, params: List = None, endpoint: str = 'd1') -> dict:
+    """Execute a D1 query via Cloudflare API. Pass endpoint='d1_lease' for statements that must not be retried."""
+    response = request(
+        'POST',
+        cloudflare_url(f"/d1/database/{DATABASE_ID}/query"),
+        endpoint=endpoint,
+        headers=cloudflare_headers(),
+        json={'sql': sql, 'params': params or []}
+    )
+
+    data = response.json()
+    if not data.get('success'):
+        raise Exception(f"D1 query failed: {data.get('errors')}")
+
+    return data['result'][0]
@@ -0,0 +1,220 @@
+"""
+Backfill Journal
+
+Append-only log of document state changes for backfill_gpu.py, so a crashed
+or interrupted run can be resumed precisely. Every 'processing', 'ready' and
+'error' transition is appended as one JSON line, with the chunk count for
+'ready'. The periodic checkpoint only knows the last document id. From the
+journal, --resume knows exactly which documents finished (they are skipped)
+and which were in flight when the run stopped (they are redone).
+
+Each record is written with a single write() on an O_APPEND descriptor, so it
+survives a crash of the process as soon as write() returns. Surviving a power
+loss depends on the fsync policy:
+
+- always:   fsync after every record
+- interval: fsync at most every JOURNAL_FSYNC_INTERVAL seconds (default)
+- never:    leave it to the OS
+
+A record torn by a crash mid-write is dropped when the journal is reopened.
+Compaction rewrites the journal with only the latest record of each document,
+through a temporary file and an atomic rename.
+
+Usage:
+    python journal.py                      # Counts by state
+    python journal.py --compact            # Rewrite with one record per document
+    python journal.py --path data/backfill_journal.shard-0-of-4.jsonl
+"""
+
+import os
+import json
+import time
+import argparse
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+JOURNAL_FILE = Path(__file__).parent / 'data' / 'backfill_journal.jsonl'
+FSYNC_POLICIES = ('always', 'interval', 'never')
+DEFAULT_FSYNC = os.getenv('JOURNAL_FSYNC', 'interval')
+DEFAULT_FSYNC_INTERVAL = float(os.getenv('JOURNAL_FSYNC_INTERVAL', '1.0'))
+
+TERMINAL_STATES = ('ready', 'error')
+
+# Compact once the journal holds this many times more records than documents
+COMPACT_RATIO = 1.5
+COMPACT_MIN_RECORDS = 1000
+
+
+@dataclass
+class JournalEntry:
+    status: str
+    chunk_count: int
+    time: float
+    error: Optional[str] = None
+
+
+class Journal:
+    """Append-only JSON-lines journal of document states, with the latest state of each held in memory."""
+
+    def __init__(self, path: Path = JOURNAL_FILE, fsync: str = DEFAULT_FSYNC,
+                 fsync_interval: float = DEFAULT_FSYNC_INTERVAL):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync policy must be one of {FSYNC_POLICIES}, got {fsync!r}")
+        self.path = Path(path)
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.records = 0
+        self._entries: Dict[str, JournalEntry] = {}
+        self._lock = threading.Lock()
+        self._last_sync = time.monotonic()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._load()
+        self._fd = os.open(str(self.path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if self.needs_compaction():
+            self.compact()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        good_end = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Torn by a crash mid-write; only the last record can be
+                    logger.warning(f"Journal {self.path}: dropping incomplete last record")
+                    break
+                try:
+                    record = json.loads(line)
+                    self._entries[record['id']] = _entry(record)
+                    self.records += 1
+                except (ValueError, KeyError):
+                    logger.warning(f"Journal {self.path}: skipping unreadable record at byte {good_end}")
+                good_end += len(line)
+        if good_end < self.path.stat().st_size:
+            os.truncate(self.path, good_end)
+
+    def record(self, doc_id: str, status: str, chunk_count: int = 0, error: Optional[str] = None):
+        """Append a state change. Repeating a document's current terminal state is not written again."""
+        with self._lock:
+            current = self._entries.get(doc_id)
+            if (current is not None and current.status == status and status in TERMINAL_STATES
+                    and current.chunk_count == chunk_count):
+                return
+            entry = JournalEntry(status, chunk_count, time.time(), error)
+            os.write(self._fd, _line(doc_id, entry))
+            self._entries[doc_id] = entry
+            self.records += 1
+
+            if self.fsync == 'always' or (
+                self.fsync == 'interval' and time.monotonic() - self._last_sync >= self.fsync_interval
+            ):
+                os.fsync(self._fd)
+                self._last_sync = time.monotonic()
+
+    def get(self, doc_id: str) -> Optional[JournalEntry]:
+        with self._lock:
+            return self._entries.get(doc_id)
+
+    def in_flight(self) -> List[str]:
+        """Documents whose last record is 'processing': they were being worked on when the run stopped."""
+        with self._lock:
+            return sorted(doc_id for doc_id, entry in self._entries.items() if entry.status == 'processing')
+
+    def summary(self) -> Dict[str, int]:
+        """Documents per latest state, plus the chunks of the 'ready' ones."""
+        with self._lock:
+            counts = {'processing': 0, 'ready': 0, 'error': 0, 'chunks': 0}
+            for entry in self._entries.values():
+                counts[entry.status] = counts.get(entry.status, 0) + 1
+                if entry.status == 'ready':
+                    counts['chunks'] += entry.chunk_count
+        return counts
+
+    def needs_compaction(self) -> bool:
+        return self.records >= COMPACT_MIN_RECORDS and self.records > COMPACT_RATIO * len(self._entries)
+
+    def compact(self):
+        """Rewrite the journal with only the latest record of each document."""
+        with self._lock:
+            tmp = self.path.with_name(self.path.name + '.tmp')
+            with open(tmp, 'wb') as f:
+                for doc_id, entry in self._entries.items():
+                    f.write(_line(doc_id, entry))
+                f.flush()
+                os.fsync(f.fileno())
+            before = self.records
+            os.close(self._fd)
+            os.replace(tmp, self.path)
+            _fsync_dir(self.path.parent)
+            self._fd = os.open(str(self.path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self.records = len(self._entries)
+            self._last_sync = time.monotonic()
+        logger.info(f"Journal compacted: {before} records -> {self.records}")
+
+    def sync(self):
+        with self._lock:
+            os.fsync(self._fd)
+            self._last_sync = time.monotonic()
+
+    def close(self):
+        """Sync, compact if worthwhile, and close."""
+        if self.fsync != 'never':
+            self.sync()
+        if self.needs_compaction():
+            self.compact()
+        with self._lock:
+            os.close(self._fd)
+
+
+def _line(doc_id: str, entry: JournalEntry) -> bytes:
+    record = {'id': doc_id, 'status': entry.status, 'chunks': entry.chunk_count, 'time': round(entry.time, 3)}
+    if entry.error:
+        record['error'] = entry.error
+    return (json.dumps(record) + '\n').encode('utf-8')
+
+
+def _entry(record: Dict) -> JournalEntry:
+    return JournalEntry(record['status'], record.get('chunks', 0), record.get('time', 0.0), record.get('error'))
+
+
+def _fsync_dir(path: Path):
+    # Makes the rename itself durable (not supported on every platform)
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or compact the backfill journal')
+    parser.add_argument('--path', type=Path, default=JOURNAL_FILE, help=f'Journal file (default: {JOURNAL_FILE})')
+    parser.add_argument('--compact', action='store_true', help='Rewrite with only the latest record per document')
+    args = parser.parse_args()
+
+    if not args.path.exists():
+        parser.error(f"{args.path} does not exist")
+    journal = Journal(args.path)
+    if args.compact:
+        journal.compact()
+        print(f"✓ Compacted to {journal.records} records")
+    counts = journal.summary()
+    print(f"{journal.path}: {counts['ready']} ready ({counts['chunks']} chunks), {counts['error']} error, "
+          f"{counts['processing']} in flight; {journal.records} records")
+    journal.close()
+
+
+if __name__ == '__main__':
+    main()
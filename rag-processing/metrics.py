@@ -0,0 +1,302 @@
+"""
+Live Backfill Metrics
+
+Throughput counters and per-stage latency histograms for backfill_gpu.py,
+cheap enough to update from every worker thread.
+
+- Counters (documents, chunks, embeddings, upload bytes) and histograms are
+  kept per thread. Each thread writes only its own slot, without a lock, and
+  the slots are merged when a snapshot is taken. Slots of threads that have
+  exited are folded into one, so per-batch executors do not pile them up.
+- Stage latencies are the spans timed in profiling.py (`timer()` and
+  `@profiled`), so metrics and traces agree on what a stage covers.
+- Latencies go into fixed log-scale buckets (1 ms to about 20 minutes, 2^(1/4)
+  apart), from which p50/p95/p99 are interpolated to within one bucket.
+- Rates (docs/min, chunks/s, embeddings/s, upload MB/s) are rolling, taken
+  over the last RATE_WINDOW seconds of snapshots.
+
+MetricsWriter writes snapshots to a file every few seconds, as JSON or as
+Prometheus text exposition (e.g. for node_exporter's textfile collector). The
+file is replaced atomically, so readers never see a partial write.
+"""
+
+import os
+import json
+import time
+import bisect
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('documents_processed', 'documents_failed', 'chunks', 'embeddings', 'upload_bytes')
+# Span names of profiling.py, which records every span here
+STAGES = ('status', 'download', 'extract', 'chunk', 'embed', 'upload')
+
+# Bucket upper bounds in seconds: 1 ms * 2^(i/4), up to ~20 minutes; the last bucket is open
+BUCKET_BOUNDS: List[float] = [0.001 * 2 ** (i / 4) for i in range(81)]
+
+METRICS_FORMATS = ('json', 'prometheus')
+DEFAULT_METRICS_INTERVAL = float(os.getenv('METRICS_INTERVAL', '15'))
+RATE_WINDOW = 60.0  # Seconds
+
+
+class Histogram:
+    """Log-bucketed latency histogram. Not thread-safe: each thread records into its own."""
+
+    __slots__ = ('counts', 'total', 'count', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other: 'Histogram'):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.total += other.total
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q: float) -> float:
+        """Estimated q-quantile (0 < q <= 1), interpolated linearly inside its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = BUCKET_BOUNDS[i - 1] if i > 0 else 0.0
+                upper = BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.50),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+
+class _Slot:
+    """One thread's counters and histograms."""
+
+    __slots__ = ('thread', 'counters', 'histograms')
+
+    def __init__(self, thread: Optional[threading.Thread]):
+        self.thread = thread
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.histograms: Dict[str, Histogram] = {}
+
+    def merge(self, other: '_Slot'):
+        for name, value in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        for stage, histogram in other.histograms.items():
+            self.histograms.setdefault(stage, Histogram()).merge(histogram)
+
+
+class Metrics:
+    """Per-thread counters and stage latency histograms, merged on read."""
+
+    def __init__(self, rate_window: float = RATE_WINDOW):
+        self.started_at = time.time()
+        self.rate_window = rate_window
+        self._local = threading.local()
+        self._slots: List[_Slot] = []
+        self._retired = _Slot(None)
+        self._lock = threading.Lock()
+        self._samples: Deque[Tuple[float, Dict[str, int]]] = deque()
+
+    def _slot(self) -> _Slot:
+        slot = getattr(self._local, 'slot', None)
+        if slot is None:
+            slot = self._local.slot = _Slot(threading.current_thread())
+            with self._lock:
+                self._slots.append(slot)
+        return slot
+
+    def count(self, name: str, value: int = 1):
+        counters = self._slot().counters
+        counters[name] = counters.get(name, 0) + value
+
+    def observe(self, stage: str, seconds: float):
+        histograms = self._slot().histograms
+        histogram = histograms.get(stage)
+        if histogram is None:
+            histogram = histograms[stage] = Histogram()
+        histogram.record(seconds)
+
+    def _merged(self) -> _Slot:
+        merged = _Slot(None)
+        with self._lock:
+            # A thread that has exited can no longer write to its slot
+            alive = []
+            for slot in self._slots:
+                if slot.thread.is_alive():
+                    alive.append(slot)
+                else:
+                    self._retired.merge(slot)
+            self._slots = alive
+            merged.merge(self._retired)
+            for slot in alive:
+                merged.merge(slot)
+        return merged
+
+    def snapshot(self) -> Dict:
+        """Merged counters, rolling rates and stage latency summaries."""
+        now = time.time()
+        merged = self._merged()
+        counters = merged.counters
+
+        with self._lock:
+            self._samples.append((now, dict(counters)))
+            while len(self._samples) > 1 and self._samples[1][0] <= now - self.rate_window:
+                self._samples.popleft()
+            since, base = self._samples[0]
+        if since >= now:
+            # First snapshot: rate over the whole run
+            since, base = self.started_at, {}
+        elapsed = max(now - since, 1e-9)
+
+        def rate(name: str) -> float:
+            return (counters.get(name, 0) - base.get(name, 0)) / elapsed
+
+        return {
+            'time': now,
+            'uptime_seconds': now - self.started_at,
+            'counters': counters,
+            'rates': {
+                'docs_per_min': (rate('documents_processed') + rate('documents_failed')) * 60,
+                'chunks_per_sec': rate('chunks'),
+                'embeddings_per_sec': rate('embeddings'),
+                'upload_mb_per_sec': rate('upload_bytes') / 1024 ** 2,
+                'window_seconds': elapsed,
+            },
+            'stages': {stage: merged.histograms[stage].summary()
+                       for stage in _ordered(merged.histograms)},
+            '_histograms': merged.histograms,
+        }
+
+    def summary_lines(self) -> List[str]:
+        """Per-stage latency lines for the end-of-run summary."""
+        snapshot = self.snapshot()
+        return [
+            f"{stage:<8} n={s['count']:<7} p50 {s['p50'] * 1000:8.1f}ms  p95 {s['p95'] * 1000:8.1f}ms  "
+            f"p99 {s['p99'] * 1000:8.1f}ms  max {s['max'] * 1000:8.1f}ms"
+            for stage, s in snapshot['stages'].items()
+        ]
+
+
+def _ordered(histograms: Dict[str, Histogram]) -> List[str]:
+    return [s for s in STAGES if s in histograms] + sorted(s for s in histograms if s not in STAGES)
+
+
+def to_json(snapshot: Dict) -> str:
+    return json.dumps({k: v for k, v in snapshot.items() if not k.startswith('_')}, indent=2)
+
+
+def to_prometheus(snapshot: Dict, prefix: str = 'backfill') -> str:
+    """Prometheus text exposition format (counters, rate gauges and stage histograms)."""
+    counters = snapshot['counters']
+    lines = [
+        f"# HELP {prefix}_documents_total Documents finished, by result.",
+        f"# TYPE {prefix}_documents_total counter",
+        f'{prefix}_documents_total{{result="processed"}} {counters.get("documents_processed", 0)}',
+        f'{prefix}_documents_total{{result="failed"}} {counters.get("documents_failed", 0)}',
+    ]
+    for name, help_text in (('chunks', 'Chunks created.'), ('embeddings', 'Embeddings generated.'),
+                            ('upload_bytes', 'Bytes of chunk batches uploaded.')):
+        lines += [f"# HELP {prefix}_{name}_total {help_text}",
+                  f"# TYPE {prefix}_{name}_total counter",
+                  f"{prefix}_{name}_total {counters.get(name, 0)}"]
+
+    for name, value in snapshot['rates'].items():
+        if name == 'window_seconds':
+            continue
+        lines += [f"# HELP {prefix}_{name} Rolling rate over the last {RATE_WINDOW:.0f}s.",
+                  f"# TYPE {prefix}_{name} gauge",
+                  f"{prefix}_{name} {value:.6g}"]
+
+    lines += [f"# HELP {prefix}_stage_seconds Time spent per document in each processing stage.",
+              f"# TYPE {prefix}_stage_seconds histogram"]
+    histograms = snapshot['_histograms']
+    for stage in _ordered(histograms):
+        histogram = histograms[stage]
+        cumulative = 0
+        for bound, n in zip(BUCKET_BOUNDS, histogram.counts):
+            cumulative += n
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound:.6g}"}} {cumulative}')
+        lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.total:.6g}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+    lines += [f"# HELP {prefix}_uptime_seconds Seconds since the run started.",
+              f"# TYPE {prefix}_uptime_seconds gauge",
+              f"{prefix}_uptime_seconds {snapshot['uptime_seconds']:.3f}"]
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsWriter:
+    """Writes metrics snapshots to a file every `interval` seconds, and once more on close()."""
+
+    def __init__(self, metrics: Metrics, path: Path, fmt: str = 'json',
+                 interval: float = DEFAULT_METRICS_INTERVAL):
+        if fmt not in METRICS_FORMATS:
+            raise ValueError(f"metrics format must be one of {METRICS_FORMATS}, got {fmt!r}")
+        self.metrics = metrics
+        self.path = Path(path)
+        self.fmt = fmt
+        self.interval = interval
+        self._stop = threading.Event()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(target=self._loop, name='metrics-writer', daemon=True)
+        self._thread.start()
+
+    def write(self):
+        snapshot = self.metrics.snapshot()
+        text = to_prometheus(snapshot) if self.fmt == 'prometheus' else to_json(snapshot)
+        tmp = self.path.with_name(f'.{self.path.name}.tmp')
+        tmp.write_text(text)
+        os.replace(tmp, self.path)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:
+                logger.warning(f"Could not write metrics to {self.path}: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+
+_metrics: Optional[Metrics] = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """Get or create the process-wide metrics."""
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = Metrics()
+    return _metrics
@@ -1,17 +1,14 @@
-import os
 import json
-import requests
 import logging
 import time
 from typing import List, Dict, Any
 from dotenv import load_dotenv
 
+from http_client import DATABASE_ID, cloudflare_url, cloudflare_headers, request
+
 # Load environment variables
 load_dotenv()
 
-CLOUDFLARE_ACCOUNT_ID = os.getenv('CLOUDFLARE_ACCOUNT_ID')
-CLOUDFLARE_API_TOKEN = os.getenv('CLOUDFLARE_API_TOKEN')
-DATABASE_ID = os.getenv('DATABASE_ID')
 BUCKET_NAME = "leukemialens-documents"  # From wrangler.toml
 
 # Logging configuration
@@ -22,17 +19,14 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Headers for Cloudflare API
-headers = {
-    'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}',
-    'Content-Type': 'application/json'
-}
+headers = cloudflare_headers()
 
 def query_d1(sql: str, params: List = None) -> dict:
     """Execute a query on Cloudflare D1."""
-    url = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/d1/database/{DATABASE_ID}/query"
+    url = cloudflare_url(f"/d1/database/{DATABASE_ID}/query")
     payload = {"sql": sql, "params": params or []}
     
-    response = requests.post(url, headers=headers, json=payload)
+    response = request('POST', url, endpoint='d1', headers=headers, json=payload)
     if response.status_code != 200:
         logger.error(f"D1 Query Failed: {response.text}")
         return {}
@@ -41,16 +35,13 @@ def query_d1(sql: str, params: List = None) -> dict:
 
 def upload_to_r2(key: str, data: dict) -> bool:
     """Upload a JSON object to Cloudflare R2."""
-    url = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/r2/buckets/{BUCKET_NAME}/objects/{key}"
+    url = cloudflare_url(f"/r2/buckets/{BUCKET_NAME}/objects/{key}")
     
     # R2 PUT via API uses a different set of headers if using the direct object API
     # Note: This requires the API token to have "R2 Edit" permissions
-    r2_headers = {
-        'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}',
-        'Content-Type': 'application/json'
-    }
+    r2_headers = cloudflare_headers()
     
-    response = requests.put(url, headers=r2_headers, data=json.dumps(data))
+    response = request('PUT', url, endpoint='r2', headers=r2_headers, data=json.dumps(data))
     
     if response.status_code == 200:
         return True
@@ -60,12 +51,12 @@ def upload_to_r2(key: str, data: dict) -> bool:
 
 def check_r2_exists(key: str) -> bool:
     """Check if an object exists in R2."""
-    url = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/r2/buckets/{BUCKET_NAME}/objects/{key}"
+    url = cloudflare_url(f"/r2/buckets/{BUCKET_NAME}/objects/{key}")
     
     # Cloudflare R2 API doesn't have a simple HEAD via the management API in the same way, 
     # but we can try to GET metadata or just try to GET the object.
     # For simplicity, we'll just try to GET it.
-    response = requests.get(url, headers=headers)
+    response = request('GET', url, endpoint='r2', headers=headers)
     return response.status_code == 200
 
 def migrate():
@@ -0,0 +1,62 @@
+"""
+Page Index
+
+Maps character offsets in extracted text to page numbers and back. Built once
+per document from the `page_breaks` list returned by the PDF and XML parsers:
+page_breaks[i] is the offset at which page i + 2 starts, so page 1 covers
+[0, page_breaks[0]), page 2 covers [page_breaks[0], page_breaks[1]), and so on.
+The lists are ascending by construction, so lookups are binary searches.
+"""
+
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple
+
+# Joins the text of consecutive pages in extracted documents
+PAGE_SEPARATOR = '\n\n'
+
+
+@dataclass
+class PageText:
+    """One page of a document streamed page by page (see pdf_parser.iter_pdf_pages)."""
+    number: int  # 1-based page number in the source file
+    text: str  # Cleaned text
+    start: int  # Offset of the page in the document text (non-empty pages joined by PAGE_SEPARATOR)
+
+
+class PageIndex:
+    """Position -> page, range -> page span, and page -> character range lookups (1-based pages)."""
+
+    def __init__(self, page_breaks: Sequence[int]):
+        self.page_breaks: List[int] = list(page_breaks)
+
+    def add_page(self, page_break: int):
+        """Extend the index by one page ending at `page_break`, for documents read page by page."""
+        if self.page_breaks and page_break < self.page_breaks[-1]:
+            raise ValueError(f"Page break {page_break} precedes {self.page_breaks[-1]}")
+        self.page_breaks.append(page_break)
+
+    @property
+    def page_count(self) -> int:
+        return len(self.page_breaks)
+
+    def page_at(self, position: int) -> int:
+        """
+        Page containing a character position.
+
+        Positions past the last break are clamped to the last page; with no
+        breaks at all this returns 0.
+        """
+        index = bisect_right(self.page_breaks, position)
+        return index + 1 if index < len(self.page_breaks) else len(self.page_breaks)
+
+    def page_span(self, start: int, end: int) -> Tuple[int, int]:
+        """First and last page of the range [start, end]."""
+        return self.page_at(start), self.page_at(end)
+
+    def page_range(self, page: int) -> Tuple[int, int]:
+        """Character range [start, end) of a page, e.g. for rendering a citation."""
+        if not 1 <= page <= len(self.page_breaks):
+            raise IndexError(f"Page {page} out of range 1-{len(self.page_breaks)}")
+        start = self.page_breaks[page - 2] if page > 1 else 0
+        return start, self.page_breaks[page - 1]
@@ -6,25 +6,19 @@ Uses PyMuPDF (fitz) to extract text from PDF documents with page boundary tracki
 
 import fitz  # PyMuPDF
 import re
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
 import logging
 
+from page_index import PageText, PAGE_SEPARATOR
+from segmentation import clean_pdf_text
+
 logger = logging.getLogger(__name__)
 
 
 def clean_text(text: str) -> str:
     """Clean extracted text."""
-    # Remove page headers/footers (common patterns)
-    # Remove lines that are just page numbers
-    text = re.sub(r'^\s*\d+\s*$', '', text, flags=re.MULTILINE)
-    
-    # Remove common header/footer patterns
-    text = re.sub(r'^\s*(Page \d+ of \d+|www\..+|https?://.+)\s*$', '', text, flags=re.MULTILINE)
-    
-    # Remove excessive whitespace and merge into one line
-    text = re.sub(r'\s+', ' ', text)
-    
-    return text.strip()
+    # Remove page numbers, common header/footer lines, and excessive whitespace
+    return clean_pdf_text(text)
 
 
 def extract_section_headers(text: str) -> List[Dict]:
@@ -51,6 +45,29 @@ def extract_section_headers(text: str) -> List[Dict]:
     return headers
 
 
+def iter_pdf_pages(pdf_path: str) -> Iterator[PageText]:
+    """
+    Yield the cleaned text of each non-empty page, one page at a time.
+
+    Only the current page's text is held, so consumers such as
+    chunker.chunk_pages() can process large PDFs in memory proportional to a
+    page rather than the document. Errors opening or reading the PDF propagate.
+    """
+    with fitz.open(pdf_path) as doc:
+        logger.info(f"PDF opened: {pdf_path}, Page count: {len(doc)}")
+        yield from _iter_pages(doc)
+
+
+def _iter_pages(doc) -> Iterator[PageText]:
+    position = 0
+    for page_num in range(len(doc)):
+        # Extract text with layout preservation
+        cleaned = clean_text(doc[page_num].get_text("text"))
+        if cleaned:
+            yield PageText(page_num + 1, cleaned, position)
+            position += len(cleaned) + len(PAGE_SEPARATOR)
+
+
 def extract_text_from_pdf(pdf_path: str) -> Optional[Dict]:
     """
     Extract text from a PDF file.
@@ -69,26 +86,17 @@ def extract_text_from_pdf(pdf_path: str) -> Optional[Dict]:
         
         full_text = []
         page_breaks = []
-        current_position = 0
         
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            
-            # Extract text with layout preservation
-            text = page.get_text("text")
-            cleaned = clean_text(text)
-            
-            if cleaned:
-                full_text.append(cleaned)
-                current_position += len(cleaned) + 1  # +1 for newline
-                page_breaks.append(current_position)
+        for page in _iter_pages(doc):
+            full_text.append(page.text)
+            page_breaks.append(page.start + len(page.text) + len(PAGE_SEPARATOR))
         
         # Get metadata
         metadata = doc.metadata or {}
         
         doc.close()
         
-        combined_text = '\n\n'.join(full_text)
+        combined_text = PAGE_SEPARATOR.join(full_text)
         
         logger.info(f"Extracted {len(combined_text)} characters from {len(page_breaks)} pages")
         
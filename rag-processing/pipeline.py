@@ -0,0 +1,202 @@
+"""
+Staged Pipeline Module
+
+Runs work items through a chain of stages connected by bounded queues, so that
+network, parsing and embedding work overlap instead of running back to back.
+Each stage has its own worker pool; a full queue blocks the stage feeding it,
+which applies backpressure all the way to the source when a slow stage (usually
+the embedder) falls behind.
+"""
+
+import time
+import queue
+import threading
+import logging
+from typing import Any, Callable, Iterable, List, Optional
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+# Default bound for each inter-stage queue
+DEFAULT_QUEUE_SIZE = 8
+
+# Seconds between progress reports while the pipeline is running
+DEFAULT_REPORT_INTERVAL = 30.0
+
+# Marks the end of the input for a stage worker
+_SENTINEL = object()
+
+
+@dataclass
+class StageStats:
+    name: str
+    workers: int
+    completed: int = 0
+    dropped: int = 0
+    failed: int = 0
+    busy_seconds: float = 0.0
+    blocked_seconds: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, outcome: str, busy: float, blocked: float = 0.0):
+        with self._lock:
+            if outcome == 'completed':
+                self.completed += 1
+            elif outcome == 'dropped':
+                self.dropped += 1
+            else:
+                self.failed += 1
+            self.busy_seconds += busy
+            self.blocked_seconds += blocked
+
+
+class Stage:
+    """
+    One step of a pipeline.
+
+    Args:
+        name: Label used in progress reports
+        func: Called with each work item. Returns the item (or a replacement)
+              to pass downstream, or None if the item was handled and should
+              not continue (e.g. it failed and its status was already written).
+        workers: Number of threads running this stage
+        queue_size: Capacity of this stage's input queue
+        on_error: Called with (item, exception) when func raises
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Any], Optional[Any]],
+        workers: int = 1,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        on_error: Optional[Callable[[Any, BaseException], None]] = None
+    ):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self.on_error = on_error
+        self.stats = StageStats(name=name, workers=self.workers)
+
+
+class StagedPipeline:
+    """Run items through stages, each stage on its own worker pool."""
+
+    def __init__(self, stages: List[Stage], report_interval: float = DEFAULT_REPORT_INTERVAL):
+        if not stages:
+            raise ValueError("StagedPipeline requires at least one stage")
+        self.stages = stages
+        self.report_interval = report_interval
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+        self._done = threading.Event()
+
+    def run(self, items: Iterable[Any]) -> List[StageStats]:
+        """
+        Feed items into the first stage and block until every stage has drained.
+
+        Returns the per-stage statistics.
+        """
+        self._started_at = time.time()
+        self._finished_at = None
+        self._done.clear()
+
+        threads: List[List[threading.Thread]] = []
+        for index, stage in enumerate(self.stages):
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            stage_threads = [
+                threading.Thread(
+                    target=self._worker,
+                    args=(stage, next_stage),
+                    name=f"{stage.name}-{n}",
+                    daemon=True
+                )
+                for n in range(stage.workers)
+            ]
+            for t in stage_threads:
+                t.start()
+            threads.append(stage_threads)
+
+        reporter = None
+        if self.report_interval > 0:
+            reporter = threading.Thread(target=self._report_loop, name='pipeline-report', daemon=True)
+            reporter.start()
+
+        try:
+            # Blocks when the first queue is full: backpressure reaches the source
+            for item in items:
+                self.stages[0].queue.put(item)
+        finally:
+            # Shut stages down in order so each one drains before the next sees its sentinels
+            for index, stage in enumerate(self.stages):
+                for _ in range(stage.workers):
+                    stage.queue.put(_SENTINEL)
+                for t in threads[index]:
+                    t.join()
+
+            self._finished_at = time.time()
+            self._done.set()
+            if reporter:
+                reporter.join()
+
+        return [stage.stats for stage in self.stages]
+
+    def _worker(self, stage: Stage, next_stage: Optional[Stage]):
+        while True:
+            item = stage.queue.get()
+            if item is _SENTINEL:
+                return
+
+            started = time.perf_counter()
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                busy = time.perf_counter() - started
+                logger.exception(f"Stage '{stage.name}' failed: {e}")
+                stage.stats.record('failed', busy)
+                if stage.on_error:
+                    try:
+                        stage.on_error(item, e)
+                    except Exception:
+                        logger.exception(f"Error handler for stage '{stage.name}' failed")
+                continue
+
+            busy = time.perf_counter() - started
+            if result is None:
+                stage.stats.record('dropped', busy)
+                continue
+
+            blocked = 0.0
+            if next_stage is not None:
+                put_started = time.perf_counter()
+                next_stage.queue.put(result)
+                blocked = time.perf_counter() - put_started
+            stage.stats.record('completed', busy, blocked)
+
+    def _report_loop(self):
+        while not self._done.wait(self.report_interval):
+            for line in self.report_lines():
+                logger.info(line)
+
+    def elapsed(self) -> float:
+        if self._started_at is None:
+            return 0.0
+        end = self._finished_at or time.time()
+        return max(end - self._started_at, 1e-9)
+
+    def report_lines(self) -> List[str]:
+        """Per-stage throughput, utilisation and queue depth."""
+        elapsed = self.elapsed()
+        lines = []
+        for stage in self.stages:
+            s = stage.stats
+            handled = s.completed + s.dropped + s.failed
+            rate = handled / elapsed * 60
+            utilisation = s.busy_seconds / (elapsed * s.workers) * 100
+            lines.append(
+                f"[{s.name:<8}] {handled:>6} done ({s.dropped + s.failed} stopped) | "
+                f"{rate:7.1f}/min | busy {utilisation:5.1f}% x{s.workers} | "
+                f"blocked {s.blocked_seconds:7.1f}s | queue {stage.queue.qsize()}/{stage.queue.maxsize}"
+            )
+        return lines
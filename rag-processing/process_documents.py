@@ -8,32 +8,40 @@ Main orchestration script for document processing pipeline:
 4. Chunk text semantically
 5. Generate embeddings
 6. Upload chunks and vectors to Cloudflare
+
+Set TRACE_FILE to write per-document step timings (JSONL), and PROFILE to
+cprofile or sample to profile the run; see profiling.py.
 """
 
 import os
 import json
+import time
 import logging
 from typing import List, Optional
 from dataclasses import dataclass, asdict
 from datetime import datetime
 
-import requests
+import numpy as np
 from dotenv import load_dotenv
 from tqdm import tqdm
 
-from pdf_parser import extract_text_from_pdf
-from chunker import chunk_text
-from embedder import generate_embeddings
+from pdf_parser import iter_pdf_pages
+from chunker import chunk_pages
+from embedder import generate_embeddings_array
+from chunk_payload import encode_chunk_batch
+from blob_cache import get_blob_cache, blob_cache_enabled
+from http_client import API_BASE_URL, api_url, query_d1, request
+from profiling import (
+    Profiler, IterationTimer, start_trace, finish_trace, activate, current_trace, record_span, timer, profiled,
+    enable_tracing, disable_tracing, TRACE_FILE, PROFILE_MODE
+)
 
 # Load environment
 load_dotenv()
 
 # Configuration
-CLOUDFLARE_ACCOUNT_ID = os.getenv('CLOUDFLARE_ACCOUNT_ID')
-CLOUDFLARE_API_TOKEN = os.getenv('CLOUDFLARE_API_TOKEN')
-DATABASE_ID = os.getenv('DATABASE_ID')
-API_BASE_URL = os.getenv('API_BASE_URL', 'https://leukemialens-api.jr-rhinehart.workers.dev')
 BATCH_SIZE = int(os.getenv('BATCH_SIZE', '10'))
+UPLOAD_FORMAT = os.getenv('UPLOAD_FORMAT', 'json')  # 'json', 'binary' or 'binary-gzip'
 
 # Logging
 logging.basicConfig(
@@ -65,26 +73,6 @@ class Chunk:
     token_count: int
 
 
-def query_d1(sql: str, params: List = None) -> dict:
-    """Execute a D1 query via Cloudflare API."""
-    url = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/d1/database/{DATABASE_ID}/query"
-    
-    response = requests.post(
-        url,
-        headers={
-            'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}',
-            'Content-Type': 'application/json'
-        },
-        json={'sql': sql, 'params': params or []}
-    )
-    
-    data = response.json()
-    if not data.get('success'):
-        raise Exception(f"D1 query failed: {data.get('errors')}")
-    
-    return data['result'][0]
-
-
 def get_pending_documents() -> List[Document]:
     """Fetch documents with status 'pending'."""
     result = query_d1(
@@ -106,28 +94,34 @@ def get_pending_documents() -> List[Document]:
     return documents
 
 
+@profiled('download')
 def download_document(doc: Document, output_path: str) -> bool:
-    """Download document from R2 via API."""
+    """Download document from R2 via API, or take it from the blob cache (BLOB_CACHE=true)."""
+    if blob_cache_enabled() and get_blob_cache().fetch(doc.id, output_path):
+        return True
     try:
-        response = requests.get(
-            f"{API_BASE_URL}/api/documents/{doc.id}/content",
-            stream=True
-        )
-        
-        if response.status_code != 200:
-            logger.error(f"Failed to download {doc.id}: {response.status_code}")
-            return False
-        
-        with open(output_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        with request('GET', api_url(f"/api/documents/{doc.id}/content"),
+                     endpoint='download', stream=True) as response:
+            if response.status_code != 200:
+                logger.error(f"Failed to download {doc.id}: {response.status_code}")
+                return False
+            
+            with open(output_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=65536):
+                    f.write(chunk)
         
+        if blob_cache_enabled():
+            try:
+                get_blob_cache().store(doc.id, output_path)
+            except Exception as e:
+                logger.warning(f"Blob cache: could not store {doc.id}: {e}")
         return True
     except Exception as e:
         logger.error(f"Download error for {doc.id}: {e}")
         return False
 
 
+@profiled('status')
 def update_document_status(doc_id: str, status: str, chunk_count: int = 0, error: str = None):
     """Update document status via API."""
     payload = {'status': status}
@@ -136,38 +130,22 @@ def update_document_status(doc_id: str, status: str, chunk_count: int = 0, error
     if error:
         payload['errorMessage'] = error
     
-    response = requests.patch(
-        f"{API_BASE_URL}/api/documents/{doc_id}/status",
-        json=payload
-    )
+    response = request('PATCH', api_url(f"/api/documents/{doc_id}/status"), endpoint='status', json=payload)
     
     return response.status_code == 200
 
 
-def upload_chunks(doc_id: str, chunks: List[Chunk], embeddings: List[List[float]]) -> bool:
+@profiled('upload')
+def upload_chunks(doc_id: str, chunks: List[Chunk], embeddings: np.ndarray) -> bool:
     """Upload chunks and embeddings to Cloudflare."""
     try:
-        # Prepare payload
-        payload = {
-            'documentId': doc_id,
-            'chunks': [
-                {
-                    'id': chunk.id,
-                    'chunkIndex': chunk.chunk_index,
-                    'content': chunk.content,
-                    'startPage': chunk.start_page,
-                    'endPage': chunk.end_page,
-                    'sectionHeader': chunk.section_header,
-                    'tokenCount': chunk.token_count,
-                    'embedding': embeddings[i]
-                }
-                for i, chunk in enumerate(chunks)
-            ]
-        }
+        # Prepare payload (vectors are written straight from the embedding matrix)
+        body, content_type = encode_chunk_batch(doc_id, chunks, embeddings, UPLOAD_FORMAT)
         
-        response = requests.post(
-            f"{API_BASE_URL}/api/chunks/batch",
-            json=payload
+        response = request(
+            'POST', api_url("/api/chunks/batch"), endpoint='upload',
+            data=body,
+            headers={'Content-Type': content_type}
         )
         
         if response.status_code != 200:
@@ -182,6 +160,14 @@ def upload_chunks(doc_id: str, chunks: List[Chunk], embeddings: List[List[float]
 
 def process_document(doc: Document, data_dir: str) -> bool:
     """Process a single document through the full pipeline."""
+    trace = start_trace(doc.id)
+    with activate(trace):
+        success = process_document_steps(doc, data_dir)
+    finish_trace(trace, 'ready' if success else 'error')
+    return success
+
+
+def process_document_steps(doc: Document, data_dir: str) -> bool:
     pdf_path = os.path.join(data_dir, f"{doc.id}.pdf")
     
     try:
@@ -194,23 +180,23 @@ def process_document(doc: Document, data_dir: str) -> bool:
             update_document_status(doc.id, 'error', error='Download failed')
             return False
         
-        # Step 2: Extract text
-        logger.info(f"Extracting text from {doc.filename}...")
-        text_result = extract_text_from_pdf(pdf_path)
-        if not text_result or not text_result.get('text'):
+        # Steps 2-3: Extract text and chunk it, page by page so the full text is never held
+        logger.info(f"Extracting and chunking text from {doc.filename}...")
+        pages = IterationTimer(iter_pdf_pages(pdf_path))
+        started = time.perf_counter()
+        try:
+            chunks = list(chunk_pages(pages, document_id=doc.id))
+        except Exception as e:
+            logger.exception(f"Error extracting text from {pdf_path}: {e}")
             update_document_status(doc.id, 'error', error='Text extraction failed')
             return False
-        
-        # Step 3: Chunk text
-        logger.info(f"Chunking text...")
-        chunks = chunk_text(
-            text=text_result['text'],
-            page_breaks=text_result.get('page_breaks', []),
-            document_id=doc.id
-        )
+        finally:
+            # Reading pages is extraction, the rest of the time is chunking
+            record_span(current_trace(), 'extract', started, pages.seconds)
+            record_span(current_trace(), 'chunk', started, time.perf_counter() - started - pages.seconds)
         
         if not chunks:
-            update_document_status(doc.id, 'error', error='Chunking produced no results')
+            update_document_status(doc.id, 'error', error='Text extraction failed')
             return False
         
         logger.info(f"Created {len(chunks)} chunks")
@@ -218,7 +204,8 @@ def process_document(doc: Document, data_dir: str) -> bool:
         # Step 4: Generate embeddings
         logger.info(f"Generating embeddings...")
         chunk_texts = [c.content for c in chunks]
-        embeddings = generate_embeddings(chunk_texts)
+        with timer('embed'):
+            embeddings = generate_embeddings_array(chunk_texts)
         
         if len(embeddings) != len(chunks):
             update_document_status(doc.id, 'error', error='Embedding generation mismatch')
@@ -270,6 +257,11 @@ def main():
     
     logger.info(f"Found {len(documents)} pending documents")
     
+    trace_writer = enable_tracing(TRACE_FILE) if TRACE_FILE else None
+    profiler = Profiler(PROFILE_MODE) if PROFILE_MODE else None
+    if profiler is not None:
+        profiler.start()
+    
     # Process each document
     processed = 0
     failed = 0
@@ -280,6 +272,12 @@ def main():
         else:
             failed += 1
     
+    if trace_writer is not None:
+        disable_tracing(trace_writer)
+        logger.info(f"Traces written to {trace_writer.path}")
+    if profiler is not None:
+        logger.info(f"Profile written to {profiler.stop()}")
+    
     # Summary
     logger.info("")
     logger.info("=" * 60)
@@ -0,0 +1,427 @@
+"""
+Profiling Hooks
+
+Instrumentation for finding out where a backfill spends its time, per document
+and per run, so a slow night can be pinned on the network, the parser or the
+embedder.
+
+- Spans: `with timer('extract'):` and `@profiled('download')` time a part of
+  a document's processing. Every span is recorded in the stage latency
+  histograms of metrics.py, and in the trace of the document the current
+  thread is working on, if any. Span names are the same for every document
+  format: status, download, extract, chunk, embed, upload.
+- Per-document traces: each document gets a DocumentTrace holding its spans.
+  Finished traces go to the registered hooks; TraceWriter is the built-in hook
+  and appends them to a JSONL file (--trace-file / TRACE_FILE).
+- Run profiles (--profile / PROFILE): 'cprofile' writes a pstats file for
+  snakeviz or `python -m pstats`. 'sample' polls every thread's stack every
+  PROFILE_SAMPLE_INTERVAL seconds and writes folded stacks, the format of
+  flamegraph.pl, speedscope and `py-spy record --format raw`. Sampling costs
+  little and sees all threads, which suits the threaded modes.
+
+Usage:
+    python profiling.py data/trace.jsonl           # Where the time went, per span
+    python profiling.py data/trace.jsonl --slowest 20
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import pstats
+import cProfile
+import argparse
+import functools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+import logging
+
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+TRACE_FILE = os.getenv('TRACE_FILE') or None
+PROFILE_MODE = os.getenv('PROFILE') or None
+PROFILE_MODES = ('cprofile', 'sample')
+DEFAULT_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.01'))
+PROFILE_DIR = Path(__file__).parent / 'data'
+
+# Samples whose innermost frame is in one of these files are threads waiting for work
+IDLE_FILES = ('threading.py', 'queue.py', 'thread.py')
+
+TraceHook = Callable[[Dict], None]
+
+_hooks: List[TraceHook] = []
+_hooks_lock = threading.Lock()
+_metrics = get_metrics()
+
+
+class DocumentTrace:
+    """Spans recorded while one document is processed. Its steps run one at a time, in any thread."""
+
+    __slots__ = ('doc_id', 'started_at', '_t0', 'spans')
+
+    def __init__(self, doc_id: str):
+        self.doc_id = doc_id
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.spans: List[tuple] = []
+
+    def add(self, name: str, started: float, seconds: float):
+        """Add a span that began at perf_counter() value `started`."""
+        self.spans.append((name, started - self._t0, seconds))
+
+    def to_record(self, status: str, error: Optional[str] = None) -> Dict:
+        totals: Dict[str, float] = {}
+        for name, _, seconds in self.spans:
+            totals[name] = totals.get(name, 0.0) + seconds
+        record = {
+            'id': self.doc_id,
+            'status': status,
+            'started_at': round(self.started_at, 3),
+            'seconds': round(time.perf_counter() - self._t0, 6),
+            'totals': {name: round(seconds, 6) for name, seconds in totals.items()},
+            'spans': [{'name': name, 'start': round(start, 6), 'seconds': round(seconds, 6)}
+                      for name, start, seconds in self.spans],
+        }
+        if error:
+            record['error'] = error
+        return record
+
+
+class _Local(threading.local):
+    # A class default: looking up a missing thread-local attribute costs more than the timer itself
+    trace: Optional[DocumentTrace] = None
+
+
+_local = _Local()
+
+
+def add_hook(hook: TraceHook):
+    """Call `hook(record)` with every finished document trace (see DocumentTrace.to_record)."""
+    with _hooks_lock:
+        _hooks.append(hook)
+
+
+def remove_hook(hook: TraceHook):
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def start_trace(doc_id: str) -> Optional[DocumentTrace]:
+    """A new trace for a document, or None when no hook would receive it."""
+    return DocumentTrace(doc_id) if _hooks else None
+
+
+def finish_trace(trace: Optional[DocumentTrace], status: str, error: Optional[str] = None):
+    """Hand a finished trace to the hooks. A hook that fails is logged and does not stop the others."""
+    if trace is None:
+        return
+    record = trace.to_record(status, error)
+    for hook in list(_hooks):
+        try:
+            hook(record)
+        except Exception as e:
+            logger.warning(f"Trace hook {hook!r} failed for {trace.doc_id}: {e}")
+
+
+def current_trace() -> Optional[DocumentTrace]:
+    return _local.trace
+
+
+@contextmanager
+def activate(trace: Optional[DocumentTrace]):
+    """Make `trace` the one timer() and @profiled record into, in this thread, for the block."""
+    previous = _local.trace
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+def record_span(trace: Optional[DocumentTrace], name: str, started: float, seconds: float):
+    """Record a span timed by the caller: in the stage metrics, and in `trace` unless it is None."""
+    _metrics.observe(name, seconds)
+    if trace is not None:
+        trace.add(name, started, seconds)
+
+
+@contextmanager
+def trace_span(trace: Optional[DocumentTrace], name: str):
+    """A span of an explicit trace (e.g. in a coroutine, where thread-locals do not apply)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(trace, name, started, time.perf_counter() - started)
+
+
+def timer(name: str):
+    """Context manager timing a span of the current thread's trace, if any."""
+    return trace_span(_local.trace, name)
+
+
+def profiled(name: str) -> Callable:
+    """Decorator timing each call as a span of the current thread's trace, if any."""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with trace_span(_local.trace, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class IterationTimer:
+    """
+    Wraps an iterator and adds up the time spent producing its items.
+
+    For producers and consumers that interleave, like PDF pages read while they
+    are chunked: the producer's time is `seconds`, the rest belongs to the consumer.
+    """
+
+    def __init__(self, iterable: Iterable):
+        self._iterator = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self) -> Iterator:
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+
+def traced(func: Callable) -> Callable:
+    """Decorator for steps taking a work item first: its `trace` is current while the step runs."""
+    @functools.wraps(func)
+    def wrapper(work, *args, **kwargs):
+        if work.trace is None:
+            return func(work, *args, **kwargs)
+        with activate(work.trace):
+            return func(work, *args, **kwargs)
+    return wrapper
+
+
+class TraceWriter:
+    """Trace hook appending one JSON line per finished document."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.records = 0
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def __call__(self, record: Dict):
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def enable_tracing(path: Path) -> TraceWriter:
+    """Start writing document traces to `path`. Undo with disable_tracing()."""
+    writer = TraceWriter(path)
+    add_hook(writer)
+    return writer
+
+
+def disable_tracing(writer: TraceWriter):
+    remove_hook(writer)
+    writer.close()
+
+
+class Profiler:
+    """
+    Profiles a whole run, as a cProfile pstats file or as sampled folded stacks.
+
+    cProfile only sees the thread that enabled it before Python 3.12, so one is
+    started in every thread created while profiling; their stats are merged on
+    stop(). Threads that already exist (e.g. a reused executor) are missed.
+    """
+
+    def __init__(self, mode: str, path: Optional[Path] = None,
+                 interval: float = DEFAULT_SAMPLE_INTERVAL, include_idle: bool = False):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"profile mode must be one of {PROFILE_MODES}, got {mode!r}")
+        self.mode = mode
+        self.path = Path(path) if path else PROFILE_DIR / ('profile.prof' if mode == 'cprofile' else 'profile.folded')
+        self.interval = interval
+        self.include_idle = include_idle
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._profiles: List[cProfile.Profile] = []
+        self._stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.mode == 'cprofile':
+            if sys.version_info < (3, 12):
+                threading.setprofile(self._start_thread_profile)
+            profile = cProfile.Profile()
+            self._profiles.append(profile)
+            profile.enable()
+        else:
+            self._thread = threading.Thread(target=self._sample_loop, name='profile-sampler', daemon=True)
+            self._thread.start()
+
+    def _start_thread_profile(self, *args):
+        # Runs once, as the first profile event of a new thread, and replaces itself
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        profile.enable()
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: _thread_group(thread.name) for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if not self.include_idle and os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, 'thread'))
+                self._stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self) -> Path:
+        """Stop profiling and write the profile. Returns its path."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.mode == 'cprofile':
+            threading.setprofile(None)
+            self._profiles[0].disable()
+            with self._lock:
+                profiles = list(self._profiles)
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                profile.create_stats()
+                if profile.stats:
+                    stats.add(profile)
+            stats.dump_stats(str(self.path))
+        else:
+            self._stop.set()
+            self._thread.join()
+            with open(self.path, 'w') as f:
+                for stack, count in sorted(self._stacks.items()):
+                    f.write(f"{stack} {count}\n")
+        return self.path
+
+    def summary_lines(self, limit: int = 10) -> List[str]:
+        """The functions with the most time (cprofile: cumulative, sample: samples where they were running)."""
+        if self.mode == 'cprofile':
+            stats = pstats.Stats(str(self.path))
+            rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+            return [f"{ct:9.2f}s  {func[2]} ({os.path.basename(func[0])}:{func[1]})"
+                    for func, (_, _, _, ct, _) in rows[:limit]]
+        own: Counter = Counter()
+        for stack, count in self._stacks.items():
+            own[stack.rsplit(';', 1)[-1]] += count
+        total = sum(own.values()) or 1
+        return [f"{count * 100 / total:6.1f}%  {frame}" for frame, count in own.most_common(limit)]
+
+
+def _thread_group(name: str) -> str:
+    # Threads of one pool share a name prefix (parse_0, ThreadPoolExecutor-0_3, ...)
+    return re.sub(r'[_-]\d+$', '', name)
+
+
+def load_traces(path: Path) -> List[Dict]:
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # A torn last line from a killed run
+                continue
+    return records
+
+
+def summarize(records: List[Dict]) -> Dict:
+    """Per span: documents, total seconds, share of all span time, mean, p50, p95 and max."""
+    per_span: Dict[str, List[float]] = {}
+    for record in records:
+        for name, seconds in record.get('totals', {}).items():
+            per_span.setdefault(name, []).append(seconds)
+    grand_total = sum(sum(values) for values in per_span.values()) or 1.0
+
+    spans = {}
+    for name, values in sorted(per_span.items(), key=lambda item: -sum(item[1])):
+        values.sort()
+        total = sum(values)
+        spans[name] = {
+            'documents': len(values),
+            'total_seconds': total,
+            'share': total / grand_total,
+            'mean': total / len(values),
+            'p50': _percentile(values, 0.50),
+            'p95': _percentile(values, 0.95),
+            'max': values[-1],
+        }
+    return {
+        'documents': len(records),
+        'failed': sum(1 for record in records if record.get('status') == 'error'),
+        'spans': spans,
+    }
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    # Nearest rank
+    index = max(0, min(len(sorted_values) - 1, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize a per-document trace file (--trace-file)')
+    parser.add_argument('path', type=Path, help='Trace file (JSONL)')
+    parser.add_argument('--slowest', type=int, default=5, help='Slowest documents to list (default: 5)')
+    parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+    args = parser.parse_args()
+
+    if not args.path.exists():
+        parser.error(f"{args.path} does not exist")
+    records = load_traces(args.path)
+    summary = summarize(records)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    print(f"{args.path}: {summary['documents']} documents ({summary['failed']} failed)")
+    print(f"  {'span':<14} {'docs':>6} {'total':>10} {'share':>7} {'mean':>9} {'p50':>9} {'p95':>9} {'max':>9}")
+    for name, s in summary['spans'].items():
+        print(f"  {name:<14} {s['documents']:>6} {s['total_seconds']:>9.1f}s {s['share'] * 100:>6.1f}% "
+              f"{s['mean']:>8.3f}s {s['p50']:>8.3f}s {s['p95']:>8.3f}s {s['max']:>8.3f}s")
+
+    if args.slowest:
+        print(f"  Slowest documents:")
+        for record in sorted(records, key=lambda r: r.get('seconds', 0.0), reverse=True)[:args.slowest]:
+            parts = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in
+                              sorted(record.get('totals', {}).items(), key=lambda item: -item[1]))
+            print(f"    {record['id']:<24} {record.get('seconds', 0.0):>8.2f}s  {record.get('status')}  ({parts})")
+
+
+if __name__ == '__main__':
+    main()
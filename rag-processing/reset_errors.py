@@ -2,20 +2,10 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-import os
-import requests
+from http_client import DATABASE_ID, cloudflare_url, cloudflare_headers, request
 
-CLOUDFLARE_ACCOUNT_ID = os.getenv('CLOUDFLARE_ACCOUNT_ID')
-CLOUDFLARE_API_TOKEN = os.getenv('CLOUDFLARE_API_TOKEN')
-DATABASE_ID = os.getenv('DATABASE_ID')
-
-url = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/d1/database/{DATABASE_ID}/query"
-headers = {
-    'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}',
-    'Content-Type': 'application/json'
-}
-
-response = requests.post(url, headers=headers, json={
+response = request('POST', cloudflare_url(f"/d1/database/{DATABASE_ID}/query"), endpoint='d1',
+                   headers=cloudflare_headers(), json={
     'sql': "UPDATE documents SET status = 'pending', error_message = NULL WHERE status = 'error'"
 })
 
@@ -0,0 +1,140 @@
+"""
+Text Segmentation
+
+Precompiled patterns and a single-pass scanner for splitting extracted text
+into paragraphs, sentences and section-header candidates. scan_paragraphs()
+runs one combined regex over the whole document and returns every paragraph
+with its offsets, its header (if it opens with one) and the positions of its
+sentence boundaries, so the chunker never re-splits or re-searches the text.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+# Paragraphs are separated by a blank line; sentences by whitespace after
+# terminal punctuation when the next sentence starts with a capital.
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+(?=[A-Z])')
+
+# Both boundaries in one pattern. It opens with the character class shared by
+# the two branches, which lets the regex engine skip ahead to candidate
+# characters instead of trying both branches at every position. Inside a
+# paragraph a whitespace run holds at most one newline (two would be a
+# paragraph break), which keeps a sentence break from swallowing the paragraph
+# break that follows it.
+BOUNDARY = re.compile(
+    r'[\n.!?](?:'
+    r'(?<=\n)(?P<paragraph>\s*\n)'
+    r'|(?<!\n)(?P<sentence>(?=\s)[^\S\n]*\n?[^\S\n]*)(?=[A-Z])'
+    r')'
+)
+
+# Common academic paper sections, or numbered sections like "2. Patient Cohort"
+SECTION_HEADER = re.compile(
+    r'(?:Abstract|Introduction|Background|Methods?|Materials?\s+and\s+Methods?|Results?'
+    r'|Discussion|Conclusions?|References|Acknowledgements?)\s*$'
+    r'|\d+\.?\s+[A-Z][A-Za-z\s]+$',
+    re.IGNORECASE
+)
+
+# pdf_parser.clean_text: lines that are only a page number, a "Page X of Y"
+# footer or a URL, and whitespace runs
+PDF_NOISE_LINE = re.compile(r'^\s*(?:\d+|Page \d+ of \d+|www\..+|https?://.+)\s*$', re.MULTILINE)
+WHITESPACE = re.compile(r'\s+')
+
+
+@dataclass
+class Span:
+    """A stripped piece of the source text and where it sits in it."""
+    text: str
+    start: int
+    end: int
+
+
+@dataclass
+class Paragraph(Span):
+    header: Optional[str] = None
+    # (start, end) offsets of the whitespace between sentences
+    sentence_breaks: List[Tuple[int, int]] = field(default_factory=list)
+
+    def sentences(self) -> List[Span]:
+        """The paragraph's sentences, cut at the boundaries found by the scan."""
+        spans = []
+        start = self.start
+        for break_start, break_end in self.sentence_breaks:
+            spans.append(Span(self.text[start - self.start:break_start - self.start], start, break_start))
+            start = break_end
+        spans.append(Span(self.text[start - self.start:], start, self.end))
+        return spans
+
+
+def split_spans(text: str, pattern: re.Pattern, offset: int = 0) -> List[Span]:
+    """Split text on a boundary pattern into stripped, non-empty spans with absolute offsets."""
+    spans = []
+    start = 0
+    for match in pattern.finditer(text):
+        _append_stripped(spans, text, start, match.start(), offset)
+        start = match.end()
+    _append_stripped(spans, text, start, len(text), offset)
+    return spans
+
+
+def _append_stripped(spans: List[Span], text: str, start: int, end: int, offset: int):
+    piece = text[start:end]
+    stripped = piece.strip()
+    if stripped:
+        start += len(piece) - len(piece.lstrip())
+        spans.append(Span(stripped, offset + start, offset + start + len(stripped)))
+
+
+def section_header(paragraph: str) -> Optional[str]:
+    """The paragraph's first line, if it is a section header."""
+    first_line = paragraph.split('\n', 1)[0].strip()
+    return first_line if SECTION_HEADER.match(first_line) else None
+
+
+def scan_paragraphs(text: str, offset: int = 0) -> List[Paragraph]:
+    """
+    Segment a document in one pass.
+
+    Returns the same paragraphs as split_spans(text, PARAGRAPH_BREAK, offset),
+    each with its section header and sentence boundaries filled in. `offset` is
+    added to every position, for text that is one piece of a larger document.
+    """
+    paragraphs = []
+    start = 0
+    sentence_breaks = []
+    for match in BOUNDARY.finditer(text):
+        if match.lastgroup == 'sentence':
+            sentence_breaks.append(match.span('sentence'))
+        else:
+            _append_paragraph(paragraphs, text, start, match.start(), sentence_breaks, offset)
+            start = match.end()
+            sentence_breaks = []
+    _append_paragraph(paragraphs, text, start, len(text), sentence_breaks, offset)
+    return paragraphs
+
+
+def _append_paragraph(paragraphs: List[Paragraph], text: str, start: int, end: int,
+                      sentence_breaks: List[Tuple[int, int]], offset: int):
+    piece = text[start:end]
+    stripped = piece.strip()
+    if not stripped:
+        return
+    start += len(piece) - len(piece.lstrip())
+    end = start + len(stripped)
+    paragraphs.append(Paragraph(
+        text=stripped,
+        start=offset + start,
+        end=offset + end,
+        header=section_header(stripped),
+        # Whitespace at the paragraph edges was stripped, so can't be a boundary
+        sentence_breaks=[(offset + s, offset + e) for s, e in sentence_breaks if start < s and e < end]
+    ))
+
+
+def clean_pdf_text(text: str) -> str:
+    """Drop page-number/footer/URL lines and collapse whitespace."""
+    text = PDF_NOISE_LINE.sub('', text)
+    return WHITESPACE.sub(' ', text).strip()
@@ -0,0 +1,150 @@
+"""
+Sharded Backfill Helpers
+
+Splits the document corpus into N shards so independent backfill_gpu.py runs
+(`--shard i/N`, one per host) can share a full re-embed without a coordination
+service. A document belongs to shard `sha1(id) mod N`, so every host computes
+the same partition from the id alone, whatever order documents are fetched in
+and whatever their status. Each shard keeps its own checkpoint and stats file
+(backfill_checkpoint.shard-i-of-N.json, backfill_stats.shard-i-of-N.json).
+
+Usage:
+    python sharding.py                                  # Merge data/backfill_stats*.json
+    python sharding.py host1/backfill_stats.shard-*.json host2/...
+    python sharding.py --json > merged_stats.json
+"""
+
+import json
+import glob
+import socket
+import hashlib
+import argparse
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+DATA_DIR = Path(__file__).parent / 'data'
+STATS_FILE = DATA_DIR / 'backfill_stats.json'
+
+# Counters that add up across shards
+SUMMED_FIELDS = ('documents_processed', 'documents_failed', 'chunks_created', 'vectors_uploaded')
+
+Shard = Tuple[int, int]  # (index, count), index in 0..count-1
+
+
+def parse_shard(value: str) -> Shard:
+    """Parse 'i/N' (0 <= i < N). Raises ValueError otherwise."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f"shard must look like i/N, got {value!r}")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"shard index must be in 0..{count - 1}, got {value!r}")
+    return index, count
+
+
+def shard_of(doc_id: str, count: int) -> int:
+    """Shard a document id belongs to. Stable across hosts and Python processes (unlike hash())."""
+    digest = hashlib.sha1(doc_id.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+
+def in_shard(doc_id: str, shard: Optional[Shard]) -> bool:
+    if shard is None:
+        return True
+    index, count = shard
+    return shard_of(doc_id, count) == index
+
+
+def shard_path(path: Path, shard: Optional[Shard]) -> Path:
+    """Per-shard variant of a checkpoint or stats file: name.shard-i-of-N.json. Unchanged without a shard."""
+    if shard is None:
+        return path
+    index, count = shard
+    return path.with_name(f"{path.stem}.shard-{index}-of-{count}{path.suffix}")
+
+
+def write_stats(path: Path, stats: Dict, shard: Optional[Shard]):
+    """Write a run's final stats (BackfillStats fields) with the shard and host, for merge_stats()."""
+    index, count = shard if shard else (None, None)
+    run = dict(stats, shard_index=index, shard_count=count, host=socket.gethostname(),
+               finished_at=datetime.now().isoformat())
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(run, f, indent=2)
+
+
+def merge_stats(runs: List[Dict]) -> Dict:
+    """
+    Aggregate the stats files of several shards.
+
+    Counters are summed. Shards run in parallel, so the combined throughput is
+    the documents attempted over the longest shard's elapsed time. Shards that
+    are missing, duplicated or split with a different N are reported so a
+    partial merge is not mistaken for the whole corpus.
+    """
+    merged = {field: sum(run.get(field, 0) for run in runs) for field in SUMMED_FIELDS}
+    elapsed = max((run.get('elapsed_seconds', 0.0) for run in runs), default=0.0)
+    attempted = merged['documents_processed'] + merged['documents_failed']
+    merged['elapsed_seconds'] = elapsed
+    merged['docs_per_min'] = attempted / (elapsed / 60) if elapsed > 0 else 0.0
+    merged['started_at'] = min((run['started_at'] for run in runs if run.get('started_at')), default=None)
+    merged['finished_at'] = max((run['finished_at'] for run in runs if run.get('finished_at')), default=None)
+
+    counts = sorted({run['shard_count'] for run in runs if run.get('shard_count')})
+    indexes = [run['shard_index'] for run in runs if run.get('shard_count')]
+    merged['shard_counts'] = counts
+    merged['shards'] = sorted(set(indexes))
+    merged['duplicate_shards'] = sorted({i for i in indexes if indexes.count(i) > 1})
+    merged['missing_shards'] = (
+        sorted(set(range(counts[0])) - set(indexes)) if len(counts) == 1 else []
+    )
+    return merged
+
+
+def load_stats(paths: List[Path]) -> List[Dict]:
+    runs = []
+    for path in paths:
+        with open(path) as f:
+            run = json.load(f)
+        run['path'] = str(path)
+        runs.append(run)
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge the stats files of sharded backfill runs')
+    parser.add_argument('files', nargs='*', type=Path,
+                        help=f'Stats files to merge (default: {DATA_DIR}/backfill_stats*.json)')
+    parser.add_argument('--json', action='store_true', help='Print the merged stats as JSON')
+    args = parser.parse_args()
+
+    paths = args.files or [Path(p) for p in sorted(glob.glob(str(DATA_DIR / 'backfill_stats*.json')))]
+    if not paths:
+        parser.error(f"no stats files given and none found in {DATA_DIR}")
+    runs = load_stats(paths)
+    merged = merge_stats(runs)
+
+    if args.json:
+        print(json.dumps({'merged': merged, 'runs': runs}, indent=2))
+        return
+
+    for run in sorted(runs, key=lambda r: (r['shard_index'] if r.get('shard_count') else -1, r['path'])):
+        shard = f"{run['shard_index']}/{run['shard_count']}" if run.get('shard_count') else 'unsharded'
+        print(f"  {shard:>9}  {run.get('host', '?'):<20} {run.get('documents_processed', 0):>8} ok "
+              f"{run.get('documents_failed', 0):>6} failed {run.get('chunks_created', 0):>10} chunks "
+              f"{run.get('elapsed_seconds', 0.0):>9.0f}s")
+    print(f"  Total: {merged['documents_processed']} processed, {merged['documents_failed']} failed, "
+          f"{merged['chunks_created']} chunks, {merged['vectors_uploaded']} vectors")
+    print(f"  Throughput: {merged['docs_per_min']:.1f} docs/min over {merged['elapsed_seconds']:.0f}s "
+          f"(longest shard)")
+    if len(merged['shard_counts']) > 1:
+        print(f"  ⚠️  Files come from different shard counts: {merged['shard_counts']}")
+    if merged['missing_shards']:
+        print(f"  ⚠️  Missing shards: {', '.join(map(str, merged['missing_shards']))}")
+    if merged['duplicate_shards']:
+        print(f"  ⚠️  Shards with more than one stats file: {', '.join(map(str, merged['duplicate_shards']))}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""
+Batched Status Writer
+
+Buffers document status transitions ('processing', 'ready', 'error') and study
+"processed" marks, and writes them to D1 as a few batched UPDATE statements
+instead of one API round trip per transition. Only the latest transition of a
+document is written, so a document that goes 'processing' -> 'ready' between
+flushes costs no round trip of its own.
+
+The buffer is flushed when it holds `max_pending` entries, when the oldest entry
+has waited `flush_interval` seconds, on flush(), and on close() / interpreter
+exit.
+"""
+
+import time
+import atexit
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+import logging
+
+from http_client import query_d1
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_SIZE = 200
+DEFAULT_FLUSH_INTERVAL = 5.0  # Seconds
+
+# D1 rejects statements with more bound parameters than this
+MAX_D1_PARAMS = 100
+
+Statement = Tuple[str, List]
+
+
+@dataclass(frozen=True)
+class StatusUpdate:
+    status: str
+    chunk_count: int = 0
+    error: Optional[str] = None
+
+
+def _chunked(items: List, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def build_status_statements(updates: Dict[str, StatusUpdate],
+                            max_params: int = MAX_D1_PARAMS) -> List[Tuple[Statement, List[str]]]:
+    """
+    Turn pending status updates into batched UPDATE statements.
+
+    Documents are grouped by status and by which optional columns they set; each
+    group becomes `UPDATE documents SET status = ?, col = CASE id WHEN ? THEN ? ... END
+    WHERE id IN (...)`, split so no statement exceeds `max_params`. Columns match
+    what the API's PATCH /api/documents/{id}/status writes.
+
+    Returns (statement, document ids it covers) pairs.
+    """
+    groups: Dict[tuple, List[str]] = {}
+    for doc_id, update in updates.items():
+        key = (update.status, update.chunk_count > 0, bool(update.error))
+        groups.setdefault(key, []).append(doc_id)
+
+    statements = []
+    for (status, has_count, has_error), doc_ids in groups.items():
+        case_columns = []
+        if has_error:
+            case_columns.append(('error_message', lambda u: u.error))
+        if has_count:
+            case_columns.append(('chunk_count', lambda u: u.chunk_count))
+
+        # One for the IN list, two per CASE arm
+        per_doc = 1 + 2 * len(case_columns)
+        for batch in _chunked(doc_ids, (max_params - 1) // per_doc):
+            assignments = ['status = ?']
+            params = [status]
+            if status == 'ready':
+                assignments.append("processed_at = datetime('now')")
+            for column, value in case_columns:
+                assignments.append(f"{column} = CASE id {' '.join(['WHEN ? THEN ?'] * len(batch))} END")
+                for doc_id in batch:
+                    params.extend([doc_id, value(updates[doc_id])])
+
+            placeholders = ', '.join(['?'] * len(batch))
+            sql = f"UPDATE documents SET {', '.join(assignments)} WHERE id IN ({placeholders})"
+            statements.append(((sql, params + batch), batch))
+
+    return statements
+
+
+def build_study_statements(studies: Dict[Tuple[str, str], set],
+                           max_params: int = MAX_D1_PARAMS) -> List[Tuple[Statement, Tuple[str, str, List]]]:
+    """
+    Turn pending study marks, keyed by (match column, extraction method), into
+    batched UPDATE statements. Returns (statement, (column, method, values)) pairs.
+    """
+    statements = []
+    for (column, method), values in studies.items():
+        for batch in _chunked(sorted(values, key=str), max_params - 1):
+            placeholders = ', '.join(['?'] * len(batch))
+            sql = (f"UPDATE studies SET extraction_method = ?, processed_at = datetime('now') "
+                   f"WHERE {column} IN ({placeholders})")
+            statements.append(((sql, [method] + batch), (column, method, batch)))
+    return statements
+
+
+class StatusWriter:
+    """
+    Thread-safe buffer of D1 status writes with a background flush thread.
+
+    `calls` counts the updates handed to the writer (each would otherwise have
+    been its own request) and `round_trips` the statements actually sent;
+    `saved_round_trips` is the difference.
+    """
+
+    def __init__(self, max_pending: int = DEFAULT_FLUSH_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 query: Callable[[str, List], dict] = query_d1):
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self._query = query
+        self._documents: Dict[str, StatusUpdate] = {}
+        self._studies: Dict[Tuple[str, str], set] = {}
+        self._oldest: Optional[float] = None
+        self._closed = False
+        self._cond = threading.Condition()
+        # Serializes flushes so an older batch can't land after a newer one
+        self._flush_lock = threading.Lock()
+
+        # Counters for reporting
+        self.calls = 0
+        self.round_trips = 0
+        self.failed_round_trips = 0
+
+        self._thread = threading.Thread(target=self._run, name='status-writer', daemon=True)
+        self._thread.start()
+
+    @property
+    def saved_round_trips(self) -> int:
+        return self.calls - self.round_trips
+
+    def _pending(self) -> int:
+        return len(self._documents) + sum(len(v) for v in self._studies.values())
+
+    def _added(self):
+        """Bookkeeping after buffering an entry. Caller holds _cond."""
+        self.calls += 1
+        if self._oldest is None:
+            # Wake the flush thread to start the interval timer
+            self._oldest = time.monotonic()
+            self._cond.notify()
+        elif self._pending() >= self.max_pending:
+            self._cond.notify()
+
+    def update_document_status(self, doc_id: str, status: str, chunk_count: int = 0, error: str = None) -> bool:
+        """Buffer a status transition; it replaces any unflushed one for the same document."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("StatusWriter is closed")
+            self._documents[doc_id] = StatusUpdate(status, chunk_count, error)
+            self._added()
+        return True
+
+    def mark_study_processed(self, column: str, value, extraction_method: str) -> bool:
+        """Buffer `UPDATE studies SET extraction_method = ?, processed_at = now WHERE column = value`."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("StatusWriter is closed")
+            self._studies.setdefault((column, extraction_method), set()).add(value)
+            self._added()
+        return True
+
+    def flush(self):
+        """Write everything buffered so far. Entries whose statement fails are re-buffered."""
+        with self._flush_lock:
+            with self._cond:
+                documents, self._documents = self._documents, {}
+                studies, self._studies = self._studies, {}
+                self._oldest = None
+
+            for (sql, params), doc_ids in build_status_statements(documents):
+                if not self._send(sql, params):
+                    self._requeue_documents({d: documents[d] for d in doc_ids})
+
+            for (sql, params), (column, method, values) in build_study_statements(studies):
+                if not self._send(sql, params):
+                    with self._cond:
+                        self._studies.setdefault((column, method), set()).update(values)
+                        self._oldest = self._oldest or time.monotonic()
+
+    def _send(self, sql: str, params: List) -> bool:
+        self.round_trips += 1
+        try:
+            self._query(sql, params)
+            return True
+        except Exception as e:
+            self.failed_round_trips += 1
+            logger.error(f"Batched status write failed ({len(params)} params): {e}")
+            return False
+
+    def _requeue_documents(self, updates: Dict[str, StatusUpdate]):
+        with self._cond:
+            for doc_id, update in updates.items():
+                # A newer transition recorded during the flush wins
+                self._documents.setdefault(doc_id, update)
+            self._oldest = self._oldest or time.monotonic()
+
+    def close(self):
+        """Stop the flush thread and write whatever is still buffered."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+
+        with self._cond:
+            if self._pending():
+                logger.error(f"{self._pending()} status update(s) could not be written: "
+                             f"{sorted(self._documents)[:20]}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._oldest is not None:
+                        timeout = self._oldest + self.flush_interval - time.monotonic()
+                        if timeout <= 0 or self._pending() >= self.max_pending:
+                            break
+                        self._cond.wait(timeout)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+            self.flush()
+
+
+_writer: Optional[StatusWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_status_writer(max_pending: int = DEFAULT_FLUSH_SIZE,
+                      flush_interval: float = DEFAULT_FLUSH_INTERVAL) -> StatusWriter:
+    """Get or start the shared status writer. It is flushed and closed at interpreter exit."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = StatusWriter(max_pending=max_pending, flush_interval=flush_interval)
+                atexit.register(shutdown_status_writer)
+                logger.info(f"Status writer started (flush at {max_pending} updates or every {flush_interval:g}s)")
+    return _writer
+
+
+def shutdown_status_writer():
+    """Flush and stop the shared status writer, if one was started, and log the round trips saved."""
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+            logger.info(f"Status writer: {_writer.calls} updates in {_writer.round_trips} round trips "
+                        f"({_writer.saved_round_trips} saved, {_writer.failed_round_trips} failed)")
+            _writer = None
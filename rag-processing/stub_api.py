@@ -0,0 +1,204 @@
+"""
+Local Stand-in API Server
+
+A small HTTP server that answers the LeukemiaLens API endpoints used by the
+processing scripts, so uploads and status updates can be exercised without the
+Cloudflare Worker:
+
+- POST  /api/chunks/batch              JSON or binary chunk batches (decoded and validated)
+- PATCH /api/documents/{id}/status     status updates
+- GET   /api/documents/{id}/content    files from --documents-dir named {id}.pdf / {id}.tgz
+- GET   /__stats                       counters for everything received
+
+Usage:
+    python stub_api.py --port 8787 --documents-dir data/stub_documents
+    API_BASE_URL=http://127.0.0.1:8787 python backfill_gpu.py --upload-format binary
+"""
+
+import re
+import json
+import time
+import argparse
+import logging
+import threading
+from pathlib import Path
+from typing import Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from chunk_payload import FRAME_CONTENT_TYPE, decode_chunk_batch_binary
+
+logger = logging.getLogger(__name__)
+
+EXPECTED_DIMENSION = 768
+
+_STATUS_PATH = re.compile(r'^/api/documents/([^/]+)/status$')
+_CONTENT_PATH = re.compile(r'^/api/documents/([^/]+)/content$')
+
+
+class StubState:
+    """Everything the stub has received, for assertions and reports."""
+
+    def __init__(self, documents_dir: Optional[Path] = None):
+        self.documents_dir = documents_dir
+        self.lock = threading.Lock()
+        self.statuses = {}
+        self.chunk_batches = 0
+        self.chunks_received = 0
+        self.bytes_received = {'json': 0, 'binary': 0}
+        self.requests = 0
+        self.started_at = time.time()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'chunkBatches': self.chunk_batches,
+                'chunksReceived': self.chunks_received,
+                'bytesReceived': dict(self.bytes_received),
+                'statusUpdates': len(self.statuses),
+                'statuses': dict(self.statuses),
+                'uptimeSeconds': time.time() - self.started_at,
+            }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = 'LeukemiaLensStub/1.0'
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+    @property
+    def state(self) -> StubState:
+        return self.server.state
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send_json(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _count_request(self):
+        with self.state.lock:
+            self.state.requests += 1
+
+    def do_GET(self):
+        self._count_request()
+        if self.path == '/__stats':
+            return self._send_json(self.state.snapshot())
+
+        match = _CONTENT_PATH.match(self.path)
+        if match and self.state.documents_dir:
+            for ext in ('.pdf', '.tgz'):
+                path = self.state.documents_dir / f"{match.group(1)}{ext}"
+                if path.exists():
+                    data = path.read_bytes()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/pdf' if ext == '.pdf' else 'application/xml')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+        self._send_json({'error': 'Not found'}, 404)
+
+    def do_PATCH(self):
+        self._count_request()
+        match = _STATUS_PATH.match(self.path)
+        body = self._read_body()
+        if not match:
+            return self._send_json({'error': 'Not found'}, 404)
+
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            return self._send_json({'error': 'Invalid JSON'}, 400)
+        if not payload.get('status'):
+            return self._send_json({'error': 'Status is required'}, 400)
+
+        with self.state.lock:
+            self.state.statuses[match.group(1)] = payload['status']
+        self._send_json({'success': True, 'document': {'id': match.group(1), **payload}})
+
+    def do_POST(self):
+        self._count_request()
+        body = self._read_body()
+        if self.path != '/api/chunks/batch':
+            return self._send_json({'error': 'Not found'}, 404)
+
+        content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip()
+        try:
+            if content_type == FRAME_CONTENT_TYPE:
+                wire_format = 'binary'
+                document_id, chunks, vectors = decode_chunk_batch_binary(body)
+                dimensions = {vectors.shape[1]} if len(chunks) else set()
+            else:
+                wire_format = 'json'
+                payload = json.loads(body)
+                document_id, chunks = payload.get('documentId'), payload.get('chunks') or []
+                dimensions = {len(c.get('embedding') or []) for c in chunks}
+        except (ValueError, KeyError) as e:
+            return self._send_json({'success': False, 'chunksCreated': 0, 'vectorsUpserted': 0,
+                                    'error': f'Malformed body: {e}'}, 400)
+
+        if not document_id or not chunks:
+            return self._send_json({'success': False, 'chunksCreated': 0, 'vectorsUpserted': 0,
+                                    'error': 'documentId and chunks are required'}, 400)
+        if dimensions != {EXPECTED_DIMENSION}:
+            return self._send_json({'success': False, 'chunksCreated': 0, 'vectorsUpserted': 0,
+                                    'error': f'Unexpected embedding dimensions: {sorted(dimensions)}'}, 400)
+
+        with self.state.lock:
+            self.state.chunk_batches += 1
+            self.state.chunks_received += len(chunks)
+            self.state.bytes_received[wire_format] += len(body)
+
+        self._send_json({'success': True, 'chunksCreated': len(chunks), 'vectorsUpserted': len(chunks)})
+
+
+def make_server(host: str = '127.0.0.1', port: int = 8787, documents_dir: Optional[Path] = None) -> ThreadingHTTPServer:
+    """Create (but do not start) a stub server. Port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(documents_dir)
+    return server
+
+
+def start_in_thread(host: str = '127.0.0.1', port: int = 0, documents_dir: Optional[Path] = None) -> ThreadingHTTPServer:
+    """Start a stub server on a background thread; its URL is server_url(server)."""
+    server = make_server(host, port, documents_dir)
+    threading.Thread(target=server.serve_forever, name='stub-api', daemon=True).start()
+    return server
+
+
+def server_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the LeukemiaLens API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8787)
+    parser.add_argument('--documents-dir', type=Path, help='Directory of {id}.pdf / {id}.tgz files to serve')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = make_server(args.host, args.port, args.documents_dir)
+    logger.info(f"Stub API listening on {server_url(server)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info(f"Stub API stats: {json.dumps(server.state.snapshot(), indent=2)}")
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
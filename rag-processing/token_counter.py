@@ -0,0 +1,192 @@
+"""
+Token Counting
+
+Counts tokens with the embedding model's fast tokenizer (the `tokenizers`
+package) so chunks can be sized to fit the model's input window. Counts are
+computed in batches and memoized per text. Where the exact count doesn't
+matter the tokenizer is skipped: WordPiece gives every whitespace-separated word
+at least one token, so spans with more words than a caller's limit are known to
+exceed it.
+
+If the tokenizer can't be loaded (package missing, or no network/cache for the
+model files), counting falls back to a characters / 4 estimate. With
+HF_HUB_OFFLINE set, only local files are tried, so an offline host does not
+wait on Hub retries.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tokenizer to count with: a tokenizer.json path or a Hugging Face model id
+EMBEDDING_TOKENIZER = os.getenv('EMBEDDING_TOKENIZER', os.getenv('EMBEDDING_MODEL', 'BAAI/bge-base-en-v1.5'))
+
+# bge-base-en-v1.5 reads at most 512 tokens, [CLS] and [SEP] included
+MODEL_MAX_TOKENS = 512
+SPECIAL_TOKENS = 2
+MAX_CHUNK_TOKENS = MODEL_MAX_TOKENS - SPECIAL_TOKENS
+
+# Fallback approximation: 1 token ≈ 4 characters
+CHARS_PER_TOKEN = 4
+# Characters the chunker puts between the parts of a chunk ('\n\n' or ' ')
+SEPARATOR_CHARS = 2
+
+MEMO_SIZE = int(os.getenv('TOKEN_MEMO_SIZE', '65536'))  # Texts whose counts are remembered
+
+
+class TokenCounter:
+    """Thread-safe, memoized token counts. Without a tokenizer, counts are estimates."""
+
+    def __init__(self, tokenizer=None, memo_size: int = MEMO_SIZE):
+        self.tokenizer = tokenizer
+        self.memo_size = memo_size
+        # Keyed by (len, hash) rather than the text itself, to keep long paragraphs out of memory
+        self._memo: 'OrderedDict[Tuple[int, int], int]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters for reporting
+        self.memo_hits = 0
+        self.skipped = 0
+        self.tokenized = 0
+
+    @property
+    def exact(self) -> bool:
+        return self.tokenizer is not None
+
+    def count(self, text: str) -> int:
+        return self.count_many([text])[0]
+
+    def count_many(self, texts: List[str], limit: Optional[int] = None) -> List[int]:
+        """
+        Token counts (without special tokens) for each text, tokenizing all misses in one batch.
+
+        With a `limit`, a text whose word count already exceeds it is not
+        tokenized; its count is the word count, a lower bound that is > limit.
+        """
+        if self.tokenizer is None:
+            return [estimate_tokens(text) for text in texts]
+
+        counts: List[Optional[int]] = [None] * len(texts)
+        missing = []
+        with self._lock:
+            for i, text in enumerate(texts):
+                if limit is not None and len(text) > limit:
+                    words = len(text.split())
+                    if words > limit:
+                        counts[i] = words
+                        self.skipped += 1
+                        continue
+                key = (len(text), hash(text))
+                cached = self._memo.get(key)
+                if cached is None:
+                    missing.append(i)
+                else:
+                    self._memo.move_to_end(key)
+                    counts[i] = cached
+                    self.memo_hits += 1
+
+        if missing:
+            encodings = self.tokenizer.encode_batch([texts[i] for i in missing], add_special_tokens=False)
+            with self._lock:
+                for i, encoding in zip(missing, encodings):
+                    counts[i] = len(encoding.ids)
+                    self._memo[(len(texts[i]), hash(texts[i]))] = counts[i]
+                self.tokenized += len(missing)
+                while len(self._memo) > self.memo_size:
+                    self._memo.popitem(last=False)
+
+        return counts
+
+    def split(self, text: str, max_tokens: int) -> List[Tuple[int, int]]:
+        """Cut text into consecutive (start, end) character ranges of at most max_tokens tokens each."""
+        if self.tokenizer is None:
+            # Sized so each range's estimate is at most max_tokens
+            return _split_chars(text, max(1, max_tokens * CHARS_PER_TOKEN - SEPARATOR_CHARS))
+
+        offsets = self.tokenizer.encode(text, add_special_tokens=False).offsets
+        return [
+            (offsets[i][0], offsets[min(i + max_tokens, len(offsets)) - 1][1])
+            for i in range(0, len(offsets), max_tokens)
+        ]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Token estimate used without a tokenizer: characters / 4, rounded up.
+
+    Each text is also charged for one separator, so the estimates of a chunk's
+    parts add up to at least the estimate of the joined chunk and a chunk sized
+    by summing them stays within its limit.
+    """
+    return -(-(len(text) + SEPARATOR_CHARS) // CHARS_PER_TOKEN)
+
+
+def _split_chars(text: str, max_chars: int) -> List[Tuple[int, int]]:
+    """Character ranges of at most max_chars, cut at the last space when there is one."""
+    ranges = []
+    start = 0
+    while len(text) - start > max_chars:
+        cut = text.rfind(' ', start + 1, start + max_chars + 1)
+        end = cut if cut > start else start + max_chars
+        ranges.append((start, end))
+        start = end + 1 if cut > start else end
+    ranges.append((start, len(text)))
+    return ranges
+
+
+def load_tokenizer(name: str = EMBEDDING_TOKENIZER):
+    """
+    Load a fast tokenizer, or None if it can't be.
+
+    `name` is a tokenizer.json path or a model id. Model ids are looked up in
+    the local Hugging Face cache first (sentence-transformers puts the model's
+    tokenizer.json there), then downloaded from the Hub unless HF_HUB_OFFLINE
+    is set.
+    """
+    try:
+        from tokenizers import Tokenizer
+        path = name if os.path.isfile(name) else _cached_tokenizer_file(name)
+        if path is None and _hub_offline():
+            raise FileNotFoundError('not in the local cache and HF_HUB_OFFLINE is set')
+        tokenizer = Tokenizer.from_file(path) if path else Tokenizer.from_pretrained(name)
+    except Exception as e:
+        logger.warning(f"Tokenizer {name} unavailable ({e}); estimating tokens as characters / {CHARS_PER_TOKEN}")
+        return None
+
+    # Counts must cover the whole text, not what the model would keep
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer
+
+
+def _hub_offline() -> bool:
+    # Read here rather than from huggingface_hub.constants, which are fixed at its
+    # import, before scripts have loaded .env
+    return os.getenv('HF_HUB_OFFLINE', '').upper() in ('1', 'ON', 'YES', 'TRUE')
+
+
+def _cached_tokenizer_file(model_id: str) -> Optional[str]:
+    try:
+        from huggingface_hub import try_to_load_from_cache
+    except ImportError:
+        return None
+    path = try_to_load_from_cache(model_id, 'tokenizer.json')
+    return path if isinstance(path, str) else None
+
+
+_counter: Optional[TokenCounter] = None
+_counter_lock = threading.Lock()
+
+
+def get_token_counter() -> TokenCounter:
+    """Get or create the shared token counter."""
+    global _counter
+    if _counter is None:
+        with _counter_lock:
+            if _counter is None:
+                _counter = TokenCounter(load_tokenizer())
+    return _counter
@@ -0,0 +1,271 @@
+"""
+Lease-Based Work Queue
+
+Hands out documents to backfill workers with leases instead of having every
+worker poll `SELECT ... WHERE status = 'pending' LIMIT n`, so several workers
+or hosts can share the corpus without processing a document twice.
+
+- claim(n) atomically moves up to n claimable documents to 'processing' under
+  this worker's lease, in a single UPDATE ... RETURNING statement.
+- Claimable means 'pending' (and 'error' if requested), or 'processing' with
+  an expired lease. The latter covers workers that crashed, and rows left in
+  'processing' before leases existed.
+- While a queue is open, a heartbeat thread extends the leases of everything
+  it still holds, every lease_seconds / 3.
+- close() hands unfinished documents back as 'pending'.
+
+Lease times come from the database clock, so hosts need not agree on the time.
+
+D1WorkQueue runs against the documents table in D1 and needs the lease columns
+from db/schema_work_queue.sql. SQLiteWorkQueue keeps the same table in a local
+file for testing the pipeline offline (e.g. with stub_api.py):
+    python work_queue.py --db data/work_queue.sqlite --add-dir /path/to/docs
+    python work_queue.py --db data/work_queue.sqlite          # Counts by status
+"""
+
+import os
+import uuid
+import sqlite3
+import calendar
+import argparse
+import threading
+import socket
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import logging
+
+from http_client import query_d1
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEASE_SECONDS = int(os.getenv('WORK_QUEUE_LEASE_SECONDS', '600'))
+DEFAULT_CLAIM_SIZE = int(os.getenv('WORK_QUEUE_CLAIM_SIZE', '100'))
+DEFAULT_QUEUE_DB = Path(os.getenv(
+    'WORK_QUEUE_DB',
+    str(Path(__file__).parent / 'data' / 'work_queue.sqlite')
+))
+
+DOCUMENT_COLUMNS = 'id, pmcid, pmid, study_id, filename, format, r2_key, status'
+
+# Database clock, in seconds
+NOW = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+# A lease that was never set (rows from before the lease columns) counts as expired
+EXPIRED = f"status = 'processing' AND COALESCE(lease_expires_at, 0) < {NOW}"
+
+CLAIM_SQL = f"""
+    UPDATE documents
+    SET status = 'processing', lease_owner = ?, lease_expires_at = {NOW} + ?
+    WHERE id IN (
+        SELECT id FROM documents
+        WHERE ({{claimable}}){{filters}}
+        ORDER BY id
+        LIMIT ?
+    )
+    RETURNING {DOCUMENT_COLUMNS}
+"""
+
+HEARTBEAT_SQL = f"""
+    UPDATE documents SET lease_expires_at = {NOW} + ?
+    WHERE lease_owner = ? AND status = 'processing'
+"""
+
+RELEASE_SQL = """
+    UPDATE documents SET status = 'pending', lease_owner = NULL, lease_expires_at = NULL
+    WHERE lease_owner = ? AND status = 'processing'
+"""
+
+RECLAIM_SQL = f"""
+    UPDATE documents SET status = 'pending', lease_owner = NULL, lease_expires_at = NULL
+    WHERE {EXPIRED}
+    RETURNING id
+"""
+
+
+def pub_date_range(year: int, month: Optional[int] = None) -> Tuple[str, str]:
+    """First and last pub_date (YYYY-MM-DD) of a year or of one month."""
+    if month:
+        month_str = str(month).zfill(2)
+        last_day = calendar.monthrange(year, month)[1]
+        return f"{year}-{month_str}-01", f"{year}-{month_str}-{last_day}"
+    return f"{year}-01-01", f"{year}-12-31"
+
+
+class WorkQueue:
+    """Lease-based claims on the documents table. Subclasses say where the table lives."""
+
+    def __init__(self, lease_seconds: int = DEFAULT_LEASE_SECONDS, owner: Optional[str] = None):
+        self.lease_seconds = lease_seconds
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.claimed = 0
+        self.claims = 0
+        self._stop = threading.Event()
+        self._heartbeat: Optional[threading.Thread] = None
+
+    def _execute(self, sql: str, params: List, idempotent: bool = True) -> List[Dict]:
+        """Run a statement. Non-idempotent ones (claims, finishes) must not be retried blindly."""
+        raise NotImplementedError
+
+    @staticmethod
+    def _selection(year: Optional[int], month: Optional[int], include_errors: bool) -> Tuple[str, str, List]:
+        claimable = f"status = 'pending' OR ({EXPIRED})"
+        if include_errors:
+            claimable += " OR status = 'error'"
+        filters, params = '', []
+        if year:
+            filters = " AND study_id IN (SELECT id FROM studies WHERE pub_date >= ? AND pub_date <= ?)"
+            params.extend(pub_date_range(year, month))
+        return claimable, filters, params
+
+    def claim(self, limit: int, year: Optional[int] = None, month: Optional[int] = None,
+              include_errors: bool = False) -> List[Dict]:
+        """Lease up to `limit` documents to this worker. Returns their rows, ordered by id."""
+        claimable, filters, params = self._selection(year, month, include_errors)
+        sql = CLAIM_SQL.format(claimable=claimable, filters=filters)
+        rows = self._execute(sql, [self.owner, self.lease_seconds] + params + [limit], idempotent=False)
+        rows.sort(key=lambda row: row['id'])
+
+        self.claims += 1
+        self.claimed += len(rows)
+        if rows and self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, name='lease-heartbeat', daemon=True)
+            self._heartbeat.start()
+        return rows
+
+    def peek(self, limit: int, year: Optional[int] = None, month: Optional[int] = None,
+             include_errors: bool = False) -> List[Dict]:
+        """The documents claim() would return, without leasing them (for --dry-run). limit=-1 means all."""
+        claimable, filters, params = self._selection(year, month, include_errors)
+        sql = f"SELECT {DOCUMENT_COLUMNS} FROM documents WHERE ({claimable}){filters} ORDER BY id LIMIT ?"
+        return self._execute(sql, params + [limit])
+
+    def heartbeat(self):
+        """Extend the leases of every document this worker still holds."""
+        self._execute(HEARTBEAT_SQL, [self.lease_seconds, self.owner])
+
+    def finish(self, doc_id: str, status: str):
+        """A claimed document reached 'ready' or 'error'. The status itself is written by the caller."""
+
+    def reclaim_expired(self) -> List[Dict]:
+        """Return documents with expired leases to 'pending' (claim() also takes them directly)."""
+        return self._execute(RECLAIM_SQL, [])
+
+    def _heartbeat_loop(self):
+        interval = max(1.0, self.lease_seconds / 3)
+        while not self._stop.wait(interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                # The lease has two more intervals before it expires
+                logger.warning(f"Lease heartbeat failed: {e}")
+
+    def close(self):
+        """Stop the heartbeat and hand documents still in 'processing' under this lease back as 'pending'."""
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+        try:
+            self._execute(RELEASE_SQL, [self.owner])
+        except Exception as e:
+            logger.warning(f"Could not release leases (they expire in {self.lease_seconds}s): {e}")
+
+
+class D1WorkQueue(WorkQueue):
+    """Work queue on the documents table in D1."""
+
+    def _execute(self, sql: str, params: List, idempotent: bool = True) -> List[Dict]:
+        return query_d1(sql, params, endpoint='d1' if idempotent else 'd1_lease').get('results', [])
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """Work queue on a local SQLite copy of the documents table, for offline testing."""
+
+    def __init__(self, path: Path = DEFAULT_QUEUE_DB, **kwargs):
+        super().__init__(**kwargs)
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                pmcid TEXT,
+                pmid TEXT,
+                study_id INTEGER,
+                filename TEXT NOT NULL,
+                format TEXT NOT NULL,
+                r2_key TEXT NOT NULL,
+                status TEXT DEFAULT 'pending',
+                lease_owner TEXT,
+                lease_expires_at INTEGER
+            )
+        """)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS studies (id INTEGER PRIMARY KEY, pub_date TEXT)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_documents_status ON documents(status)')
+        self._conn.commit()
+
+    def _execute(self, sql: str, params: List, idempotent: bool = True) -> List[Dict]:
+        with self._lock:
+            rows = [dict(row) for row in self._conn.execute(sql, params)]
+            self._conn.commit()
+        return rows
+
+    def finish(self, doc_id: str, status: str):
+        # Offline there is no API writing statuses into this table, so record them here
+        self._execute(
+            'UPDATE documents SET status = ?, lease_owner = NULL, lease_expires_at = NULL '
+            'WHERE id = ? AND lease_owner = ?',
+            [status, doc_id, self.owner],
+            idempotent=False
+        )
+
+    def add_documents(self, rows: List[Dict]) -> int:
+        """Insert pending documents (dicts with at least id, filename, format, r2_key); existing ids are kept."""
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO documents (id, pmcid, pmid, study_id, filename, format, r2_key) '
+                'VALUES (:id, :pmcid, :pmid, :study_id, :filename, :format, :r2_key)',
+                [{'pmcid': None, 'pmid': None, 'study_id': None, **row} for row in rows]
+            )
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    def counts(self) -> Dict[str, int]:
+        return {row['status']: row['count'] for row in self._execute(
+            'SELECT status, COUNT(*) AS count FROM documents GROUP BY status', []
+        )}
+
+    def close(self):
+        super().close()
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or fill a local SQLite work queue')
+    parser.add_argument('--db', type=Path, default=DEFAULT_QUEUE_DB, help=f'Queue file (default: {DEFAULT_QUEUE_DB})')
+    parser.add_argument('--add-dir', type=Path,
+                        help='Add every {id}.pdf / {id}.tgz in this directory as a pending document')
+    parser.add_argument('--reclaim', action='store_true', help="Return expired leases to 'pending'")
+    args = parser.parse_args()
+
+    queue = SQLiteWorkQueue(args.db)
+    if args.add_dir:
+        rows = [
+            {'id': path.stem, 'filename': path.name, 'format': 'xml' if path.suffix == '.tgz' else 'pdf',
+             'r2_key': path.name}
+            for path in sorted(args.add_dir.iterdir()) if path.suffix in ('.pdf', '.tgz')
+        ]
+        print(f"✓ Added {queue.add_documents(rows)} documents")
+    if args.reclaim:
+        print(f"✓ Reclaimed {len(queue.reclaim_expired())} expired leases")
+    print(f"{queue.path}: " + ', '.join(f"{status} {count}" for status, count in sorted(queue.counts().items())))
+    queue.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,25 +2,26 @@
 XML Text Extraction Module
 
 Extracts text from PMC Open Access XML files (JATS/NLM format).
-These come as .tgz archives containing .nxml files.
+These come as .tgz archives containing .nxml files. Articles are parsed
+incrementally with iterparse (see iter_jats_sections).
 """
 
-import tarfile
-import tempfile
-import re
 import os
-from pathlib import Path
-from typing import Dict, List, Optional
+import tarfile
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, Iterator, List, Optional, Union
 from xml.etree import ElementTree as ET
 import logging
 
+from segmentation import WHITESPACE
+
 logger = logging.getLogger(__name__)
 
 
 def clean_text(text: str) -> str:
     """Clean extracted text."""
     # Remove excessive whitespace
-    text = re.sub(r'\s+', ' ', text)
+    text = WHITESPACE.sub(' ', text)
     return text.strip()
 
 
@@ -42,15 +43,11 @@ def extract_element_text(element: Optional[ET.Element]) -> str:
             # Include the text but not the reference details
             if child.text:
                 text_parts.append(child.text)
-            if child.tail:
-                text_parts.append(child.tail)
         elif child.tag in ('fig', 'table-wrap', 'supplementary-material'):
             # Skip figures/tables inline but get caption
             caption = child.find('.//caption')
             if caption is not None:
                 text_parts.append(extract_element_text(caption))
-            if child.tail:
-                text_parts.append(child.tail)
         else:
             text_parts.append(extract_element_text(child))
         
@@ -60,10 +57,132 @@ def extract_element_text(element: Optional[ET.Element]) -> str:
     return ''.join(text_parts)
 
 
-def parse_jats_xml(xml_path: str) -> Optional[Dict]:
+@dataclass
+class JatsSection:
+    """A run of paragraphs from one section of an article, as yielded by iter_jats_sections()."""
+    heading_path: List[str]  # Titles of the enclosing sections, outermost first ('' if untitled)
+    paragraphs: List[str]  # Cleaned paragraph texts
+
+
+def iter_jats_sections(xml_file: Union[str, BinaryIO], metadata: Optional[Dict] = None) -> Iterator[JatsSection]:
+    """
+    Stream the abstract and body of a JATS/NLM article, in document order.
+    
+    Built on iterparse: every paragraph is read once, when its closing tag is
+    reached, and emitted under the innermost section containing it. Paragraphs
+    are removed from the tree as soon as they are read, so memory stays flat
+    however long the article is. A section's own paragraphs are emitted before
+    its subsections; any that follow the subsections come as a second run with
+    the same heading path. Paragraphs directly in the body have an empty path,
+    and the abstract is one paragraph under ['Abstract'].
+    
+    Article metadata (title, authors) is stored into `metadata` when given.
+    Parsing stops at the end of the body, so back matter such as the
+    reference list is never read.
+    """
+    open_elements: List[ET.Element] = []
+    # [title, paragraphs] for the body and each section open inside it
+    open_sections: List[list] = []
+    in_body = False
+    seen_abstract = seen_meta = False
+    paragraph_depth = 0
+    body_paragraphs = 0
+    
+    def flush() -> Iterator[JatsSection]:
+        title, paragraphs = open_sections[-1]
+        if paragraphs:
+            yield JatsSection([title for title, _ in open_sections[1:]], paragraphs)
+            open_sections[-1][1] = []
+    
+    for event, elem in ET.iterparse(xml_file, events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            open_elements.append(elem)
+            if tag == 'p':
+                paragraph_depth += 1
+            elif tag == 'body' and not in_body:
+                in_body = True
+                open_sections.append([None, []])
+            elif tag == 'sec' and in_body and not paragraph_depth:
+                yield from flush()
+                open_sections.append(['', []])
+            continue
+        
+        open_elements.pop()
+        parent = open_elements[-1] if open_elements else None
+        if tag == 'p':
+            paragraph_depth -= 1
+            # Nested paragraphs (e.g. in an inline figure caption) are part of the outer one
+            if in_body and not paragraph_depth:
+                text = clean_text(extract_element_text(elem))
+                if text:
+                    open_sections[-1][1].append(text)
+                    body_paragraphs += 1
+                parent.remove(elem)
+        elif not in_body:
+            if tag == 'abstract' and not seen_abstract:
+                seen_abstract = True
+                text = clean_text(extract_element_text(elem))
+                if text:
+                    yield JatsSection(['Abstract'], [text])
+                elem.clear()
+            elif tag == 'article-meta' and not seen_meta:
+                seen_meta = True
+                if metadata is not None:
+                    metadata.update(_article_metadata(elem))
+                elem.clear()
+        elif paragraph_depth:
+            continue
+        elif tag == 'title' and parent is not None and parent.tag == 'sec':
+            open_sections[-1][0] = clean_text(extract_element_text(elem))
+        elif tag == 'sec':
+            yield from flush()
+            open_sections.pop()
+            # Without any paragraphs the body is kept whole for the fallback below
+            if body_paragraphs:
+                parent.remove(elem)
+        elif tag == 'body':
+            yield from flush()
+            if not body_paragraphs:
+                # Unstructured body: take all of its text
+                text = clean_text(extract_element_text(elem))
+                if text:
+                    yield JatsSection([], [text])
+            return
+
+
+def _article_metadata(article_meta: ET.Element) -> Dict:
+    metadata = {}
+    title_group = article_meta.find('.//title-group/article-title')
+    if title_group is not None:
+        metadata['title'] = extract_element_text(title_group)
+    
+    # Get authors
+    authors = []
+    for contrib in article_meta.findall('.//contrib[@contrib-type="author"]'):
+        name = contrib.find('.//name')
+        if name is not None:
+            surname = name.find('surname')
+            given = name.find('given-names')
+            if surname is not None:
+                author_name = surname.text or ''
+                if given is not None and given.text:
+                    author_name = f"{given.text} {author_name}"
+                authors.append(author_name)
+    metadata['authors'] = ', '.join(authors)
+    return metadata
+
+
+def parse_jats_xml(xml_file: Union[str, BinaryIO], label: Optional[str] = None) -> Optional[Dict]:
     """
     Parse a JATS/NLM XML file and extract text with structure.
     
+    `xml_file` is a path or a binary file object (e.g. an archive member);
+    `label` names it in log messages and defaults to the path. Each section
+    from iter_jats_sections() becomes its paragraphs, preceded by the titles
+    (in capitals) of the sections entered since the previous one, and is
+    followed by a simulated page break.
+    
     Returns:
         {
             'text': str,           # Full extracted text
@@ -72,82 +191,26 @@ def parse_jats_xml(xml_path: str) -> Optional[Dict]:
             'metadata': Dict       # Article metadata
         }
     """
+    label = label or str(xml_file)
     try:
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-        
-        # Handle namespace if present
-        ns = {}
-        if root.tag.startswith('{'):
-            ns_end = root.tag.find('}')
-            ns['ns'] = root.tag[1:ns_end]
-        
         sections = []
         current_position = 0
         page_breaks = []
-        
-        # Extract article metadata
-        article_meta = root.find('.//article-meta')
         metadata = {}
-        if article_meta is not None:
-            title_group = article_meta.find('.//title-group/article-title')
-            if title_group is not None:
-                metadata['title'] = extract_element_text(title_group)
-            
-            # Get authors
-            authors = []
-            for contrib in article_meta.findall('.//contrib[@contrib-type="author"]'):
-                name = contrib.find('.//name')
-                if name is not None:
-                    surname = name.find('surname')
-                    given = name.find('given-names')
-                    if surname is not None:
-                        author_name = surname.text or ''
-                        if given is not None and given.text:
-                            author_name = f"{given.text} {author_name}"
-                        authors.append(author_name)
-            metadata['authors'] = ', '.join(authors)
-        
-        # Extract abstract
-        abstract = root.find('.//abstract')
-        if abstract is not None:
-            abstract_text = extract_element_text(abstract)
-            if abstract_text:
-                sections.append("ABSTRACT\n\n" + clean_text(abstract_text))
-                current_position += len(sections[-1]) + 2
-                page_breaks.append(current_position)
-        
-        # Extract body sections
-        body = root.find('.//body')
-        if body is not None:
-            for sec in body.findall('.//sec'):
-                # Get section title
-                title = sec.find('title')
-                section_title = extract_element_text(title) if title is not None else ""
-                
-                # Get section content (paragraphs)
-                paragraphs = []
-                for p in sec.findall('.//p'):
-                    p_text = extract_element_text(p)
-                    if p_text:
-                        paragraphs.append(clean_text(p_text))
-                
-                if paragraphs:
-                    section_text = ""
-                    if section_title:
-                        section_text = section_title.upper() + "\n\n"
-                    section_text += "\n\n".join(paragraphs)
-                    sections.append(section_text)
-                    current_position += len(section_text) + 2
-                    page_breaks.append(current_position)
+        previous_path: List[str] = []
         
-        # If no structured sections found, try to get all text from body
-        if not sections and body is not None:
-            body_text = extract_element_text(body)
-            if body_text:
-                sections.append(clean_text(body_text))
-                current_position += len(sections[-1]) + 2
-                page_breaks.append(current_position)
+        for section in iter_jats_sections(xml_file, metadata):
+            # Titles shared with the previous section were already written
+            path = section.heading_path
+            shared = 0
+            while shared < min(len(path), len(previous_path)) and path[shared] == previous_path[shared]:
+                shared += 1
+            previous_path = path
+            headings = [title.upper() for title in path[shared:] if title]
+            section_text = "\n\n".join(headings + section.paragraphs)
+            sections.append(section_text)
+            current_position += len(section_text) + 2
+            page_breaks.append(current_position)
         
         combined_text = '\n\n'.join(sections)
         
@@ -164,10 +227,10 @@ def parse_jats_xml(xml_path: str) -> Optional[Dict]:
         }
         
     except ET.ParseError as e:
-        logger.error(f"XML parse error in {xml_path}: {e}")
+        logger.error(f"XML parse error in {label}: {e}")
         return None
     except Exception as e:
-        logger.exception(f"Error parsing XML {xml_path}: {e}")
+        logger.exception(f"Error parsing XML {label}: {e}")
         return None
 
 
@@ -180,25 +243,23 @@ def extract_text_from_xml(tgz_path: str) -> Optional[Dict]:
     - Various image files
     
     Returns same structure as extract_text_from_pdf() for compatibility.
+    
+    The archive is read as a stream and the XML is parsed straight from its
+    member, so nothing is written to disk. Images stored before the XML are
+    decompressed only to be skipped over, and reading stops once the XML has
+    been parsed.
     """
     try:
-        with tempfile.TemporaryDirectory() as tmpdir:
-            # Extract the tgz archive
-            with tarfile.open(tgz_path, 'r:gz') as tar:
-                tar.extractall(tmpdir)
-            
-            # Find the .nxml file
-            nxml_files = list(Path(tmpdir).rglob('*.nxml'))
-            
-            if not nxml_files:
-                logger.error(f"No .nxml file found in {tgz_path}")
-                return None
-            
-            # Use the first (usually only) nxml file
-            nxml_path = nxml_files[0]
-            logger.info(f"Found XML file: {nxml_path.name}")
-            
-            return parse_jats_xml(str(nxml_path))
+        with tarfile.open(tgz_path, 'r|gz') as tar:
+            for member in tar:
+                # Use the first (usually only) nxml file
+                if not (member.isfile() and member.name.endswith('.nxml')):
+                    continue
+                logger.info(f"Found XML file: {os.path.basename(member.name)}")
+                return parse_jats_xml(tar.extractfile(member), label=f"{tgz_path}:{member.name}")
+        
+        logger.error(f"No .nxml file found in {tgz_path}")
+        return None
             
     except tarfile.TarError as e:
         logger.error(f"Error extracting tar archive {tgz_path}: {e}")
@@ -0,0 +1,108 @@
+// ==========================================
+// Binary chunk batch frames (POST /api/chunks/batch)
+// ==========================================
+//
+// Compact alternative to the JSON body, produced by rag-processing/chunk_payload.py.
+// Layout (little-endian):
+//   0  magic "LLCB" | 4 version (1) | 5 dtype (1 = float32, 2 = float16)
+//   6  compression (0 = none, 1 = gzip) | 7 reserved
+//   8  header length (u32) | 12 vector block length (u32)
+//   16 body: JSON header + raw vector block (gzip-compressed as a whole if compression = 1)
+// The header is { documentId, dimension, chunks: [...] } with the JSON chunk
+// fields minus `embedding`; row i of the vector block belongs to chunk i.
+
+import type { BatchChunkRequest } from './rag-types';
+
+export const CHUNK_FRAME_CONTENT_TYPE = 'application/vnd.leukemialens.chunk-batch';
+
+const FRAME_MAGIC = [0x4c, 0x4c, 0x43, 0x42]; // "LLCB"
+const FRAME_VERSION = 1;
+const PREAMBLE_SIZE = 16;
+const DTYPE_FLOAT32 = 1;
+const DTYPE_FLOAT16 = 2;
+const COMPRESSION_NONE = 0;
+const COMPRESSION_GZIP = 1;
+
+interface ChunkFrameHeader {
+    documentId: string;
+    dimension: number;
+    chunks: Array<Omit<BatchChunkRequest['chunks'][number], 'embedding'>>;
+}
+
+function halfToFloat(bits: number): number {
+    const sign = bits & 0x8000 ? -1 : 1;
+    const exponent = (bits >> 10) & 0x1f;
+    const fraction = bits & 0x03ff;
+
+    if (exponent === 0) {
+        return sign * Math.pow(2, -14) * (fraction / 1024);
+    }
+    if (exponent === 0x1f) {
+        return fraction ? NaN : sign * Infinity;
+    }
+    return sign * Math.pow(2, exponent - 15) * (1 + fraction / 1024);
+}
+
+export async function decodeChunkFrame(buffer: ArrayBuffer): Promise<BatchChunkRequest> {
+    if (buffer.byteLength < PREAMBLE_SIZE) {
+        throw new Error('Chunk batch frame is truncated');
+    }
+
+    const preamble = new DataView(buffer, 0, PREAMBLE_SIZE);
+    if (FRAME_MAGIC.some((byte, i) => preamble.getUint8(i) !== byte)) {
+        throw new Error('Not a chunk batch frame');
+    }
+
+    const version = preamble.getUint8(4);
+    const dtype = preamble.getUint8(5);
+    const compression = preamble.getUint8(6);
+    const headerLength = preamble.getUint32(8, true);
+    const vectorsLength = preamble.getUint32(12, true);
+
+    if (version !== FRAME_VERSION) {
+        throw new Error(`Unsupported chunk batch frame version: ${version}`);
+    }
+    if (dtype !== DTYPE_FLOAT32 && dtype !== DTYPE_FLOAT16) {
+        throw new Error(`Unsupported vector dtype code: ${dtype}`);
+    }
+
+    // slice() copies into a fresh, 0-aligned buffer so typed-array views line up
+    let body = buffer.slice(PREAMBLE_SIZE);
+    if (compression === COMPRESSION_GZIP) {
+        const stream = new Response(body).body!.pipeThrough(new DecompressionStream('gzip'));
+        body = await new Response(stream).arrayBuffer();
+    } else if (compression !== COMPRESSION_NONE) {
+        throw new Error(`Unsupported compression: ${compression}`);
+    }
+
+    if (body.byteLength !== headerLength + vectorsLength) {
+        throw new Error(`Frame body is ${body.byteLength} bytes, expected ${headerLength + vectorsLength}`);
+    }
+
+    const header = JSON.parse(
+        new TextDecoder().decode(new Uint8Array(body, 0, headerLength))
+    ) as ChunkFrameHeader;
+    const { dimension, chunks } = header;
+    const itemSize = dtype === DTYPE_FLOAT32 ? 4 : 2;
+
+    if (vectorsLength !== chunks.length * dimension * itemSize) {
+        throw new Error(`Vector block is ${vectorsLength} bytes, expected ${chunks.length} x ${dimension} x ${itemSize}`);
+    }
+
+    const values = dtype === DTYPE_FLOAT32
+        ? new Float32Array(body, headerLength, chunks.length * dimension)
+        : new Uint16Array(body, headerLength, chunks.length * dimension);
+
+    return {
+        documentId: header.documentId,
+        chunks: chunks.map((chunk, i) => {
+            const row = values.subarray(i * dimension, (i + 1) * dimension);
+            return {
+                ...chunk,
+                embedding: dtype === DTYPE_FLOAT32
+                    ? Array.from(row)
+                    : Array.from(row, halfToFloat)
+            };
+        })
+    };
+}
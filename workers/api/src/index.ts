@@ -15,6 +15,7 @@ import type {
     RAGQueryRequest,
     RAGQueryResponse
 } from './rag-types';
+import { CHUNK_FRAME_CONTENT_TYPE, decodeChunkFrame } from './chunk-frame';
 
 type Bindings = {
     DB: D1Database;
@@ -2066,7 +2067,11 @@ app.get('/api/documents/:id/chunks', async (c) => {
 // Batch create chunks with embeddings
 app.post('/api/chunks/batch', async (c) => {
     try {
-        const body = await c.req.json<BatchChunkRequest>();
+        // Accept either the JSON body or the compact binary frame (see chunk-frame.ts)
+        const contentType = c.req.header('Content-Type') || '';
+        const body = contentType.startsWith(CHUNK_FRAME_CONTENT_TYPE)
+            ? await decodeChunkFrame(await c.req.arrayBuffer())
+            : await c.req.json<BatchChunkRequest>();
 
         if (!body.documentId || !body.chunks || body.chunks.length === 0) {
             return c.json<BatchChunkResponse>({